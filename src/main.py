@@ -10,45 +10,204 @@
 """
 AI笔记整理工具 - 主程序
 将凌乱的笔记转换为结构化的Markdown格式
+
+不带参数时启动图形界面，也可以使用命令行模式:
+    python main.py watch <文件夹>...    监视文件夹并自动转换新增或修改的文件
+    python main.py serve [--port 8000]  启动本地HTTP服务，以接口方式提供转换功能
+    python main.py cluster enqueue|worker|status --queue <队列文件>
+                                        分布式批处理：协调端写入任务，多台机器上的工作进程领取处理
 """
 
 import sys
-import os
-import json
-from pathlib import Path
-from PySide6.QtWidgets import QApplication
-from ui.main_window import MainWindow
+import argparse
+import threading
 
 
 def load_config():
-    """加载配置文件"""
+    """加载配置
+    
+    Returns:
+        Settings: 设置快照(只读)，文件不存在或读取失败时为空
+    """
+    from utils.settings_service import get_settings
+    return get_settings()
+
+
+def create_processor(settings, model_id=None, all_models=False, **router_options):
+    """根据配置创建命令行模式使用的AI处理器
+    Args:
+        settings: 配置内容
+        model_id: 使用的模型ID，为None时使用第一个模型
+        all_models: 是否在所有模型之间负载均衡
+        router_options: 传给ModelRouter的其他参数
+    """
+    from models.ai_processor import get_processor, get_router
+    
+    models_info = settings.get("MODELS") or {}
+    if not models_info:
+        # 旧版单模型配置，直接使用设置中的CUSTOM_*项
+        return get_processor()
+    
+    if all_models:
+        return get_router(models_info, **router_options)
+    
+    if model_id is None:
+        model_id = next(iter(models_info))
+    if model_id not in models_info:
+        raise ValueError(f"未找到模型: {model_id}，可用模型: {', '.join(models_info)}")
+    return get_router({model_id: models_info[model_id]}, **router_options)
+
+
+def default_format_options(settings, args=None):
+    """命令行模式使用的格式选项"""
+    return {
+        'header_level': getattr(args, "header_level", None) or 1,
+        'list_style': getattr(args, "list_style", None) or "unordered",
+        'code_language': getattr(args, "code_language", None) or "text",
+        'prompt_template': settings.get("PROMPT_TEMPLATE") or "请将以下笔记内容转换为Markdown格式:\n\n"
+    }
+
+
+def _add_model_arguments(parser):
+    """添加模型和格式相关的通用命令行参数"""
+    parser.add_argument("--model", help="使用的模型ID(settings.json中MODELS的键)，默认使用第一个模型")
+    parser.add_argument("--all-models", action="store_true", help="在所有已配置的模型之间负载均衡")
+    parser.add_argument("--header-level", type=int, choices=range(1, 7), help="标题级别")
+    parser.add_argument("--list-style", choices=["unordered", "ordered"], help="列表样式")
+    parser.add_argument("--code-language", help="代码块默认语言")
+
+
+def run_watch(args):
+    """监视模式"""
+    from utils.watch_service import WatchService
+    
+    settings = load_config()
+    processor = create_processor(settings, args.model, args.all_models)
+    service = WatchService(
+        args.folders,
+        processor,
+        default_format_options(settings, args),
+        workers=args.workers,
+        queue_size=args.queue_size,
+        debounce=args.debounce,
+        poll_interval=args.poll_interval,
+        use_native=not args.poll,
+        dedup_distance=args.dedup_distance if args.dedup else None,
+        docx_mode=args.docx_mode
+    )
+    service.run_forever(process_existing=not args.new_only)
+
+
+def run_serve(args):
+    """本地HTTP服务模式"""
+    from utils.api_server import ConversionService, start_api_server
+    
+    settings = load_config()
+    processor = create_processor(settings, args.model, args.all_models)
+    service = ConversionService(
+        processor,
+        default_format_options(settings, args),
+        workers=args.workers,
+        max_queue=args.max_queue,
+        cache_size=args.cache_size,
+        allowed_roots=args.allow_dir
+    )
+    server = start_api_server(service, args.host, args.port)
+    host, port = server.server_address[:2]
+    print(f"服务已启动: http://{host}:{port} (按 Ctrl+C 停止)")
+    
     try:
-        # 获取项目根目录
-        current_dir = Path(__file__).resolve().parent
-        project_root = current_dir.parent
-        
-        # 设置文件路径
-        config_file = project_root / "settings.json"
-        
-        # 检查文件是否存在
-        if not config_file.exists():
-            return
-        
-        # 读取设置
-        with open(config_file, 'r', encoding='utf-8') as f:
-            settings = json.load(f)
-        
-        # 设置环境变量
-        for key, value in settings.items():
-            if value:  # 只设置非空值
-                os.environ[key] = value
-                
-    except Exception as e:
-        print(f"加载配置文件时出错: {e}")
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        print("正在停止服务...")
+    finally:
+        server.shutdown()
+        service.shutdown()
 
 
-def main():
-    """主函数入口"""
+def run_cluster_enqueue(args):
+    """分布式模式：扫描文件夹并写入共享任务队列"""
+    from utils.work_queue import WorkQueue, scan_folder_tasks
+    
+    settings = load_config()
+    work_queue = WorkQueue(args.queue)
+    work_queue.set_format_options(default_format_options(settings, args))
+    
+    count = 0
+    for folder in args.folders:
+        count += work_queue.enqueue(scan_folder_tasks(folder))
+    print(f"已添加或更新 {count} 个任务，当前队列: {work_queue.summary()}")
+    work_queue.close()
+
+
+def _run_cluster_worker_process(options):
+    """分布式模式的单个工作进程，使用模块级函数以便在多进程模式下启动"""
+    from utils.work_queue import WorkQueue, DistributedWorker
+    
+    settings = load_config()
+    processor = create_processor(settings, options["model"], options["all_models"])
+    work_queue = WorkQueue(options["queue"], lease_seconds=options["lease"], max_attempts=options["max_attempts"])
+    worker = DistributedWorker(
+        work_queue,
+        processor,
+        threads=options["threads"],
+        exit_when_idle=options["exit_when_idle"],
+        poll_interval=options["poll_interval"]
+    )
+    worker.run()
+    work_queue.close()
+
+
+def run_cluster_worker(args):
+    """分布式模式：启动一个或多个工作进程"""
+    import multiprocessing
+    
+    options = {
+        "queue": args.queue,
+        "model": args.model,
+        "all_models": args.all_models,
+        "lease": args.lease,
+        "max_attempts": args.max_attempts,
+        "threads": args.threads,
+        "exit_when_idle": args.exit_when_idle,
+        "poll_interval": args.poll_interval
+    }
+    if args.processes <= 1:
+        _run_cluster_worker_process(options)
+        return
+    
+    processes = [
+        multiprocessing.Process(target=_run_cluster_worker_process, args=(options,))
+        for _ in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.join()
+
+
+def run_cluster_status(args):
+    """分布式模式：查看队列状态"""
+    from utils.work_queue import WorkQueue
+    
+    work_queue = WorkQueue(args.queue)
+    if args.retry_failed:
+        print(f"已将 {work_queue.retry_failed()} 个失败任务放回队列")
+    print(f"队列状态: {work_queue.summary()}")
+    for item in work_queue.failed_items():
+        print(f"  失败: {item['path']} (尝试{item['attempts']}次, {item['worker']}): {item['error']}")
+    work_queue.close()
+
+
+def run_gui():
+    """启动图形界面"""
+    from PySide6.QtWidgets import QApplication
+    from ui.main_window import MainWindow
+    
     # 加载配置
     load_config()
     
@@ -61,5 +220,70 @@ def main():
     sys.exit(app.exec())
 
 
+def main():
+    """主函数入口"""
+    parser = argparse.ArgumentParser(description="AI笔记整理工具，不带参数时启动图形界面")
+    subparsers = parser.add_subparsers(dest="command")
+    
+    # 监视模式
+    watch_parser = subparsers.add_parser("watch", help="监视文件夹，自动转换新增或修改的文件")
+    watch_parser.add_argument("folders", nargs="+", help="要监视的文件夹")
+    watch_parser.add_argument("--workers", type=int, default=2, help="工作线程数")
+    watch_parser.add_argument("--queue-size", type=int, default=100, help="待处理队列的最大长度")
+    watch_parser.add_argument("--debounce", type=float, default=2.0, help="文件停止变化多少秒后开始处理")
+    watch_parser.add_argument("--poll", action="store_true", help="强制使用轮询方式监视")
+    watch_parser.add_argument("--poll-interval", type=float, default=1.0, help="轮询间隔(秒)")
+    watch_parser.add_argument("--new-only", action="store_true", help="只处理启动后新增或修改的文件")
+    watch_parser.add_argument("--dedup", action="store_true", help="重复图片只OCR一次(逐像素比较确认内容相同后复用识别结果)")
+    watch_parser.add_argument("--dedup-distance", type=int, default=10, help="作为去重候选的感知哈希汉明距离阈值(0-256)")
+    watch_parser.add_argument("--docx-mode", choices=["auto", "llm", "local"], default="auto",
+                              help="Word文档处理方式: auto=结构清晰的文档直接转换, llm=始终使用AI, local=仅本地转换")
+    _add_model_arguments(watch_parser)
+    watch_parser.set_defaults(func=run_watch)
+    
+    # HTTP服务模式
+    serve_parser = subparsers.add_parser("serve", help="启动本地HTTP服务，以接口方式提供转换功能")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="监听地址")
+    serve_parser.add_argument("--port", type=int, default=8000, help="监听端口")
+    serve_parser.add_argument("--workers", type=int, default=2, help="工作线程数")
+    serve_parser.add_argument("--max-queue", type=int, default=16, help="最多排队的请求数，超出时返回503")
+    serve_parser.add_argument("--cache-size", type=int, default=256, help="OCR和AI结果缓存的最大条目数")
+    serve_parser.add_argument("--allow-dir", action="append", help="允许通过路径访问的目录，可重复指定，默认不限制")
+    _add_model_arguments(serve_parser)
+    serve_parser.set_defaults(func=run_serve)
+    
+    # 分布式模式
+    cluster_parser = subparsers.add_parser("cluster", help="分布式批处理，多台机器通过共享任务队列协同转换")
+    cluster_subparsers = cluster_parser.add_subparsers(dest="cluster_command", required=True)
+    
+    enqueue_parser = cluster_subparsers.add_parser("enqueue", help="扫描文件夹并写入任务队列")
+    enqueue_parser.add_argument("folders", nargs="+", help="要转换的文件夹，所有工作机器需以相同路径访问")
+    enqueue_parser.add_argument("--queue", required=True, help="任务队列文件(放在共享存储上)")
+    _add_model_arguments(enqueue_parser)
+    enqueue_parser.set_defaults(func=run_cluster_enqueue)
+    
+    worker_parser = cluster_subparsers.add_parser("worker", help="启动工作进程领取并处理任务")
+    worker_parser.add_argument("--queue", required=True, help="任务队列文件")
+    worker_parser.add_argument("--processes", type=int, default=1, help="本机启动的工作进程数")
+    worker_parser.add_argument("--threads", type=int, default=1, help="每个工作进程的处理线程数")
+    worker_parser.add_argument("--lease", type=float, default=300.0, help="任务租约时长(秒)，超时未续租的任务会被重新领取")
+    worker_parser.add_argument("--max-attempts", type=int, default=3, help="每个任务最多尝试的次数")
+    worker_parser.add_argument("--poll-interval", type=float, default=2.0, help="没有任务时的等待间隔(秒)")
+    worker_parser.add_argument("--exit-when-idle", action="store_true", help="队列处理完毕后退出")
+    _add_model_arguments(worker_parser)
+    worker_parser.set_defaults(func=run_cluster_worker)
+    
+    status_parser = cluster_subparsers.add_parser("status", help="查看队列状态")
+    status_parser.add_argument("--queue", required=True, help="任务队列文件")
+    status_parser.add_argument("--retry-failed", action="store_true", help="将失败的任务重新放回队列")
+    status_parser.set_defaults(func=run_cluster_status)
+    
+    args = parser.parse_args()
+    if args.command is None:
+        run_gui()
+    else:
+        args.func(args)
+
+
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
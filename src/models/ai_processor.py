@@ -13,12 +13,19 @@ AI处理模块
 """
 
 from abc import ABC, abstractmethod
-import os
+import time
+import queue
+import threading
+from collections import deque
 import openai
 import json
 from datetime import datetime
 from pathlib import Path
 
+from utils.settings_service import get_settings
+from utils.adaptive_limiter import get_limiter, get_limiter_registry, is_throttle_error
+
+
 class AIProcessor(ABC):
     """AI处理器抽象基类"""
     
@@ -31,18 +38,56 @@ def get_processor(api_key=None, base_url=None):
     """获取自定义处理器实例"""
     return CustomProcessor(api_key=api_key, base_url=base_url)
 
+def get_router(models_info, **kwargs):
+    """根据模型配置字典获取多模型路由器实例"""
+    return ModelRouter(models_info, **kwargs)
+
 class CustomProcessor(AIProcessor):
     """自定义模型处理器"""
     
-    def __init__(self, api_key=None, base_url=None):
+    def __init__(self, api_key=None, base_url=None, timeout=None, max_retries=None):
         """初始化自定义处理器
         Args:
             api_key: 模型API密钥
             base_url: 模型API基础地址
+            timeout: 单次请求超时时间(秒)，为None时使用openai默认值
+            max_retries: openai客户端自动重试的次数，为None时使用openai默认值
         """
-        self.base_url = base_url or os.environ.get("CUSTOM_BASE_URL")
-        self.api_key = api_key or os.environ.get("CUSTOM_API_KEY")
-        self.model_name = os.environ.get("CUSTOM_MODEL", "gpt-3.5-turbo")
+        # 未指定时使用设置中的默认模型
+        default_model = get_settings().default_model
+        self.base_url = base_url or default_model.get("base_url")
+        self.api_key = api_key or default_model.get("api_key")
+        self.model_name = default_model.get("name") or "gpt-3.5-turbo"
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self._client = None
+        self._client_key = None
+        
+        # token用量统计(含服务端前缀缓存命中的token数)
+        self._usage_lock = threading.Lock()
+        self.usage_stats = {
+            "requests": 0,
+            "prompt_tokens": 0,
+            "cached_tokens": 0,
+            "completion_tokens": 0
+        }
+    
+    def _get_client(self):
+        """获取(并缓存)当前配置对应的OpenAI客户端
+        
+        每个处理器持有独立客户端，避免多线程并发时互相覆盖openai全局配置；
+        重试次数也是客户端配置的一部分，修改后重新创建客户端
+        """
+        client_key = (self.api_key, self.base_url, self.timeout, self.max_retries)
+        if self._client is None or self._client_key != client_key:
+            kwargs = {"api_key": self.api_key, "base_url": self.base_url}
+            if self.timeout:
+                kwargs["timeout"] = self.timeout
+            if self.max_retries is not None:
+                kwargs["max_retries"] = self.max_retries
+            self._client = openai.OpenAI(**kwargs)
+            self._client_key = client_key
+        return self._client
         
     def test_connection(self, prompt: str = "你好，你是谁") -> tuple:
         """测试自定义模型连接并进行完整功能验证
@@ -54,11 +99,9 @@ class CustomProcessor(AIProcessor):
                    - 成功时返回 (response_text, success_message)
                    - 失败时返回 (False, error_message)
         """
-        openai.api_key = self.api_key
-        openai.base_url= self.base_url
         try:
             # 执行测试请求
-            completion =openai.chat.completions.create(
+            completion = self._get_client().chat.completions.create(
                 model= str(self.model_name),
                 messages= [
                 {
@@ -116,37 +159,741 @@ class CustomProcessor(AIProcessor):
         except Exception as e:
             print(f"缓存配置时出错: {e}")
     
-    def process_note(self, note_content, format_options=None):
-        """使用自定义模型处理笔记"""
-        # 举个例子
-        prompt_template = format_options.pop('prompt_template', "请将以下笔记内容转换为Markdown格式:\n\n") if format_options else "请将以下笔记内容转换为Markdown格式:\n\n"
-        prompt = self._build_prompt(note_content, format_options, prompt_template)
+    def process_note(self, note_content, format_options=None, on_first_token=None, cancel_token=None,
+                     on_delta=None):
+        """使用自定义模型处理笔记
+        Args:
+            note_content: 笔记内容
+            format_options: 格式选项
+            on_first_token: 收到首个token时的回调，提供时使用流式请求
+            cancel_token: 取消令牌(CancelToken)，提供时使用流式请求并支持中途取消
+            on_delta: 收到增量文本时的回调，参数为新增的文本，提供时使用流式请求
+        """
+        messages = self._prepare_messages(note_content, format_options)
+        
+        if on_first_token or cancel_token or on_delta:
+            return self._process_streaming(messages, on_first_token, cancel_token, on_delta)
+        
         # 利用自定义api调用
-        openai.api_key = self.api_key
-        openai.base_url= self.base_url
-        completion =openai.chat.completions.create(
+        completion = self._get_client().chat.completions.create(
             model= str(self.model_name),
-            messages= [
-            {
-                "role":"user",
-                "content": str(prompt)
-            }
-            ],
+            messages= messages,
             stream=False  # 添加此行以确保不使用流式传输
         )
+        self._record_usage(completion.usage)
         
         # 验证响应结构
         answer = completion.choices[0].message.content
+        if not answer:
+            raise EmptyResponseError("模型返回了空结果")
         return answer
     
-    def _build_prompt(self, note_content, format_options, prompt_template="请将以下笔记内容转换为Markdown格式:\n\n"):
-        """构建处理提示"""
-        prompt = prompt_template
-        prompt += note_content + "\n\n"
+    def _process_streaming(self, messages, on_first_token=None, cancel_token=None, on_delta=None):
+        """以流式方式请求模型，用于检测首个token到达时间、中途取消和增量输出"""
+        if cancel_token and cancel_token.cancelled:
+            raise RequestCancelledError("请求已被取消")
+        
+        stream = self._get_client().chat.completions.create(
+            model=str(self.model_name),
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        if cancel_token:
+            cancel_token.attach(stream)
+        
+        parts = []
+        first_token_seen = False
+        try:
+            for chunk in stream:
+                # 用量信息在最后一个(choices为空的)数据块中返回
+                if getattr(chunk, "usage", None):
+                    self._record_usage(chunk.usage)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                # 推理模型会先输出reasoning_content，同样视为首个token
+                if not first_token_seen and (delta.content or getattr(delta, "reasoning_content", None)):
+                    first_token_seen = True
+                    if on_first_token:
+                        on_first_token()
+                if delta.content:
+                    parts.append(delta.content)
+                    if on_delta:
+                        on_delta(delta.content)
+        except Exception:
+            if cancel_token and cancel_token.cancelled:
+                raise RequestCancelledError("请求已被取消")
+            raise
+        
+        if cancel_token and cancel_token.cancelled:
+            raise RequestCancelledError("请求已被取消")
+        if not parts:
+            # 空结果不能作为成功返回，否则路由、对冲和任务日志会把空笔记记为已完成
+            raise EmptyResponseError("模型的流式响应中没有内容")
+        return "".join(parts)
+    
+    def build_messages(self, note_content, format_options=None):
+        """构建发送给模型的消息列表(不修改传入的格式选项)"""
+        return self._prepare_messages(note_content, dict(format_options) if format_options else None)
+    
+    def _prepare_messages(self, note_content, format_options=None):
+        """从格式选项中取出提示词模板并构建消息列表"""
+        # 举个例子
+        prompt_template = format_options.pop('prompt_template', "请将以下笔记内容转换为Markdown格式:\n\n") if format_options else "请将以下笔记内容转换为Markdown格式:\n\n"
+        return self._build_messages(note_content, format_options, prompt_template)
+    
+    def _record_usage(self, usage):
+        """记录一次请求的token用量
+        
+        兼容OpenAI的prompt_tokens_details.cached_tokens和DeepSeek的prompt_cache_hit_tokens
+        """
+        if not usage:
+            return
+        if not isinstance(usage, dict):
+            usage = usage.model_dump() if hasattr(usage, "model_dump") else vars(usage)
+        
+        details = usage.get("prompt_tokens_details") or {}
+        cached_tokens = details.get("cached_tokens") or usage.get("prompt_cache_hit_tokens") or 0
+        
+        with self._usage_lock:
+            self.usage_stats["requests"] += 1
+            self.usage_stats["prompt_tokens"] += usage.get("prompt_tokens") or 0
+            self.usage_stats["cached_tokens"] += cached_tokens
+            self.usage_stats["completion_tokens"] += usage.get("completion_tokens") or 0
+    
+    def build_batch_request(self, custom_id, note_content, format_options=None):
+        """构建批处理任务中的单条请求(JSONL中的一行)"""
+        messages = self._prepare_messages(note_content, dict(format_options) if format_options else None)
+        return {
+            "custom_id": str(custom_id),
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": str(self.model_name),
+                "messages": messages
+            }
+        }
+    
+    def submit_batch(self, batch_requests):
+        """将请求序列化为JSONL并提交异步批处理任务
+        Args:
+            batch_requests: build_batch_request生成的请求列表
+            
+        Returns:
+            str: 批处理任务ID
+        """
+        lines = [json.dumps(request, ensure_ascii=False) for request in batch_requests]
+        jsonl_data = ("\n".join(lines) + "\n").encode("utf-8")
+        
+        client = self._get_client()
+        input_file = client.files.create(file=("batch_input.jsonl", jsonl_data), purpose="batch")
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        return batch.id
+    
+    def wait_batch(self, batch_id, poll_interval=30.0, timeout=None, on_status=None, cancel_token=None):
+        """轮询等待批处理任务结束
+        Args:
+            batch_id: 批处理任务ID
+            poll_interval: 轮询间隔(秒)
+            timeout: 最长等待时间(秒)，为None时一直等待
+            on_status: 状态回调，参数为batch对象
+            cancel_token: 取消令牌，取消后停止等待(不会取消服务端任务)
+            
+        Returns:
+            batch对象
+        """
+        start = time.monotonic()
+        client = self._get_client()
+        while True:
+            batch = client.batches.retrieve(batch_id)
+            if on_status:
+                on_status(batch)
+            
+            if batch.status in BATCH_FINAL_STATUSES:
+                return batch
+            if cancel_token and cancel_token.cancelled:
+                raise RequestCancelledError(f"已停止等待批处理任务 {batch_id}")
+            if timeout is not None and time.monotonic() - start > timeout:
+                raise TimeoutError(f"批处理任务 {batch_id} 等待超时")
+            
+            # 分段等待，便于及时响应取消
+            deadline = time.monotonic() + poll_interval
+            while time.monotonic() < deadline:
+                if cancel_token and cancel_token.cancelled:
+                    break
+                time.sleep(min(0.5, poll_interval))
+    
+    def fetch_batch_results(self, batch):
+        """下载批处理结果
+        
+        Returns:
+            dict: {custom_id: 结果文本}，失败的请求对应值为Exception
+        """
+        client = self._get_client()
+        results = {}
+        
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            content = client.files.content(file_id).text
+            for line in content.splitlines():
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                custom_id = item.get("custom_id")
+                response = item.get("response") or {}
+                body = response.get("body") or {}
+                
+                if item.get("error") or response.get("status_code", 200) != 200:
+                    error = item.get("error") or body.get("error") or f"状态码 {response.get('status_code')}"
+                    results[custom_id] = Exception(f"批处理请求失败: {error}")
+                else:
+                    self._record_usage(body.get("usage"))
+                    results[custom_id] = body["choices"][0]["message"]["content"]
+        
+        return results
+    
+    def process_notes_batch(self, notes, format_options=None, poll_interval=30.0, on_status=None, cancel_token=None):
+        """以异步批处理模式处理多条笔记
+        Args:
+            notes: {custom_id: 笔记内容}
+            format_options: 格式选项
+            poll_interval: 轮询间隔(秒)
+            on_status: 状态回调，参数为batch对象
+            cancel_token: 取消令牌
+            
+        Returns:
+            dict: {custom_id: 结果文本或Exception}
+        """
+        batch_requests = [
+            self.build_batch_request(custom_id, content, format_options)
+            for custom_id, content in notes.items()
+        ]
+        batch_id = self.submit_batch(batch_requests)
+        return self.collect_batch(
+            batch_id, notes, poll_interval=poll_interval, on_status=on_status, cancel_token=cancel_token
+        )
+    
+    def collect_batch(self, batch_id, custom_ids, poll_interval=30.0, on_status=None, cancel_token=None):
+        """等待已提交的批处理任务结束并下载结果，也用于继续之前取消等待的任务
+        Args:
+            batch_id: 批处理任务ID
+            custom_ids: 任务中各请求的custom_id
+            poll_interval: 轮询间隔(秒)
+            on_status: 状态回调，参数为batch对象
+            cancel_token: 取消令牌，取消后停止等待并抛出RequestCancelledError(服务端任务继续执行)
+            
+        Returns:
+            dict: {custom_id: 结果文本或Exception}
+        """
+        batch = self.wait_batch(batch_id, poll_interval=poll_interval, on_status=on_status, cancel_token=cancel_token)
+        
+        if batch.status != "completed":
+            raise BatchJobError(f"批处理任务 {batch_id} 未完成，状态: {batch.status}")
+        
+        results = self.fetch_batch_results(batch)
+        for custom_id in custom_ids:
+            results.setdefault(str(custom_id), Exception("批处理结果中缺少该请求"))
+        return results
+    
+    def _build_instructions(self, format_options, prompt_template="请将以下笔记内容转换为Markdown格式:\n\n"):
+        """构建与笔记内容无关的指令部分(提示词模板+格式要求)
+        
+        同一批次中该部分完全相同，放在消息最前面可以被服务端作为公共前缀缓存
+        """
+        instructions = prompt_template.rstrip() + "\n"
         
         if format_options:
-            prompt += "请遵循以下格式要求:\n"
+            instructions += "\n请遵循以下格式要求:\n"
             for key, value in format_options.items():
-                prompt += f"- {key}: {value}\n"
+                instructions += f"- {key}: {value}\n"
+        
+        instructions += "\n笔记内容将在下一条消息中给出，请直接输出转换后的Markdown。"
+        return instructions
+    
+    def _build_messages(self, note_content, format_options, prompt_template="请将以下笔记内容转换为Markdown格式:\n\n"):
+        """构建处理消息：固定的指令消息在前，每条笔记不同的内容在后"""
+        return [
+            {
+                "role": "system",
+                "content": self._build_instructions(format_options, prompt_template)
+            },
+            {
+                "role": "user",
+                "content": str(note_content)
+            }
+        ]
+
+
+# 批处理任务的最终状态
+BATCH_FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+class BatchJobError(Exception):
+    """异步批处理任务错误"""
+    pass
+
+
+class ModelRouterError(Exception):
+    """多模型路由错误（所有模型均调用失败）"""
+    pass
+
+
+class RequestCancelledError(Exception):
+    """请求被取消（例如对冲请求中落后的一方）"""
+    pass
+
+
+class EmptyResponseError(Exception):
+    """模型没有返回任何内容（如流式响应中没有内容增量）"""
+    pass
+
+
+class CancelToken:
+    """请求取消令牌
+    
+    取消时会关闭已建立的流式响应，使阻塞在读取上的工作线程尽快退出
+    """
+    
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._stream = None
+    
+    @property
+    def cancelled(self):
+        """是否已取消"""
+        return self._event.is_set()
+    
+    def attach(self, stream):
+        """关联流式响应对象，若已取消则立即关闭"""
+        with self._lock:
+            self._stream = stream
+        if self.cancelled:
+            self._close_stream()
+    
+    def cancel(self):
+        """取消请求"""
+        self._event.set()
+        self._close_stream()
+    
+    def _close_stream(self):
+        with self._lock:
+            stream = self._stream
+        if stream is not None:
+            try:
+                stream.close()
+            except Exception:
+                pass
+
+
+def llm_limiter_key(model_info):
+    """模型接口在自适应并发控制中的标识：同一服务地址上的同一模型共用一个限流器"""
+    return f"llm:{model_info.get('base_url', '')}:{model_info.get('name', '')}"
+
+
+def learned_concurrency(model_info):
+    """模型当前(或上次批处理学到)的并发数，没有记录时为初始并发数"""
+    max_concurrency = max(1, int(model_info.get("max_concurrency", 1) or 1))
+    limit = get_limiter_registry().saved_limit(llm_limiter_key(model_info), _initial_concurrency(max_concurrency))
+    return max(1, min(max_concurrency, int(limit)))
+
+
+def _initial_concurrency(max_concurrency):
+    """没有历史记录时从并发上限的一半开始"""
+    return max(1, max_concurrency // 2)
+
+
+class ModelEndpoint:
+    """模型路由中的单个端点，对应settings.json中MODELS的一项"""
+    
+    def __init__(self, model_id, model_info):
+        """初始化模型端点
+        Args:
+            model_id: 模型ID
+            model_info: 模型配置字典，除name/base_url/api_key外支持以下可选项:
+                weight: 权重，默认1
+                max_concurrency: 最大并发请求数，默认1；实际并发数在此范围内按限流和响应耗时自动调整
+                timeout: 单次请求超时时间(秒)，默认120
+        """
+        self.model_id = model_id
+        self.display_name = model_info.get("display_name") or model_info.get("name", model_id)
+        self.weight = max(1, int(model_info.get("weight", 1) or 1))
+        self.max_concurrency = max(1, int(model_info.get("max_concurrency", 1) or 1))
+        self.timeout = float(model_info.get("timeout", 120) or 120)
+        # 自适应并发：遇到限流、超时或首token耗时突增时降低，正常时逐步提高，学到的并发数在多次运行之间保留
+        self.limiter = get_limiter(
+            llm_limiter_key(model_info),
+            initial=_initial_concurrency(self.max_concurrency),
+            max_limit=self.max_concurrency
+        )
+        
+        # 限流由路由器处理(降低并发后重试)，客户端不再自行重试，否则限流对自适应并发不可见
+        self.processor = CustomProcessor(
+            api_key=model_info.get("api_key", ""),
+            base_url=model_info.get("base_url", ""),
+            timeout=self.timeout,
+            max_retries=0
+        )
+        self.processor.model_name = model_info.get("name", "")
+        
+        # 运行状态
+        self.in_flight = 0
+        self.success_count = 0
+        self.failure_count = 0
+        self.consecutive_failures = 0
+        self.unhealthy_until = 0.0
+        self.avg_latency = None
+        self.avg_ttft = None
+        self.total_latency = 0.0
+    
+    def is_healthy(self, now):
+        """端点是否处于健康状态（未在熔断冷却期内）"""
+        return now >= self.unhealthy_until
+    
+    def has_capacity(self):
+        """端点是否还有空闲并发额度(按自适应的并发上限)"""
+        return self.limiter.has_capacity(self.in_flight)
+    
+    def load(self):
+        """按权重归一化后的负载，用于加权最少连接选择"""
+        return (self.in_flight + 1) / self.weight
+
+
+class ModelRouter(AIProcessor):
+    """多模型路由器
+    
+    将并发请求按权重分发到多个已配置的模型端点上，支持每个端点的并发上限、
+    健康状态跟踪(连续失败熔断)以及在出错或响应过慢时切换到其他端点。
+    
+    开启请求对冲(hedge_percentile)后，若请求在历史首token耗时的指定分位数内
+    仍未收到首个token，会向其他模型(没有其他模型时为同一模型)发送一个副本请求，
+    先完成者胜出，另一个请求被取消
+    """
+    
+    def __init__(self, models_info, failure_threshold=3, cooldown=30.0, slow_factor=3.0,
+                 hedge_percentile=None, hedge_initial_delay=20.0, hedge_min_samples=5, throttle_retries=5):
+        """初始化路由器
+        Args:
+            models_info: 模型配置字典 {model_id: model_info}
+            failure_threshold: 连续失败多少次后熔断该端点
+            cooldown: 熔断冷却时间(秒)
+            slow_factor: 首token耗时超过平均首token耗时的倍数时视为慢响应，计入失败
+            throttle_retries: 单个请求被限流后在同一端点上重试的最多次数
+            hedge_percentile: 触发对冲请求的首token耗时分位数(如95)，为None时不对冲
+            hedge_initial_delay: 样本不足时使用的对冲等待时间(秒)
+            hedge_min_samples: 使用分位数前至少需要的首token耗时样本数
+        """
+        self.endpoints = [
+            ModelEndpoint(model_id, model_info)
+            for model_id, model_info in models_info.items()
+            if model_info.get("base_url")
+        ]
+        if not self.endpoints:
+            raise ModelRouterError("没有可用的模型配置，请先在设置中添加模型")
         
-        return prompt
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.slow_factor = slow_factor
+        self.throttle_retries = throttle_retries
+        self._condition = threading.Condition()
+        
+        # 请求对冲配置
+        self.hedge_percentile = hedge_percentile
+        self.hedge_initial_delay = hedge_initial_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_count = 0
+        self.hedge_win_count = 0
+        self._ttft_samples = deque(maxlen=500)
+    
+    def total_capacity(self):
+        """所有端点并发上限之和，可作为批量处理的工作线程数"""
+        return sum(endpoint.max_concurrency for endpoint in self.endpoints)
+    
+    def _acquire(self, exclude):
+        """选择并占用一个端点，所有端点都满载时阻塞等待
+        
+        优先选择健康且有空闲额度的端点(加权最少连接)；
+        若未尝试的端点全部处于熔断期，则选择最早恢复的端点进行试探
+        """
+        with self._condition:
+            while True:
+                candidates = [e for e in self.endpoints if e.model_id not in exclude]
+                if not candidates:
+                    return None
+                
+                now = time.monotonic()
+                healthy = [e for e in candidates if e.is_healthy(now)]
+                pool = healthy or [min(candidates, key=lambda e: e.unhealthy_until)]
+                available = [e for e in pool if e.has_capacity()]
+                
+                if available:
+                    endpoint = min(available, key=lambda e: e.load())
+                    endpoint.in_flight += 1
+                    return endpoint
+                
+                self._condition.wait(timeout=1.0)
+    
+    def _acquire_hedge(self, tried):
+        """为对冲请求选择端点(不阻塞)
+        
+        优先选择其他健康的端点；对冲请求本身很少，允许超出端点的并发上限，
+        没有其他端点时复用已尝试过的端点
+        """
+        with self._condition:
+            now = time.monotonic()
+            healthy = [e for e in self.endpoints if e.is_healthy(now)]
+            untried = [e for e in healthy if e.model_id not in tried]
+            pool = (
+                [e for e in untried if e.has_capacity()]
+                or untried
+                or healthy
+            )
+            if not pool:
+                return None
+            endpoint = min(pool, key=lambda e: e.load())
+            endpoint.in_flight += 1
+            return endpoint
+    
+    def _release(self, endpoint, latency=None, error=None, cancelled=False, started=None, ttft=None):
+        """释放端点并更新其健康状态和自适应并发上限
+        Args:
+            endpoint: 端点
+            latency: 请求总耗时(秒)，成功时提供
+            error: 请求失败时的异常
+            cancelled: 请求是否被取消
+            started: 请求开始的时间
+            ttft: 首token耗时(秒)；总耗时随输出长度变化，过载只按首token耗时判断
+        """
+        with self._condition:
+            if not cancelled:
+                endpoint.limiter.record(
+                    started, ttft, error, saturated=not endpoint.limiter.has_capacity(endpoint.in_flight)
+                )
+            endpoint.in_flight -= 1
+            
+            if cancelled:
+                # 被取消的请求不计入端点的健康统计
+                pass
+            elif error is None:
+                # 首token明显慢于该端点的历史平均值时视为降级；总耗时随输出长度变化，长笔记不算慢响应
+                slow = (
+                    ttft is not None
+                    and endpoint.avg_ttft is not None
+                    and ttft > endpoint.avg_ttft * self.slow_factor
+                )
+                if ttft is not None and not slow:
+                    # 慢响应不计入平均值，持续变慢时才能连续判定并熔断
+                    endpoint.avg_ttft = ttft if endpoint.avg_ttft is None else endpoint.avg_ttft * 0.8 + ttft * 0.2
+                if endpoint.avg_latency is None:
+                    endpoint.avg_latency = latency
+                else:
+                    endpoint.avg_latency = endpoint.avg_latency * 0.8 + latency * 0.2
+                endpoint.success_count += 1
+                endpoint.total_latency += latency
+                endpoint.consecutive_failures = endpoint.consecutive_failures + 1 if slow else 0
+            elif is_throttle_error(error):
+                # 限流说明端点可用只是并发过高，已由自适应并发降低上限，不计入熔断
+                endpoint.failure_count += 1
+            else:
+                endpoint.failure_count += 1
+                endpoint.consecutive_failures += 1
+            
+            if endpoint.consecutive_failures >= self.failure_threshold:
+                endpoint.unhealthy_until = time.monotonic() + self.cooldown
+                endpoint.consecutive_failures = 0
+            
+            self._condition.notify_all()
+    
+    def process_note(self, note_content, format_options=None, on_delta=None):
+        """通过路由选择模型处理笔记，失败时自动切换到其他模型
+        Args:
+            note_content: 笔记内容
+            format_options: 格式选项
+            on_delta: 增量文本回调。切换模型重试时会以None调用一次，表示之前输出的增量应丢弃；
+                      启用请求对冲时不输出增量
+        """
+        if self.hedge_percentile:
+            return self._process_hedged(note_content, format_options)
+        
+        tried = set()
+        last_error = None
+        throttle_retries = self.throttle_retries
+        
+        while True:
+            endpoint = self._acquire(tried)
+            if endpoint is None:
+                break
+            tried.add(endpoint.model_id)
+            
+            start = time.monotonic()
+            first_token = {}
+            
+            def on_first_token():
+                first_token["ttft"] = time.monotonic() - start
+            
+            try:
+                # process_note会弹出prompt_template，每次尝试使用独立副本；
+                # 使用流式请求以获得与输出长度无关的首token耗时
+                options = dict(format_options) if format_options else None
+                result = endpoint.processor.process_note(
+                    note_content, options, on_first_token=on_first_token, on_delta=on_delta
+                )
+            except Exception as e:
+                last_error = e
+                self._release(endpoint, error=e, started=start)
+                if on_delta:
+                    on_delta(None)
+                if throttle_retries > 0 and is_throttle_error(e):
+                    # 被限流时等降低后的并发额度空出后在同一端点重试
+                    throttle_retries -= 1
+                    tried.discard(endpoint.model_id)
+                continue
+            
+            self._release(
+                endpoint, latency=time.monotonic() - start, started=start, ttft=first_token.get("ttft")
+            )
+            return result
+        
+        raise ModelRouterError(f"所有模型均调用失败: {last_error}")
+    
+    def hedge_delay(self):
+        """当前的对冲等待时间：历史首token耗时的指定分位数"""
+        with self._condition:
+            samples = sorted(self._ttft_samples)
+        if len(samples) < self.hedge_min_samples:
+            return self.hedge_initial_delay
+        index = min(len(samples) - 1, int(len(samples) * self.hedge_percentile / 100))
+        return samples[index]
+    
+    def _record_ttft(self, ttft):
+        """记录首token耗时样本"""
+        with self._condition:
+            self._ttft_samples.append(ttft)
+    
+    def _process_hedged(self, note_content, format_options=None):
+        """带请求对冲的处理流程"""
+        results = queue.Queue()
+        attempts = []
+        tried = set()
+        last_error = None
+        throttle_retries = self.throttle_retries
+        
+        def run(endpoint, cancel_token, first_token_event):
+            start = time.monotonic()
+            first_token = {}
+            
+            def on_first_token():
+                first_token["ttft"] = time.monotonic() - start
+                first_token_event.set()
+                self._record_ttft(first_token["ttft"])
+            
+            try:
+                options = dict(format_options) if format_options else None
+                result = endpoint.processor.process_note(
+                    note_content, options,
+                    on_first_token=on_first_token,
+                    cancel_token=cancel_token
+                )
+            except RequestCancelledError as e:
+                self._release(endpoint, cancelled=True)
+                results.put((cancel_token, "cancelled", e, endpoint))
+            except Exception as e:
+                self._release(endpoint, error=e, started=start)
+                results.put((cancel_token, "error", e, endpoint))
+            else:
+                self._release(
+                    endpoint, latency=time.monotonic() - start, started=start, ttft=first_token.get("ttft")
+                )
+                results.put((cancel_token, "ok", result, endpoint))
+        
+        def launch(endpoint):
+            tried.add(endpoint.model_id)
+            cancel_token = CancelToken()
+            first_token_event = threading.Event()
+            attempts.append((cancel_token, first_token_event))
+            threading.Thread(
+                target=run, args=(endpoint, cancel_token, first_token_event), daemon=True
+            ).start()
+            return cancel_token
+        
+        endpoint = self._acquire(tried)
+        if endpoint is None:
+            raise ModelRouterError("没有可用的模型")
+        primary = launch(endpoint)
+        running = 1
+        hedge_checked = False
+        
+        while running:
+            timeout = None if hedge_checked else self.hedge_delay()
+            try:
+                token, status, value, finished_endpoint = results.get(timeout=timeout)
+            except queue.Empty:
+                # 等待时间内所有请求都还没有收到首个token，发出对冲请求
+                hedge_checked = True
+                if not any(event.is_set() for _, event in attempts):
+                    hedge_endpoint = self._acquire_hedge(tried)
+                    if hedge_endpoint is not None:
+                        launch(hedge_endpoint)
+                        running += 1
+                        with self._condition:
+                            self.hedge_count += 1
+                continue
+            
+            running -= 1
+            if status == "ok":
+                # 先完成者胜出，取消其余请求
+                for other, _ in attempts:
+                    if other is not token:
+                        other.cancel()
+                if token is not primary:
+                    with self._condition:
+                        self.hedge_win_count += 1
+                return value
+            
+            if status == "error":
+                last_error = value
+                if throttle_retries > 0 and is_throttle_error(value):
+                    throttle_retries -= 1
+                    tried.discard(finished_endpoint.model_id)
+            
+            if running == 0:
+                # 所有在途请求都失败了，切换到尚未尝试的模型
+                endpoint = self._acquire(tried)
+                if endpoint is not None:
+                    attempts.clear()
+                    primary = launch(endpoint)
+                    running = 1
+                    hedge_checked = False
+        
+        raise ModelRouterError(f"所有模型均调用失败: {last_error}")
+    
+    def get_stats(self):
+        """获取各端点的运行统计"""
+        with self._condition:
+            now = time.monotonic()
+            return [
+                {
+                    "model_id": e.model_id,
+                    "display_name": e.display_name,
+                    "model_name": e.processor.model_name,
+                    "weight": e.weight,
+                    "max_concurrency": e.max_concurrency,
+                    "concurrency_limit": e.limiter.current(),
+                    "throttled": e.limiter.throttle_count,
+                    "in_flight": e.in_flight,
+                    "success": e.success_count,
+                    "failure": e.failure_count,
+                    "avg_latency": e.avg_latency,
+                    "avg_ttft": e.avg_ttft,
+                    "total_latency": e.total_latency,
+                    "healthy": e.is_healthy(now),
+                    "usage": dict(e.processor.usage_stats)
+                }
+                for e in self.endpoints
+            ]
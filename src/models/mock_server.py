@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@File    :   mock_server.py
+@Time    :   2025/04/03
+@Author  :   Maker 
+@Version :   1.0
+'''
+
+"""
+本地模拟模型服务
+实现OpenAI兼容的chat/completions(含stream=true时的SSE流式输出)、files和batches接口，
+用于在无网络、无密钥时测试CustomProcessor的实时模式、流式输出、请求对冲和离线批处理模式
+
+用法:
+    python -m models.mock_server --port 8765
+    然后将模型API地址设置为 http://127.0.0.1:8765/v1/
+"""
+
+import json
+import time
+import uuid
+import argparse
+import threading
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class MockState:
+    """模拟服务的内存状态"""
+    
+    def __init__(self, batch_delay=2.0, response_delay=0.0, max_concurrency=0):
+        """
+        Args:
+            batch_delay: 批处理任务从创建到完成的模拟耗时(秒)
+            response_delay: 实时请求的模拟耗时(秒)
+            max_concurrency: 同时处理的实时请求数上限，超出时返回429，0表示不限制
+        """
+        self.batch_delay = batch_delay
+        self.response_delay = response_delay
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.throttled_count = 0
+        self.files = {}
+        self.batches = {}
+        self.lock = threading.Lock()
+
+
+def mock_completion(body):
+    """根据请求体生成模拟的chat completion响应"""
+    messages = body.get("messages") or []
+    content = messages[-1].get("content", "") if messages else ""
+    if isinstance(content, list):
+        content = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    
+    answer = f"# 模拟输出\n\n{content}"
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "mock-model"),
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": answer},
+                "finish_reason": "stop"
+            }
+        ],
+        "usage": {
+            "prompt_tokens": len(content),
+            "completion_tokens": len(answer),
+            "total_tokens": len(content) + len(answer)
+        }
+    }
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """模拟服务请求处理器"""
+    
+    state = None
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def _send_json(self, data, status=200):
+        payload = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+    
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length) if length else b""
+    
+    def _path(self):
+        # 兼容 /v1/xxx 和 /xxx 两种写法
+        path = self.path.split("?", 1)[0].rstrip("/")
+        return path[3:] if path.startswith("/v1/") else path
+    
+    def do_GET(self):
+        path = self._path()
+        
+        if path.startswith("/batches/"):
+            batch = self._refresh_batch(path[len("/batches/"):])
+            if batch is None:
+                return self._send_json({"error": {"message": "batch not found"}}, 404)
+            return self._send_json(batch)
+        
+        if path.startswith("/files/") and path.endswith("/content"):
+            file_id = path[len("/files/"):-len("/content")]
+            with self.state.lock:
+                file_data = self.state.files.get(file_id)
+            if file_data is None:
+                return self._send_json({"error": {"message": "file not found"}}, 404)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(file_data["content"])))
+            self.end_headers()
+            self.wfile.write(file_data["content"])
+            return
+        
+        if path in ("", "/models"):
+            return self._send_json({"object": "list", "data": [{"id": "mock-model", "object": "model"}]})
+        
+        self._send_json({"error": {"message": "not found"}}, 404)
+    
+    def do_POST(self):
+        path = self._path()
+        body = self._read_body()
+        
+        if path == "/chat/completions":
+            return self._chat_completion(json.loads(body))
+        
+        if path == "/files":
+            return self._create_file(body)
+        
+        if path == "/batches":
+            return self._create_batch(json.loads(body))
+        
+        if path.startswith("/batches/") and path.endswith("/cancel"):
+            batch_id = path[len("/batches/"):-len("/cancel")]
+            with self.state.lock:
+                batch = self.state.batches.get(batch_id)
+                if batch is not None and batch["status"] not in ("completed", "failed", "expired"):
+                    batch["status"] = "cancelled"
+                    batch["cancelled_at"] = int(time.time())
+            if batch is None:
+                return self._send_json({"error": {"message": "batch not found"}}, 404)
+            return self._send_json(batch)
+        
+        self._send_json({"error": {"message": "not found"}}, 404)
+    
+    def _chat_completion(self, body):
+        """处理实时请求，超出并发上限时返回429"""
+        state = self.state
+        with state.lock:
+            if state.max_concurrency and state.in_flight >= state.max_concurrency:
+                state.throttled_count += 1
+                throttled = True
+            else:
+                state.in_flight += 1
+                throttled = False
+        if throttled:
+            return self._send_json(
+                {"error": {"message": "Rate limit reached, too many concurrent requests", "type": "rate_limit_error"}},
+                429
+            )
+        try:
+            if state.response_delay:
+                time.sleep(state.response_delay)
+            if body.get("stream"):
+                return self._send_stream(body)
+            return self._send_json(mock_completion(body))
+        finally:
+            with state.lock:
+                state.in_flight -= 1
+    
+    def _send_stream(self, body, chunk_size=16):
+        """以SSE方式逐块返回chat.completion.chunk，最后发送[DONE]"""
+        completion = mock_completion(body)
+        answer = completion["choices"][0]["message"]["content"]
+        base = {
+            "id": completion["id"],
+            "object": "chat.completion.chunk",
+            "created": completion["created"],
+            "model": completion["model"]
+        }
+        
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        
+        def send(data):
+            self.wfile.write(f"data: {data}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        
+        send(json.dumps(dict(base, choices=[
+            {"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}
+        ]), ensure_ascii=False))
+        for start in range(0, len(answer), chunk_size):
+            send(json.dumps(dict(base, choices=[
+                {"index": 0, "delta": {"content": answer[start:start + chunk_size]}, "finish_reason": None}
+            ]), ensure_ascii=False))
+        send(json.dumps(dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            send(json.dumps(dict(base, choices=[], usage=completion["usage"])))
+        send("[DONE]")
+        self.close_connection = True
+    
+    def _create_file(self, body):
+        """处理multipart/form-data文件上传"""
+        header = f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode("utf-8")
+        message = BytesParser(policy=default_policy).parsebytes(header + body)
+        
+        content = b""
+        filename = "upload.jsonl"
+        purpose = "batch"
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if name == "file":
+                content = part.get_payload(decode=True) or b""
+                filename = part.get_filename() or filename
+            elif name == "purpose":
+                purpose = part.get_content().strip()
+        
+        file_id = f"file-{uuid.uuid4().hex[:12]}"
+        file_object = {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed"
+        }
+        with self.state.lock:
+            self.state.files[file_id] = {"meta": file_object, "content": content}
+        self._send_json(file_object)
+    
+    def _create_batch(self, request):
+        """创建批处理任务"""
+        with self.state.lock:
+            if request.get("input_file_id") not in self.state.files:
+                return self._send_json({"error": {"message": "input file not found"}}, 400)
+            
+            batch_id = f"batch_{uuid.uuid4().hex[:12]}"
+            batch = {
+                "id": batch_id,
+                "object": "batch",
+                "endpoint": request.get("endpoint", "/v1/chat/completions"),
+                "input_file_id": request["input_file_id"],
+                "completion_window": request.get("completion_window", "24h"),
+                "status": "validating",
+                "created_at": int(time.time()),
+                "output_file_id": None,
+                "error_file_id": None,
+                "request_counts": {"total": 0, "completed": 0, "failed": 0}
+            }
+            self.state.batches[batch_id] = batch
+        self._send_json(batch)
+    
+    def _refresh_batch(self, batch_id):
+        """根据创建时间推进任务状态，到期后生成结果文件"""
+        with self.state.lock:
+            batch = self.state.batches.get(batch_id)
+            if batch is None or batch["status"] in ("completed", "failed", "expired", "cancelled"):
+                return batch
+            
+            elapsed = time.time() - batch["created_at"]
+            if elapsed < self.state.batch_delay:
+                batch["status"] = "in_progress"
+                return batch
+            
+            lines = self.state.files[batch["input_file_id"]]["content"].decode("utf-8").splitlines()
+            output_lines = []
+            for line in lines:
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                output_lines.append(json.dumps({
+                    "id": f"batch_req_{uuid.uuid4().hex[:12]}",
+                    "custom_id": request.get("custom_id"),
+                    "response": {"status_code": 200, "body": mock_completion(request.get("body") or {})},
+                    "error": None
+                }, ensure_ascii=False))
+            
+            output_id = f"file-{uuid.uuid4().hex[:12]}"
+            output_content = ("\n".join(output_lines) + "\n").encode("utf-8")
+            self.state.files[output_id] = {
+                "meta": {"id": output_id, "object": "file", "purpose": "batch_output"},
+                "content": output_content
+            }
+            
+            batch["status"] = "completed"
+            batch["completed_at"] = int(time.time())
+            batch["output_file_id"] = output_id
+            batch["request_counts"] = {"total": len(output_lines), "completed": len(output_lines), "failed": 0}
+            return batch
+
+
+def start_mock_server(host="127.0.0.1", port=0, batch_delay=2.0, response_delay=0.0, max_concurrency=0):
+    """在后台线程中启动模拟服务
+    
+    Returns:
+        ThreadingHTTPServer: 服务实例，server.server_address[1]为实际端口
+    """
+    handler = type("BoundMockHandler", (MockHandler,), {"state": MockState(batch_delay, response_delay, max_concurrency)})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="本地模拟OpenAI兼容模型服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--batch-delay", type=float, default=2.0, help="批处理任务模拟耗时(秒)")
+    parser.add_argument("--response-delay", type=float, default=0.0, help="实时请求模拟耗时(秒)")
+    parser.add_argument("--max-concurrency", type=int, default=0, help="同时处理的实时请求数上限，超出时返回429")
+    args = parser.parse_args()
+    
+    server = start_mock_server(args.host, args.port, args.batch_delay, args.response_delay, args.max_concurrency)
+    print(f"模拟模型服务已启动: http://{args.host}:{server.server_address[1]}/v1/")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@File    :   note_packer.py
+@Time    :   2025/04/03
+@Author  :   Maker
+@Version :   1.0
+'''
+
+"""
+小笔记合并请求
+批处理中大量笔记只有几行(截图OCR结果、一段话的txt)，每篇单独请求都要重复发送提示词并等待一次往返。
+NotePacker包装AI处理器：短笔记进入队列，发送线程从队列中取出格式选项相同的笔记，在token预算内合并为一个请求，
+每篇用带随机标记的分隔行包围，模型按同样的分隔行输出后再拆分回各篇；分隔行缺失或损坏的笔记单独重试
+"""
+
+import re
+import json
+import time
+import secrets
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from models.token_estimator import estimate_tokens
+from utils.adaptive_limiter import is_throttle_error
+
+
+# 默认的合并参数
+DEFAULT_TOKEN_BUDGET = 2000       # 每个合并请求中笔记内容的token上限
+DEFAULT_MAX_ITEMS = 8             # 每个合并请求最多包含的笔记数
+DEFAULT_SMALL_NOTE_TOKENS = 400   # 不超过该token数的笔记才参与合并
+DEFAULT_LINGER = 0.3              # 笔记数未满时，最早的笔记等待其他笔记加入的最长时间(秒)
+DEFAULT_WORKERS = 4               # 同时发送的合并请求数
+
+# 识别鉴权错误的关键字(HTTP 401/403、OpenAI AuthenticationError/PermissionDeniedError等)
+_AUTH_PATTERN = re.compile(r"\b40[13]\b|authentication|unauthorized|permission|invalid.?api.?key", re.IGNORECASE)
+
+
+def _begin_marker(index, tag):
+    return f"<<<NOTE {index} {tag}>>>"
+
+
+def _end_marker(index, tag):
+    return f"<<<END {index} {tag}>>>"
+
+
+def build_packed_instructions(count, tag):
+    """合并请求中说明分隔格式的文字
+
+    包含每个请求不同的随机标记和篇数，放在用户消息开头，系统消息(提示词模板)保持不变以便服务端缓存公共前缀
+    """
+    return (
+        f"以下包含 {count} 篇相互独立的笔记，第n篇以单独一行的 {_begin_marker('n', tag)} 开始、"
+        f"以单独一行的 {_end_marker('n', tag)} 结束(n从0开始)。\n"
+        f"请分别转换每一篇，按原来的顺序输出，每篇转换结果的前后保留与输入完全相同的分隔行，"
+        f"分隔行之外不要输出任何内容，也不要把不同笔记的内容合并。"
+    )
+
+
+def build_packed_content(notes, tag):
+    """将多篇笔记拼接为一条消息：开头说明分隔格式，每篇用分隔行包围
+
+    Args:
+        notes: 笔记内容列表
+        tag: 本次请求的随机标记，避免与笔记中的文字混淆
+    Returns:
+        str: 合并后的内容
+    """
+    parts = [build_packed_instructions(len(notes), tag)]
+    for index, note in enumerate(notes):
+        parts.append(f"{_begin_marker(index, tag)}\n{str(note).strip()}\n{_end_marker(index, tag)}")
+    return "\n\n".join(parts)
+
+
+def _is_auth_error(error):
+    """是否为密钥无效、无权限等鉴权错误"""
+    return bool(_AUTH_PATTERN.search(f"{type(error).__name__} {error}"))
+
+
+def split_packed_result(text, count, tag):
+    """按分隔行拆分模型的输出
+
+    Args:
+        text: 模型输出
+        count: 笔记篇数
+        tag: 请求的随机标记
+    Returns:
+        dict: {序号: 转换结果}，分隔行缺失、重复或内容为空的笔记不包含在内
+    """
+    pattern = re.compile(
+        rf"^[ \t]*<<<NOTE (\d+) {re.escape(tag)}>>>[ \t]*\n(.*?)\n[ \t]*<<<END \1 {re.escape(tag)}>>>[ \t]*$",
+        re.MULTILINE | re.DOTALL
+    )
+    found = {}
+    duplicated = set()
+    for match in pattern.finditer(text or ""):
+        index = int(match.group(1))
+        if index in found:
+            duplicated.add(index)
+        found[index] = match.group(2).strip()
+    return {
+        index: content for index, content in found.items()
+        if index < count and index not in duplicated and content and "<<<NOTE " not in content
+    }
+
+
+class _PackItem:
+    """等待合并发送的一篇笔记"""
+
+    def __init__(self, content, tokens):
+        self.content = content
+        self.tokens = tokens
+        self.queued_at = time.monotonic()
+        self.future = Future()
+
+
+class _Queue:
+    """一组格式选项相同、等待合并发送的笔记"""
+
+    def __init__(self, format_options):
+        self.format_options = format_options
+        self.items = deque()
+        self.tokens = 0
+
+
+class NotePacker:
+    """合并短笔记请求的AI处理器包装，接口与被包装的处理器(CustomProcessor或ModelRouter)相同
+
+    短笔记进入队列后不占用调用线程，由最多workers个发送线程从队列中取出笔记凑成合并请求：
+    发送线程都在忙时笔记在队列中积累，空闲后一次取走尽量多的笔记，调用方的线程数只需与模型的并发数相同
+    """
+
+    def __init__(self, processor, token_budget=DEFAULT_TOKEN_BUDGET, max_items=DEFAULT_MAX_ITEMS,
+                 small_note_tokens=DEFAULT_SMALL_NOTE_TOKENS, linger=DEFAULT_LINGER, workers=DEFAULT_WORKERS):
+        """
+        Args:
+            processor: 被包装的AI处理器
+            token_budget: 每个合并请求中笔记内容的token上限
+            max_items: 每个合并请求最多包含的笔记数
+            small_note_tokens: 不超过该token数的笔记才参与合并
+            linger: 笔记数未满时，最早的笔记等待其他笔记加入的最长时间(秒)
+            workers: 同时发送的合并请求数，通常为模型的并发上限
+        """
+        self.processor = processor
+        self.token_budget = token_budget
+        self.max_items = max(1, max_items)
+        self.small_note_tokens = small_note_tokens
+        self.linger = linger
+        self.workers = max(1, workers)
+        self._lock = threading.Lock()
+        self._queues = {}
+        self._sending = 0
+        self._timer = None
+        self._closed = False
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="note-packer")
+        self.stats = {
+            "direct": 0,          # 未参与合并、直接请求的笔记数
+            "packed_requests": 0, # 合并请求数
+            "packed_notes": 0,    # 通过合并请求完成的笔记数
+            "retried": 0,         # 合并请求失败或分隔行损坏后单独重试的笔记数
+        }
+
+    def process_note(self, note_content, format_options=None, on_delta=None):
+        """处理笔记：短笔记与其他笔记合并请求，其余直接交给被包装的处理器
+
+        Args:
+            note_content: 笔记内容
+            format_options: 格式选项
+            on_delta: 增量文本回调，提供时不参与合并
+        """
+        if on_delta is not None:
+            self._count("direct")
+            return self._process_single(note_content, format_options, on_delta)
+        return self.submit_note(note_content, format_options).result()
+
+    def submit_note(self, note_content, format_options=None):
+        """提交笔记，短笔记加入队列后立即返回，不等待合并请求完成
+
+        Args:
+            note_content: 笔记内容
+            format_options: 格式选项
+        Returns:
+            Future: 转换结果；不参与合并的笔记在调用线程中直接处理，返回时已完成
+        """
+        tokens = estimate_tokens(str(note_content))
+        if self.max_items < 2 or tokens > self.small_note_tokens:
+            self._count("direct")
+            future = Future()
+            try:
+                future.set_result(self._process_single(note_content, format_options))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        key = json.dumps(format_options or {}, sort_keys=True, ensure_ascii=False, default=str)
+        item = _PackItem(note_content, tokens)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("NotePacker已关闭")
+            queue = self._queues.get(key)
+            if queue is None:
+                queue = self._queues[key] = _Queue(dict(format_options) if format_options else None)
+            queue.items.append(item)
+            queue.tokens += tokens
+            self._dispatch()
+        return item.future
+
+    def _ready(self, queue, now):
+        """队列中的笔记是否已可以发送：凑满一个请求，或最早的笔记已等待linger秒"""
+        return (
+            len(queue.items) >= self.max_items
+            or queue.tokens >= self.token_budget
+            or now - queue.items[0].queued_at >= self.linger
+        )
+
+    def _dispatch(self):
+        """有空闲的发送线程时，从可以发送的队列中取出笔记发送(调用方持有锁)"""
+        now = time.monotonic()
+        while self._sending < self.workers:
+            ready = [(key, queue) for key, queue in self._queues.items() if self._ready(queue, now)]
+            if not ready:
+                break
+            # 优先发送等待最久的笔记
+            key, queue = min(ready, key=lambda entry: entry[1].items[0].queued_at)
+            items = self._take(queue)
+            if not queue.items:
+                del self._queues[key]
+            self._sending += 1
+            self._executor.submit(self._send, items, queue.format_options)
+
+        # 还有未凑满的笔记时，在最早的笔记等待超时后再次检查
+        if self._queues and self._timer is None and self._sending < self.workers:
+            oldest = min(queue.items[0].queued_at for queue in self._queues.values())
+            self._timer = threading.Timer(max(0.0, oldest + self.linger - now), self._on_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _take(self, queue):
+        """从队列头部取出不超过笔记数和token预算的笔记"""
+        items = []
+        tokens = 0
+        while queue.items and len(items) < self.max_items:
+            item = queue.items[0]
+            if items and tokens + item.tokens > self.token_budget:
+                break
+            items.append(queue.items.popleft())
+            tokens += item.tokens
+        queue.tokens -= tokens
+        return items
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+            self._dispatch()
+
+    def _send(self, items, format_options):
+        try:
+            self._process_pack(items, format_options)
+        finally:
+            with self._lock:
+                self._sending -= 1
+                self._dispatch()
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self.stats[name] += value
+
+    def _process_single(self, note_content, format_options=None, on_delta=None):
+        options = dict(format_options) if format_options else None
+        if on_delta is not None:
+            return self.processor.process_note(note_content, options, on_delta=on_delta)
+        return self.processor.process_note(note_content, options)
+
+    def _process_pack(self, items, format_options):
+        """发送合并请求并拆分结果，分隔行损坏的笔记单独重试"""
+        if len(items) == 1:
+            self._count("direct")
+            self._finish_single(items[0], format_options)
+            return
+
+        tag = secrets.token_hex(3)
+        options = dict(format_options) if format_options else None
+        try:
+            text = self.processor.process_note(build_packed_content([item.content for item in items], tag), options)
+        except Exception as e:
+            # 限流和鉴权错误逐篇重试也不会成功，其他错误(如合并后的请求超时)逐篇重试
+            if is_throttle_error(e) or _is_auth_error(e):
+                for item in items:
+                    item.future.set_exception(e)
+                return
+            for item in items:
+                self._count("retried")
+                self._finish_single(item, format_options)
+            return
+        self._count("packed_requests")
+
+        results = split_packed_result(text, len(items), tag)
+        damaged = []
+        for index, item in enumerate(items):
+            if index in results:
+                item.future.set_result(results[index])
+            else:
+                damaged.append(item)
+        self._count("packed_notes", len(items) - len(damaged))
+
+        # 其他笔记已经可以继续写出，再逐篇重试损坏的笔记
+        for item in damaged:
+            self._count("retried")
+            self._finish_single(item, format_options)
+
+    def _finish_single(self, item, format_options):
+        try:
+            item.future.set_result(self._process_single(item.content, format_options))
+        except Exception as e:
+            item.future.set_exception(e)
+
+    def close(self):
+        """停止发送线程：等待正在发送的请求完成，队列中尚未发送的笔记以异常结束"""
+        with self._lock:
+            self._closed = True
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            queued = [item for queue in self._queues.values() for item in queue.items]
+            self._queues.clear()
+        for item in queued:
+            item.future.set_exception(RuntimeError("NotePacker已关闭"))
+        self._executor.shutdown(wait=True)
+
+    def summary(self):
+        """合并效果的文字说明"""
+        with self._lock:
+            stats = dict(self.stats)
+        return (
+            f"小笔记合并: {stats['packed_notes']} 篇笔记通过 {stats['packed_requests']} 个合并请求完成，"
+            f"单独重试 {stats['retried']} 篇，直接请求 {stats['direct']} 篇"
+        )
+
+    def __getattr__(self, name):
+        # 其他属性(如get_stats、usage_stats)直接使用被包装的处理器
+        if name == "processor":
+            raise AttributeError(name)
+        return getattr(self.processor, name)
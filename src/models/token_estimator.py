@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@File    :   token_estimator.py
+@Time    :   2025/04/03
+@Author  :   Maker 
+@Version :   1.0
+'''
+
+"""
+批处理预估模块
+在批量处理开始前估算每个文件的token数，并根据历史吞吐量预测总token、费用和耗时，
+同时找出超出模型上下文长度的文件
+"""
+
+import os
+import re
+import json
+import time
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.file_handler import FileHandler
+
+
+# 中日韩字符(含全角标点)，按每字约1个token保守估算
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]')
+
+# 其他字符按约4个字符1个token估算
+CHARS_PER_TOKEN = 4
+
+# 图像文件在OCR之前无法得知文字量，按固定值估算
+IMAGE_TOKENS_ESTIMATE = 500
+
+# 输出token数相对于输入笔记token数的估算比例
+OUTPUT_TOKEN_RATIO = 1.1
+
+# 未配置context_window时使用的默认上下文长度
+DEFAULT_CONTEXT_WINDOW = 32768
+
+# 没有历史数据时的默认性能假设
+DEFAULT_REQUEST_OVERHEAD = 2.0   # 每次请求的固定耗时(秒)
+DEFAULT_OUTPUT_TOKENS_PER_SECOND = 30.0
+
+_tokenizer = None
+_tokenizer_loaded = False
+_tokenizer_lock = threading.Lock()
+
+
+def _get_tokenizer():
+    """获取本地tokenizer(可选依赖tiktoken)，未安装时返回None"""
+    global _tokenizer, _tokenizer_loaded
+    with _tokenizer_lock:
+        if not _tokenizer_loaded:
+            _tokenizer_loaded = True
+            try:
+                import tiktoken
+                _tokenizer = tiktoken.get_encoding("cl100k_base")
+            except Exception:
+                _tokenizer = None
+    return _tokenizer
+
+
+def estimate_tokens(text):
+    """估算文本的token数
+    
+    已安装tiktoken时使用cl100k_base编码精确计数，否则按字符类型启发式估算
+    """
+    if not text:
+        return 0
+    
+    tokenizer = _get_tokenizer()
+    if tokenizer is not None:
+        return len(tokenizer.encode(text, disallowed_special=()))
+    
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    other_count = len(text) - cjk_count
+    return cjk_count + (other_count + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+class TokenCountCache:
+    """文件token数缓存，以文件大小和修改时间判断是否失效"""
+    
+    def __init__(self, cache_file):
+        """
+        Args:
+            cache_file: 缓存文件路径(JSON)
+        """
+        self.cache_file = Path(cache_file)
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._dirty = False
+        
+        if self.cache_file.exists():
+            try:
+                with open(self.cache_file, 'r', encoding='utf-8') as f:
+                    self._entries = json.load(f)
+            except Exception as e:
+                print(f"读取token缓存时出错: {e}")
+                self._entries = {}
+    
+    def get(self, file_path, stat):
+        """获取缓存的token数，文件已变化时返回None"""
+        with self._lock:
+            entry = self._entries.get(str(file_path))
+        if entry and entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime:
+            return entry.get("tokens")
+        return None
+    
+    def set(self, file_path, stat, tokens):
+        """写入token数"""
+        with self._lock:
+            self._entries[str(file_path)] = {
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "tokens": tokens
+            }
+            self._dirty = True
+    
+    def save(self):
+        """保存缓存到文件"""
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = dict(self._entries)
+            self._dirty = False
+        try:
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.cache_file, 'w', encoding='utf-8') as f:
+                json.dump(entries, f, ensure_ascii=False)
+        except Exception as e:
+            print(f"保存token缓存时出错: {e}")
+
+
+class ThroughputHistory:
+    """各模型的历史吞吐量记录，保存在项目根目录的model_stats.json中"""
+    
+    def __init__(self, stats_file=None):
+        """
+        Args:
+            stats_file: 统计文件路径，为None时使用项目根目录下的model_stats.json
+        """
+        if stats_file is None:
+            stats_file = Path(__file__).resolve().parent.parent.parent / "model_stats.json"
+        self.stats_file = Path(stats_file)
+        self.stats = {}
+        
+        if self.stats_file.exists():
+            try:
+                with open(self.stats_file, 'r', encoding='utf-8') as f:
+                    self.stats = json.load(f)
+            except Exception as e:
+                print(f"读取模型统计时出错: {e}")
+    
+    def record(self, model_name, requests, total_latency, prompt_tokens, completion_tokens):
+        """累加一次批处理中某个模型的统计数据"""
+        if not model_name or requests <= 0:
+            return
+        entry = self.stats.setdefault(model_name, {
+            "requests": 0,
+            "total_latency": 0.0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0
+        })
+        entry["requests"] += requests
+        entry["total_latency"] += total_latency
+        entry["prompt_tokens"] += prompt_tokens
+        entry["completion_tokens"] += completion_tokens
+    
+    def record_router_stats(self, router_stats):
+        """从ModelRouter.get_stats()的结果中记录各模型统计"""
+        for stats in router_stats:
+            usage = stats.get("usage", {})
+            self.record(
+                stats.get("model_name"),
+                stats.get("success", 0),
+                stats.get("total_latency", 0.0),
+                usage.get("prompt_tokens", 0),
+                usage.get("completion_tokens", 0)
+            )
+    
+    def seconds_per_request(self, model_name, output_tokens):
+        """根据历史数据预测一次请求的耗时(秒)"""
+        entry = self.stats.get(model_name)
+        if entry and entry.get("completion_tokens") and entry.get("requests"):
+            # 按历史每输出token耗时(含请求固定开销)折算
+            return output_tokens * entry["total_latency"] / entry["completion_tokens"]
+        if entry and entry.get("requests"):
+            return entry["total_latency"] / entry["requests"]
+        return DEFAULT_REQUEST_OVERHEAD + output_tokens / DEFAULT_OUTPUT_TOKENS_PER_SECOND
+    
+    def save(self):
+        """保存统计数据"""
+        try:
+            with open(self.stats_file, 'w', encoding='utf-8') as f:
+                json.dump(self.stats, f, ensure_ascii=False, indent=4)
+        except Exception as e:
+            print(f"保存模型统计时出错: {e}")
+
+
+class FileEstimate:
+    """单个文件的预估结果"""
+    
+    def __init__(self, path, size=0, note_tokens=0, is_guess=False, error=None):
+        self.path = Path(path)
+        self.size = size
+        self.note_tokens = note_tokens
+        self.is_guess = is_guess  # 图像文件等无法读取内容时为True
+        self.error = error
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+
+
+class BatchPlan:
+    """批处理预估结果"""
+    
+    def __init__(self):
+        self.files = []
+        self.total_prompt_tokens = 0
+        self.total_output_tokens = 0
+        self.estimated_cost = None
+        self.estimated_seconds = 0.0
+        self.context_window = DEFAULT_CONTEXT_WINDOW
+        self.oversized = []
+        self.unreadable = []
+        self.planning_seconds = 0.0
+    
+    def summary_lines(self):
+        """生成可读的预估报告"""
+        guessed = sum(1 for f in self.files if f.is_guess)
+        lines = [
+            f"预估文件数: {len(self.files)} (其中 {guessed} 个图像文件按每个 {IMAGE_TOKENS_ESTIMATE} token估算)",
+            f"预估输入token: {self.total_prompt_tokens}",
+            f"预估输出token: {self.total_output_tokens}",
+        ]
+        if self.estimated_cost is not None:
+            lines.append(f"预估费用: {self.estimated_cost:.4f}")
+        else:
+            lines.append("预估费用: 未知(可在模型配置中设置input_price/output_price，单位为每百万token价格)")
+        lines.append(f"预估耗时: {format_duration(self.estimated_seconds)}")
+        
+        if self.oversized:
+            lines.append(f"警告: {len(self.oversized)} 个文件可能超出模型上下文长度({self.context_window} token):")
+            for estimate in self.oversized[:20]:
+                lines.append(f"  {estimate.path.name}: 约 {estimate.prompt_tokens + estimate.output_tokens} token")
+            if len(self.oversized) > 20:
+                lines.append(f"  ... 另有 {len(self.oversized) - 20} 个")
+        if self.unreadable:
+            lines.append(f"警告: {len(self.unreadable)} 个文件无法读取")
+        
+        lines.append(f"(预估用时 {self.planning_seconds:.2f} 秒)")
+        return lines
+
+
+def format_duration(seconds):
+    """将秒数格式化为可读时长，None表示未知"""
+    if seconds is None:
+        return "未知"
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds} 秒"
+    if seconds < 3600:
+        return f"{seconds // 60} 分 {seconds % 60} 秒"
+    return f"{seconds // 3600} 小时 {seconds % 3600 // 60} 分"
+
+
+class BatchPlanner:
+    """批处理预估器"""
+    
+    def __init__(self, cache_file, history=None, max_workers=None):
+        """
+        Args:
+            cache_file: token数缓存文件路径
+            history: ThroughputHistory实例，为None时自动加载
+            max_workers: 并行读取文件的线程数
+        """
+        self.cache = TokenCountCache(cache_file)
+        self.history = history or ThroughputHistory()
+        self.max_workers = max_workers or min(32, (os.cpu_count() or 1) * 4)
+    
+    def _estimate_file(self, file_path):
+        """估算单个文件的笔记token数"""
+        file_path = Path(file_path)
+        try:
+            stat = file_path.stat()
+        except OSError as e:
+            return FileEstimate(file_path, error=str(e))
+        
+        if file_path.suffix.lower() in FileHandler.SUPPORTED_IMAGE_FORMATS:
+            return FileEstimate(file_path, stat.st_size, IMAGE_TOKENS_ESTIMATE, is_guess=True)
+        
+        tokens = self.cache.get(file_path, stat)
+        if tokens is None:
+            content = FileHandler.read_file(str(file_path))
+            if content is None:
+                return FileEstimate(file_path, stat.st_size, error="无法读取文件内容")
+            tokens = estimate_tokens(content)
+            self.cache.set(file_path, stat, tokens)
+        
+        return FileEstimate(file_path, stat.st_size, tokens)
+    
+    def plan(self, files, model_infos, instructions="", concurrency=1):
+        """对一批文件进行预估
+        Args:
+            files: 文件路径列表
+            model_infos: 参与处理的模型配置列表(负载均衡时为多个)，
+                可选配置项 input_price/output_price(每百万token价格)、context_window
+            instructions: 每次请求固定附带的指令文本(提示词模板和格式要求)
+            concurrency: 并发请求数
+            
+        Returns:
+            BatchPlan: 预估结果
+        """
+        start = time.monotonic()
+        plan = BatchPlan()
+        
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            estimates = list(executor.map(self._estimate_file, files))
+        self.cache.save()
+        
+        instruction_tokens = estimate_tokens(instructions)
+        model_infos = list(model_infos) or [{}]
+        plan.context_window = min(
+            int(info.get("context_window") or DEFAULT_CONTEXT_WINDOW) for info in model_infos
+        )
+        
+        # 多个模型时按平均值估算单价和速度
+        prices = [
+            (float(info["input_price"]), float(info.get("output_price", info["input_price"])))
+            for info in model_infos if info.get("input_price") is not None
+        ]
+        total_cost = 0.0
+        total_seconds = 0.0
+        
+        for estimate in estimates:
+            plan.files.append(estimate)
+            if estimate.error:
+                plan.unreadable.append(estimate)
+                continue
+            
+            estimate.prompt_tokens = estimate.note_tokens + instruction_tokens
+            estimate.output_tokens = int(estimate.note_tokens * OUTPUT_TOKEN_RATIO)
+            plan.total_prompt_tokens += estimate.prompt_tokens
+            plan.total_output_tokens += estimate.output_tokens
+            
+            if estimate.prompt_tokens + estimate.output_tokens > plan.context_window:
+                plan.oversized.append(estimate)
+            
+            total_seconds += sum(
+                self.history.seconds_per_request(info.get("name"), estimate.output_tokens)
+                for info in model_infos
+            ) / len(model_infos)
+            if prices:
+                input_price = sum(p[0] for p in prices) / len(prices)
+                output_price = sum(p[1] for p in prices) / len(prices)
+                total_cost += (estimate.prompt_tokens * input_price + estimate.output_tokens * output_price) / 1_000_000
+        
+        plan.estimated_cost = total_cost if prices else None
+        plan.estimated_seconds = total_seconds / max(1, concurrency)
+        plan.planning_seconds = time.monotonic() - start
+        return plan
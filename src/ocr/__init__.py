@@ -12,6 +12,6 @@ OCR模块
 """
 
 # 导出OCR处理器和异常类
-from .ocr_processor import OCRProcessor, OCRProcessingError, OCRAPIError
+from .ocr_processor import OCRProcessor, OCRProcessingError, OCRAPIError, get_ocr_processor
 
-__all__ = ["OCRProcessor", "OCRProcessingError", "OCRAPIError"] 
\ No newline at end of file
+__all__ = ["OCRProcessor", "OCRProcessingError", "OCRAPIError", "get_ocr_processor"]
\ No newline at end of file
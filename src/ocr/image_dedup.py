@@ -0,0 +1,429 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@File    :   image_dedup.py
+@Time    :   2025/04/03
+@Author  :   Maker
+@Version :   1.0
+'''
+
+"""
+近似重复图片去重
+为图片计算感知哈希(256位dHash)和像素摘要，哈希的汉明距离在阈值以内的图片只是候选：
+像素摘要相同，或缩放到相同尺寸后逐像素比较几乎没有差异，才视为同一张图片并复用代表图片的识别结果。
+布局相同、文字不同的截图哈希往往完全相同，必须经过像素比较才能避免错误复用。
+哈希和识别结果保存在索引文件中，使用多索引哈希按汉明距离检索，之后的运行中新图片与已有图片比较时无需逐一比对
+"""
+
+import time
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from PIL import Image, ImageChops
+
+
+# 支持去重的图片格式
+DEDUP_IMAGE_FORMATS = ['.png', '.jpg', '.jpeg', '.bmp', '.tiff', '.gif']
+
+# 感知哈希边长，哈希为 HASH_SIZE*HASH_SIZE 位
+HASH_SIZE = 16
+HASH_BITS = HASH_SIZE * HASH_SIZE
+
+# 像素比较：以较小的图片为准(长边不超过该尺寸)缩放到相同尺寸后比较灰度值
+PIXEL_DIFF_SIZE = 2048
+# 按该边长的小块统计平均灰度差：改动一个字符会使所在小块的差异明显升高，
+# 而重新压缩、缩放产生的噪声分散在各处，每个小块的平均差异都很小
+PIXEL_DIFF_BLOCK = 4
+# 所有小块的平均灰度差都不超过该值(0-255)时视为同一张图片
+PIXEL_DIFF_MAX = 48
+# 两张图片宽高比相差超过该比例时不是同一张图片
+ASPECT_RATIO_TOLERANCE = 0.02
+
+
+def hamming_distance(a, b):
+    """两个哈希值之间的汉明距离"""
+    return bin(a ^ b).count("1")
+
+
+def dhash(image, hash_size=HASH_SIZE):
+    """计算图片的差值哈希(dHash)，对缩放、重新压缩和轻微的亮度变化不敏感
+
+    Args:
+        image: PIL图片
+        hash_size: 哈希边长，结果为 hash_size*hash_size 位整数
+    Returns:
+        int: 哈希值
+    """
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def image_signature(image_path, hash_size=HASH_SIZE):
+    """计算图片的感知哈希和像素摘要
+
+    Args:
+        image_path: 图片路径
+        hash_size: 哈希边长
+    Returns:
+        tuple: (哈希值, 像素摘要)，多页(帧)图片返回None
+    """
+    with Image.open(image_path) as img:
+        # 多页图片的首页相同不代表内容相同，不参与去重
+        if getattr(img, "n_frames", 1) > 1:
+            return None
+        img = img.convert("RGB")
+    # 像素摘要与文件格式和元数据无关，内容完全相同的图片摘要相同
+    digest = hashlib.sha1(f"{img.width}x{img.height}:".encode("ascii") + img.tobytes()).hexdigest()
+    return dhash(img, hash_size), digest
+
+
+def pixel_difference(first_path, second_path, size=PIXEL_DIFF_SIZE, block=PIXEL_DIFF_BLOCK):
+    """将两张图片缩放到相同尺寸后逐像素比较
+
+    Args:
+        first_path: 第一张图片路径
+        second_path: 第二张图片路径
+        size: 比较时长边的最大尺寸
+        block: 统计平均差异的小块边长
+    Returns:
+        int: 差异最大的小块的平均灰度差(0-255)，宽高比不同时返回255
+    """
+    with Image.open(first_path) as first, Image.open(second_path) as second:
+        first_ratio = first.width / max(1, first.height)
+        second_ratio = second.width / max(1, second.height)
+        if abs(first_ratio - second_ratio) > ASPECT_RATIO_TOLERANCE * max(first_ratio, second_ratio):
+            return 255
+        # 以较小的图片为准，缩放副本与原图比较时不放大
+        width = min(first.width, second.width, size)
+        height = max(1, round(width / first_ratio))
+        if height > size:
+            height = size
+            width = max(1, round(height * first_ratio))
+        first_small = first.convert("L").resize((width, height), Image.BILINEAR)
+        second_small = second.convert("L").resize((width, height), Image.BILINEAR)
+
+    difference = ImageChops.difference(first_small, second_small)
+    blocks = difference.resize((max(1, width // block), max(1, height // block)), Image.BOX)
+    return blocks.getextrema()[1]
+
+
+class HammingIndex:
+    """多索引哈希：把哈希分成 max_distance+1 段分别建立哈希表。
+    由抽屉原理，汉明距离不超过阈值的两个哈希至少有一段完全相同，
+    查找时只需比对各段命中的候选，而不用和所有哈希逐一比较"""
+
+    def __init__(self, max_distance, bits=64):
+        """
+        Args:
+            max_distance: 支持查找的最大汉明距离
+            bits: 哈希位数
+        """
+        self.max_distance = max_distance
+        parts = min(bits, max_distance + 1)
+        bounds = [bits * i // parts for i in range(parts + 1)]
+        # 每段为 (右移位数, 掩码)
+        self._segments = [
+            (bounds[i], (1 << (bounds[i + 1] - bounds[i])) - 1) for i in range(parts)
+        ]
+        self._tables = [{} for _ in range(parts)]
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, key, value):
+        """添加元素，key为哈希值"""
+        item = (key, value)
+        for table, (shift, mask) in zip(self._tables, self._segments):
+            table.setdefault((key >> shift) & mask, []).append(item)
+        self._size += 1
+
+    def search(self, key, max_distance=None):
+        """查找与key的汉明距离不超过max_distance(不能大于建立索引时的阈值)的元素
+        Returns:
+            list: (距离, key, value) 列表，按距离从小到大排序
+        """
+        if max_distance is None or max_distance > self.max_distance:
+            max_distance = self.max_distance
+
+        results = []
+        seen = set()
+        for table, (shift, mask) in zip(self._tables, self._segments):
+            for item in table.get((key >> shift) & mask, ()):
+                if id(item) in seen:
+                    continue
+                seen.add(id(item))
+                distance = hamming_distance(key, item[0])
+                if distance <= max_distance:
+                    results.append((distance, item[0], item[1]))
+        results.sort(key=lambda result: result[0])
+        return results
+
+
+class ImageHashEntry:
+    """索引中的一张图片"""
+
+    def __init__(self, path, hash_value, digest, text=None):
+        self.path = path
+        self.hash_value = hash_value
+        self.digest = digest
+        self.text = text
+        # 识别进行中时，其他近似图片等待该Future得到结果
+        self.future = None
+        self.failed = False
+
+
+class ImageDeduplicator:
+    """近似重复图片去重器，线程安全，可在批处理的多个工作线程中共享"""
+
+    def __init__(self, index_path, max_distance=10, hash_workers=4, max_pixel_diff=PIXEL_DIFF_MAX):
+        """
+        Args:
+            index_path: 哈希索引文件(SQLite)路径
+            max_distance: 作为候选的最大汉明距离(256位哈希)
+            hash_workers: 并行计算哈希的线程数
+            max_pixel_diff: 候选图片逐像素比较时允许的最大小块平均灰度差，为0时只复用像素完全相同的图片
+        """
+        self.index_path = Path(index_path)
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_distance = max_distance
+        self.hash_workers = max(1, hash_workers)
+        self.max_pixel_diff = max_pixel_diff
+
+        self.reused_count = 0
+        self.ocr_count = 0
+
+        self._lock = threading.Lock()
+        self._index = HammingIndex(max_distance, HASH_BITS)
+        self._hashes = {}
+        self._entries = {}
+
+        self._conn = sqlite3.connect(str(self.index_path), check_same_thread=False, timeout=30)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS images (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER,
+                    mtime REAL,
+                    hash TEXT NOT NULL,
+                    text TEXT,
+                    duplicate_of TEXT,
+                    updated_at REAL,
+                    digest TEXT
+                )
+            """)
+            # 旧版本创建的索引没有digest列，其中的64位哈希也不再使用
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(images)")}
+            if "digest" not in columns:
+                self._conn.execute("ALTER TABLE images ADD COLUMN digest TEXT")
+            self._conn.commit()
+
+            # 已识别的图片加入检索索引；只保存了哈希的图片仅用于跳过重复计算
+            for path, size, mtime, hash_hex, text, digest in self._conn.execute(
+                "SELECT path, size, mtime, hash, text, digest FROM images"
+            ):
+                if not digest or len(hash_hex) != HASH_BITS // 4:
+                    continue
+                hash_value = int(hash_hex, 16)
+                self._hashes[path] = (size, mtime, hash_value, digest)
+                if text:
+                    self._add_entry(ImageHashEntry(path, hash_value, digest, text))
+
+    def _add_entry(self, entry):
+        """将图片加入检索索引(调用方持有锁)"""
+        self._index.add(entry.hash_value, entry)
+        self._entries[entry.path] = entry
+
+    def close(self):
+        """关闭索引文件"""
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def is_image(file):
+        """文件是否为支持去重的图片"""
+        return Path(file).suffix.lower() in DEDUP_IMAGE_FORMATS
+
+    def image_signature(self, file):
+        """获取图片的(哈希, 像素摘要)，文件未变化时使用索引中保存的值；多页图片返回None"""
+        path = str(file)
+        stat = Path(file).stat()
+        with self._lock:
+            cached = self._hashes.get(path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime:
+            return cached[2], cached[3]
+
+        signature = image_signature(file)
+        if signature is None:
+            return None
+        hash_value, digest = signature
+        with self._lock:
+            # 文件内容已变化，旧的识别结果不能再被其他图片复用
+            stale = self._entries.pop(path, None)
+            if stale is not None and stale.future is None:
+                stale.failed = True
+            self._hashes[path] = (stat.st_size, stat.st_mtime, hash_value, digest)
+            self._conn.execute(
+                """INSERT INTO images (path, size, mtime, hash, digest, updated_at) VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(path) DO UPDATE SET size=excluded.size, mtime=excluded.mtime,
+                   hash=excluded.hash, digest=excluded.digest, text=NULL, duplicate_of=NULL,
+                   updated_at=excluded.updated_at""",
+                (path, stat.st_size, stat.st_mtime, f"{hash_value:0{HASH_BITS // 4}x}", digest, time.time())
+            )
+            self._conn.commit()
+        return hash_value, digest
+
+    def is_same_image(self, file, digest, other_path, other_digest):
+        """候选图片是否与该图片内容相同：像素摘要相同，或逐像素比较的差异在允许范围内"""
+        if digest == other_digest:
+            return True
+        if self.max_pixel_diff <= 0 or str(file) == str(other_path):
+            return False
+        try:
+            return pixel_difference(file, other_path) <= self.max_pixel_diff
+        except Exception:
+            # 代表图片已被删除或无法读取，不能确认内容相同
+            return False
+
+    def prepare(self, files):
+        """并行计算一批图片的哈希并统计重复情况(会读取图片，应在后台线程中调用)
+        Returns:
+            dict: images(图片数)、groups(需要OCR的组数)、duplicates(可复用结果的图片数)
+        """
+        images = [file for file in files if self.is_image(file)]
+
+        def safe_signature(file):
+            try:
+                return file, self.image_signature(file)
+            except Exception:
+                return file, None
+
+        with ThreadPoolExecutor(max_workers=self.hash_workers) as executor:
+            signatures = [item for item in executor.map(safe_signature, images) if item[1] is not None]
+
+        # 模拟分组：已识别的图片和本批次中先出现的图片作为代表
+        with self._lock:
+            known = [entry for entry in self._entries.values() if not entry.failed]
+        batch = HammingIndex(self.max_distance, HASH_BITS)
+        for entry in known:
+            batch.add(entry.hash_value, (entry.path, entry.digest))
+        duplicates = 0
+        for file, (hash_value, digest) in signatures:
+            if any(
+                self.is_same_image(file, digest, path, other_digest)
+                for _, _, (path, other_digest) in batch.search(hash_value)
+            ):
+                duplicates += 1
+            else:
+                batch.add(hash_value, (str(file), digest))
+        return {"images": len(images), "groups": len(signatures) - duplicates, "duplicates": duplicates}
+
+    def _find_representative(self, file, hash_value, digest):
+        """查找内容相同且未失败的代表图片，哈希只用于筛选候选，像素比较在锁外进行"""
+        with self._lock:
+            candidates = [entry for _, _, entry in self._index.search(hash_value) if not entry.failed]
+        for entry in candidates:
+            if self.is_same_image(file, digest, entry.path, entry.digest):
+                return entry
+        return None
+
+    def read_image(self, file, ocr_func):
+        """读取图片文字：有近似图片已识别(或正在识别)时复用其结果，否则调用ocr_func识别
+
+        Args:
+            file: 图片路径
+            ocr_func: 实际的识别函数 ocr_func(path) -> str
+        Returns:
+            str: 识别文本
+        """
+        try:
+            signature = self.image_signature(file)
+        except Exception:
+            signature = None
+        if signature is None:
+            # 无法计算哈希(如图片损坏)或多页图片，直接交给OCR处理
+            return ocr_func(str(file))
+        hash_value, digest = signature
+
+        entry = self._find_representative(file, hash_value, digest)
+        owner = entry is None
+        if owner:
+            # 并发比较期间其他线程可能也在识别同一张图片，此时各自识别，不影响结果的正确性
+            entry = ImageHashEntry(str(file), hash_value, digest)
+            entry.future = Future()
+            with self._lock:
+                self._add_entry(entry)
+
+        if not owner:
+            try:
+                text = entry.text if entry.text else entry.future.result()
+            except Exception:
+                text = None
+            if text:
+                if entry.path != str(file):
+                    self._record_duplicate(file, entry.path, text)
+                return text
+            # 代表图片识别失败，单独识别本图片
+            return ocr_func(str(file))
+
+        try:
+            text = ocr_func(str(file))
+        except Exception as e:
+            self._mark_failed(entry, e)
+            raise
+        if not text:
+            self._mark_failed(entry, None)
+            return text
+
+        with self._lock:
+            entry.text = text
+            self.ocr_count += 1
+            self._conn.execute(
+                "UPDATE images SET text=?, duplicate_of=NULL, updated_at=? WHERE path=?",
+                (text, time.time(), str(file))
+            )
+            self._conn.commit()
+        entry.future.set_result(text)
+        return text
+
+    def _mark_failed(self, entry, error):
+        """代表图片识别失败，从检索中排除并通知等待者"""
+        with self._lock:
+            entry.failed = True
+        if error is None:
+            entry.future.set_result(None)
+        else:
+            entry.future.set_exception(error)
+
+    def _record_duplicate(self, file, representative, text):
+        with self._lock:
+            self.reused_count += 1
+            self._conn.execute(
+                "UPDATE images SET text=?, duplicate_of=?, updated_at=? WHERE path=?",
+                (text, representative, time.time(), str(file))
+            )
+            self._conn.commit()
+
+    def duplicate_groups(self):
+        """获取索引中记录的近似重复关系
+        Returns:
+            dict: {代表图片路径: [近似图片路径, ...]}
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path, duplicate_of FROM images WHERE duplicate_of IS NOT NULL ORDER BY path"
+            ).fetchall()
+        groups = {}
+        for path, representative in rows:
+            groups.setdefault(representative, []).append(path)
+        return groups
@@ -9,7 +9,7 @@
 
 """
 OCR处理模块
-负责图像文字识别，支持百度OCR、腾讯云OCR和自定义OCR
+负责图像文字识别，支持百度OCR、腾讯云OCR、自定义OCR和本地离线OCR
 """
 
 import os
@@ -23,6 +23,133 @@ from typing import Optional, Dict, Any, List
 from datetime import datetime
 import logging
 import tempfile
+import threading
+import importlib.util
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+from utils.settings_service import OCR_KEYS, get_settings, get_settings_service
+from utils.adaptive_limiter import get_limiter, is_throttle_error
+
+
+# 本地OCR引擎及其对应的安装包
+LOCAL_OCR_ENGINES = {
+    "rapidocr": ("rapidocr_onnxruntime", "pip install rapidocr_onnxruntime"),
+    "tesseract": ("pytesseract", "pip install pytesseract (并安装Tesseract程序及中文语言包)")
+}
+
+# 在线OCR服务的(初始并发数, 最大并发数)，实际并发数按限流和响应耗时自动调整
+REMOTE_OCR_CONCURRENCY = {
+    "BAIDU": (2, 10),
+    "TENCENT": (5, 20),
+    "CUSTOM": (4, 16),
+}
+
+# 在线OCR服务限流时(降低并发后)重试的次数
+OCR_THROTTLE_RETRIES = 3
+
+# 本地OCR进程池，所有OCRProcessor实例共享，配置变化时重建
+_local_pool = None
+_local_pool_key = None
+_local_pool_lock = threading.Lock()
+
+# 工作进程内的OCR引擎实例，每个进程只加载一次模型
+_local_engine = None
+
+
+def _create_local_engine(engine_name):
+    """创建本地OCR引擎(在工作进程中调用)"""
+    if engine_name == "tesseract":
+        import pytesseract
+        return pytesseract
+    from rapidocr_onnxruntime import RapidOCR
+    return RapidOCR()
+
+
+def _init_local_ocr_worker(engine_name):
+    """工作进程初始化：预先加载OCR模型，失败时推迟到处理任务时再报告错误"""
+    global _local_engine
+    try:
+        _local_engine = _create_local_engine(engine_name)
+    except Exception:
+        _local_engine = None
+
+
+def _run_local_ocr(image_path, engine_name, language, max_image_size):
+    """在工作进程中识别单张图片，返回每行文本组成的列表"""
+    global _local_engine
+    if _local_engine is None:
+        _local_engine = _create_local_engine(engine_name)
+    
+    with Image.open(image_path) as img:
+        img.thumbnail((max_image_size, max_image_size))
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        
+        if engine_name == "tesseract":
+            lang = "chi_sim+eng" if language.startswith("zh") else "eng"
+            text = _local_engine.image_to_string(img, lang=lang)
+            return [line for line in text.splitlines() if line.strip()]
+        
+        import numpy as np
+        result, _ = _local_engine(np.asarray(img))
+        # RapidOCR的结果为 [文本框坐标, 文本, 置信度] 列表
+        return [item[1] for item in (result or [])]
+
+
+def get_local_ocr_pool(engine_name, workers):
+    """获取本地OCR进程池，引擎或进程数变化时重建"""
+    global _local_pool, _local_pool_key
+    with _local_pool_lock:
+        key = (engine_name, workers)
+        if _local_pool is None or _local_pool_key != key:
+            if _local_pool is not None:
+                _local_pool.shutdown(wait=False)
+            # 界面和批处理都在多线程环境下运行，使用spawn避免fork带来的锁状态问题
+            _local_pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_local_ocr_worker,
+                initargs=(engine_name,)
+            )
+            _local_pool_key = key
+        return _local_pool
+
+
+def shutdown_local_ocr_pool():
+    """关闭本地OCR进程池"""
+    global _local_pool, _local_pool_key
+    with _local_pool_lock:
+        if _local_pool is not None:
+            _local_pool.shutdown(wait=False, cancel_futures=True)
+        _local_pool = None
+        _local_pool_key = None
+
+# 按当前设置创建的共享OCR处理器，OCR相关设置变化时重建
+_shared_processor = None
+_shared_processor_subscribed = False
+_shared_processor_lock = threading.Lock()
+
+
+def _reset_shared_processor(settings, changed_keys):
+    """OCR设置变化时丢弃共享的处理器(及其客户端)，下次使用时按新设置创建"""
+    global _shared_processor
+    with _shared_processor_lock:
+        _shared_processor = None
+
+
+def get_ocr_processor():
+    """获取按当前设置创建的共享OCR处理器，批量识别时不必为每个文件重新读取配置和创建客户端"""
+    global _shared_processor, _shared_processor_subscribed
+    with _shared_processor_lock:
+        if _shared_processor is None:
+            service = get_settings_service()
+            if not _shared_processor_subscribed:
+                service.subscribe(_reset_shared_processor, OCR_KEYS)
+                _shared_processor_subscribed = True
+            _shared_processor = OCRProcessor(service.snapshot().ocr_config())
+        return _shared_processor
 
 
 class OCRProcessor:
@@ -32,15 +159,21 @@ class OCRProcessor:
         """初始化OCR处理器
         
         Args:
-            config: OCR配置字典，如果为None则从环境变量读取配置
+            config: OCR配置字典，如果为None则使用当前设置中的OCR配置
         """
-        # 如果未提供配置，则从环境变量读取
+        # 如果未提供配置，则使用当前设置
         if config is None:
-            config = self._load_config_from_env()
+            config = get_settings().ocr_config()
             
         self.config = config
         self.supported_formats = ['.png', '.jpg', '.jpeg', '.bmp', '.tiff', '.gif']
         self.max_image_size = 4096  # 最大允许的图片尺寸
+        self.multi_frame_formats = ['.tiff', '.gif']  # 可能包含多页(帧)的格式
+        # 多页图片同时识别的页数，同时也限制了内存中解出的页数
+        self.frame_workers = int(self.config.get("OCR_FRAME_WORKERS") or 8)
+        # 百度/腾讯OCR客户端，创建一次后复用(配置变化时由get_ocr_processor重建处理器)
+        self._client = None
+        self._client_lock = threading.Lock()
         
         # 创建日志记录器
         self.logger = logging.getLogger("OCRProcessor")
@@ -51,28 +184,6 @@ class OCRProcessor:
             self.logger.addHandler(handler)
             self.logger.setLevel(logging.INFO)
     
-    def _load_config_from_env(self) -> Dict[str, Any]:
-        """从环境变量加载OCR配置"""
-        config = {
-            "OCR_API_TYPE": os.environ.get("OCR_API_TYPE", "CUSTOM")
-        }
-        
-        # 根据API类型加载对应的配置
-        if config["OCR_API_TYPE"] == "BAIDU":
-            config["BAIDU_APP_ID"] = os.environ.get("BAIDU_APP_ID", "")
-            config["BAIDU_API_KEY"] = os.environ.get("BAIDU_API_KEY", "")
-            config["BAIDU_SECRET_KEY"] = os.environ.get("BAIDU_SECRET_KEY", "")
-            config["BAIDU_OCR_TOKEN"] = os.environ.get("BAIDU_OCR_TOKEN", "")
-        elif config["OCR_API_TYPE"] == "TENCENT":
-            config["TENCENT_SECRET_ID"] = os.environ.get("TENCENT_SECRET_ID", "")
-            config["TENCENT_SECRET_KEY"] = os.environ.get("TENCENT_SECRET_KEY", "")
-        else:  # CUSTOM
-            config["CUSTOM_OCR_ENDPOINT"] = os.environ.get("CUSTOM_OCR_ENDPOINT", "")
-            config["OCR_LANGUAGE"] = os.environ.get("OCR_LANGUAGE", "zh")
-            config["OCR_TIMEOUT"] = int(os.environ.get("OCR_TIMEOUT", "30"))
-            
-        return config
-
     def preprocess_image(self, image_path: Path) -> bytes:
         """预处理图片以提高OCR识别精度"""
         try:
@@ -96,29 +207,154 @@ class OCRProcessor:
             raise OCRProcessingError(f"图像预处理失败: {str(e)}")
 
     def process_image(self, image_path: Path) -> str:
-        """处理图片并返回识别文本"""
+        """处理图片并返回识别文本，多页TIFF和多帧GIF逐页识别后按页码顺序拼接"""
         if image_path.suffix.lower() not in self.supported_formats:
             raise ValueError(f"不支持的图片格式: {image_path.suffix}，支持的格式: {', '.join(self.supported_formats)}")
 
+        if image_path.suffix.lower() in self.multi_frame_formats:
+            frame_count = self._frame_count(image_path)
+            if frame_count > 1:
+                try:
+                    return self._process_frames(image_path, frame_count)
+                except OCRProcessingError:
+                    raise
+                except Exception as e:
+                    raise OCRProcessingError(f"多页图片处理失败: {str(e)}") from e
+        
+        return self._process_single_image(image_path)
+    
+    def _frame_count(self, image_path: Path) -> int:
+        """获取图片的页(帧)数，只读取文件头"""
+        try:
+            with Image.open(image_path) as img:
+                return getattr(img, "n_frames", 1)
+        except Exception:
+            # 无法读取时按单页处理，由OCR接口报告具体错误
+            return 1
+    
+    def _process_frames(self, image_path: Path, frame_count: int) -> str:
+        """并发识别多页图片的各页
+        
+        各页按顺序逐一解出并保存为临时文件，同时最多有frame_workers页在识别中，
+        内存占用与总页数无关；总耗时接近最慢的几页，而不是各页耗时之和
+        """
+        self.logger.info(f"{image_path.name} 共 {frame_count} 页，开始逐页识别")
+        temp_dir = tempfile.mkdtemp(prefix="ocr_frames_")
+        texts = [None] * frame_count
+        errors = {}
+        
+        def recognize(index, frame_path):
+            try:
+                return index, self._process_single_image(frame_path), None
+            except Exception as e:
+                return index, None, e
+            finally:
+                frame_path.unlink(missing_ok=True)
+        
+        try:
+            with Image.open(image_path) as img, \
+                    ThreadPoolExecutor(max_workers=max(1, self.frame_workers)) as executor:
+                running = set()
+                for index in range(frame_count):
+                    # 识别中的页数达到上限时，等待有页完成后再解出下一页
+                    if len(running) >= self.frame_workers:
+                        done, running = wait(running, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            self._collect_frame(future.result(), texts, errors)
+                    
+                    img.seek(index)
+                    # 传真扫描件多为黑白或灰度，保持原模式可大幅减少编码耗时和临时文件大小
+                    frame = img.copy() if img.mode in ("1", "L", "RGB") else img.convert("RGB")
+                    frame.thumbnail((self.max_image_size, self.max_image_size))
+                    frame_path = Path(temp_dir) / f"page_{index + 1:04d}.png"
+                    frame.save(frame_path, compress_level=1)
+                    frame.close()
+                    running.add(executor.submit(recognize, index, frame_path))
+                
+                for future in running:
+                    self._collect_frame(future.result(), texts, errors)
+        finally:
+            try:
+                os.rmdir(temp_dir)
+            except OSError:
+                pass
+        
+        if len(errors) == frame_count:
+            raise OCRProcessingError(f"所有页面识别失败: {errors[0]}")
+        
+        # 按页码顺序拼接，每页前加页码标记
+        pages = []
+        for index in range(frame_count):
+            if index in errors:
+                body = f"(本页识别失败: {errors[index]})"
+            else:
+                body = texts[index] or ""
+            pages.append(f"--- 第 {index + 1}/{frame_count} 页 ---\n{body}")
+        return "\n\n".join(pages)
+    
+    def _collect_frame(self, result, texts, errors):
+        """记录单页的识别结果"""
+        index, text, error = result
+        if error is not None:
+            self.logger.warning(f"第 {index + 1} 页识别失败: {error}")
+            errors[index] = error
+        else:
+            texts[index] = text
+    
+    def _process_single_image(self, image_path: Path) -> str:
+        """按配置的OCR接口识别单张图片"""
         try:
             # 获取OCR API类型
             api_type = self.config.get('OCR_API_TYPE', 'CUSTOM')
             
-            # 百度OCR处理
-            if api_type == "BAIDU":
-                return self._process_with_baidu(image_path)
-            
-            # 腾讯OCR处理
-            elif api_type == "TENCENT":
-                return self._process_with_tencent(image_path)
-            
-            # 自定义OCR处理
-            else:
-                return self._process_with_custom(image_path)
+            # 本地离线OCR处理(并发数由进程池决定)
+            if api_type == "LOCAL":
+                return self._process_with_local(image_path)
+            
+            # 在线OCR服务的并发数由自适应限流器控制，所有文件和页共用
+            limiter = self._get_limiter(api_type)
+            for attempt in range(OCR_THROTTLE_RETRIES + 1):
+                try:
+                    with limiter.slot():
+                        # 百度OCR处理
+                        if api_type == "BAIDU":
+                            return self._process_with_baidu(image_path)
+                        
+                        # 腾讯OCR处理
+                        elif api_type == "TENCENT":
+                            return self._process_with_tencent(image_path)
+                        
+                        # 自定义OCR处理
+                        else:
+                            return self._process_with_custom(image_path)
+                except OCRAPIError as e:
+                    # 被限流时限流器已降低并发，等空出额度后重试
+                    if attempt == OCR_THROTTLE_RETRIES or not is_throttle_error(e):
+                        raise
+                    self.logger.warning(f"OCR服务限流，降低并发后重试: {image_path}")
                 
         except Exception as e:
             raise OCRProcessingError(f"图片处理失败: {str(e)}") from e
     
+    def _get_limiter(self, api_type):
+        """获取在线OCR服务的自适应限流器，同一服务(账号、地域或地址)共用一个"""
+        if api_type == "BAIDU":
+            key = f"ocr:BAIDU:{self.config.get('BAIDU_APP_ID', '')}"
+        elif api_type == "TENCENT":
+            key = f"ocr:TENCENT:{self.config.get('TENCENT_REGION') or 'ap-beijing'}"
+        else:
+            api_type = "CUSTOM"
+            key = f"ocr:CUSTOM:{self.config.get('CUSTOM_OCR_ENDPOINT', '')}"
+        initial, max_limit = REMOTE_OCR_CONCURRENCY[api_type]
+        return get_limiter(key, initial=initial, max_limit=max_limit)
+    
+    def _get_client(self, factory):
+        """获取OCR服务客户端，首次调用时用factory创建"""
+        with self._client_lock:
+            if self._client is None:
+                self._client = factory()
+            return self._client
+    
     def _process_with_baidu(self, image_path: Path) -> str:
         """使用百度OCR处理图片"""
         try:
@@ -126,15 +362,15 @@ class OCRProcessor:
             from aip import AipOcr
             
             # 获取百度OCR参数
-            app_id = self.config.get("BAIDU_APP_ID") or os.environ.get("BAIDU_APP_ID")
-            api_key = self.config.get("BAIDU_API_KEY") or os.environ.get("BAIDU_API_KEY")
-            secret_key = self.config.get("BAIDU_SECRET_KEY") or os.environ.get("BAIDU_SECRET_KEY")
+            app_id = self.config.get("BAIDU_APP_ID")
+            api_key = self.config.get("BAIDU_API_KEY")
+            secret_key = self.config.get("BAIDU_SECRET_KEY")
             
             if not app_id or not api_key or not secret_key:
                 raise OCRAPIError("未配置百度OCR APP_ID、API_KEY或SECRET_KEY")
             
-            # 创建客户端
-            client = AipOcr(app_id, api_key, secret_key)
+            # 获取(首次时创建)客户端
+            client = self._get_client(lambda: AipOcr(app_id, api_key, secret_key))
             
             # 读取图片文件
             with open(str(image_path), 'rb') as fp:
@@ -174,25 +410,29 @@ class OCRProcessor:
             from tencentcloud.ocr.v20181119 import ocr_client, models
             
             # 获取腾讯云配置
-            secret_id = self.config.get("TENCENT_SECRET_ID") or os.environ.get("TENCENT_SECRET_ID")
-            secret_key = self.config.get("TENCENT_SECRET_KEY") or os.environ.get("TENCENT_SECRET_KEY")
+            secret_id = self.config.get("TENCENT_SECRET_ID")
+            secret_key = self.config.get("TENCENT_SECRET_KEY")
+            region = self.config.get("TENCENT_REGION") or "ap-beijing"
             
             if not secret_id or not secret_key:
                 raise OCRAPIError("未配置腾讯云SecretId或SecretKey")
             
-            # 创建认证对象
-            cred = credential.Credential(secret_id, secret_key)
-            
-            # 配置HTTP参数
-            httpProfile = HttpProfile()
-            httpProfile.endpoint = "ocr.tencentcloudapi.com"
-            
-            # 创建客户端配置
-            clientProfile = ClientProfile()
-            clientProfile.httpProfile = httpProfile
+            def create_client():
+                # 创建认证对象
+                cred = credential.Credential(secret_id, secret_key)
+                
+                # 配置HTTP参数
+                httpProfile = HttpProfile()
+                httpProfile.endpoint = "ocr.tencentcloudapi.com"
+                
+                # 创建客户端配置
+                clientProfile = ClientProfile()
+                clientProfile.httpProfile = httpProfile
+                
+                # 创建OCR客户端
+                return ocr_client.OcrClient(cred, region, clientProfile)
             
-            # 创建OCR客户端，使用北京区域
-            client = ocr_client.OcrClient(cred, "ap-beijing", clientProfile)
+            client = self._get_client(create_client)
             
             # 读取图片文件并转换为base64
             with open(str(image_path), 'rb') as f:
@@ -225,7 +465,7 @@ class OCRProcessor:
         """使用自定义OCR处理图片"""
         try:
             # 获取自定义OCR地址
-            ocr_url = self.config.get("CUSTOM_OCR_ENDPOINT") or os.environ.get("CUSTOM_OCR_ENDPOINT")
+            ocr_url = self.config.get("CUSTOM_OCR_ENDPOINT")
             
             if not ocr_url:
                 raise OCRAPIError("未配置自定义OCR API地址")
@@ -277,6 +517,56 @@ class OCRProcessor:
         except Exception as e:
             raise OCRAPIError(f"自定义OCR处理失败: {str(e)}")
 
+    def _local_engine_name(self) -> str:
+        """获取配置的本地OCR引擎名称"""
+        engine_name = (self.config.get("LOCAL_OCR_ENGINE") or "rapidocr").lower()
+        if engine_name not in LOCAL_OCR_ENGINES:
+            raise OCRAPIError(f"不支持的本地OCR引擎: {engine_name}，可选: {', '.join(LOCAL_OCR_ENGINES)}")
+        return engine_name
+
+    def _process_with_local(self, image_path: Path) -> str:
+        """使用本地离线OCR引擎处理图片，识别在进程池中进行，每个工作进程只加载一次模型"""
+        engine_name = self._local_engine_name()
+        module_name, install_hint = LOCAL_OCR_ENGINES[engine_name]
+        if importlib.util.find_spec(module_name) is None:
+            raise OCRAPIError(f"未安装本地OCR引擎，请执行: {install_hint}")
+        
+        workers = int(self.config.get("LOCAL_OCR_WORKERS") or 0) or os.cpu_count() or 1
+        pool = get_local_ocr_pool(engine_name, workers)
+        try:
+            future = pool.submit(
+                _run_local_ocr,
+                str(image_path),
+                engine_name,
+                self.config.get("OCR_LANGUAGE", "zh"),
+                self.max_image_size
+            )
+            lines = future.result(timeout=self.config.get("OCR_TIMEOUT", 120))
+        except BrokenProcessPool as e:
+            # 工作进程异常退出(如内存不足)，下次调用时重建进程池
+            shutdown_local_ocr_pool()
+            raise OCRAPIError(f"本地OCR工作进程异常退出: {str(e)}")
+        except Exception as e:
+            raise OCRAPIError(f"本地OCR处理失败: {str(e)}")
+        
+        return "\n".join(lines)
+
+    def test_local_connection(self):
+        """测试本地OCR引擎是否可用"""
+        try:
+            engine_name = self._local_engine_name()
+            module_name, install_hint = LOCAL_OCR_ENGINES[engine_name]
+            if importlib.util.find_spec(module_name) is None:
+                self.logger.error(f"未安装本地OCR引擎，请执行: {install_hint}")
+                return False
+            
+            self.logger.info(f"本地OCR引擎({engine_name})可用")
+            return True
+            
+        except Exception as e:
+            self.logger.error(f"本地OCR引擎测试失败: {str(e)}")
+            return False
+
     def test_baidu_connection(self):
         """测试百度OCR连接"""
         try:
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@File    :   batch_dashboard.py
+@Time    :   2025/04/03
+@Author  :   Maker
+@Version :   1.0
+'''
+
+"""
+批处理面板
+定时读取流水线指标(PipelineMetrics)，显示各阶段的排队数、处理中数量、吞吐量和延迟分位数，
+并按实测吞吐量估计剩余时间；刷新频率有上限，处理再快也不会占满界面线程
+"""
+
+import time
+
+from PySide6.QtCore import QTimer, Qt
+from PySide6.QtWidgets import QWidget, QVBoxLayout, QLabel, QTableWidget, QTableWidgetItem, QHeaderView
+
+from models.token_estimator import format_duration
+
+
+# 面板中显示的阶段及其名称
+STAGE_LABELS = {
+    "read": "读取",
+    "ocr": "OCR",
+    "llm": "AI处理",
+    "write": "写出",
+    "total": "整体",
+}
+
+COLUMN_TITLES = ["阶段", "排队", "处理中", "完成", "失败", "吞吐(个/分)", "p50", "p95"]
+
+
+def format_latency(seconds):
+    """格式化单个任务的耗时"""
+    if seconds is None:
+        return "-"
+    if seconds < 1:
+        return f"{seconds * 1000:.0f}ms"
+    return f"{seconds:.1f}s"
+
+
+class BatchDashboard(QWidget):
+    """批处理实时面板"""
+
+    def __init__(self, parent=None, max_fps=4):
+        """
+        Args:
+            parent: 父控件
+            max_fps: 每秒最多刷新的次数
+        """
+        super().__init__(parent)
+        self.metrics = None
+        self.total = 0
+        self._started = None
+
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.summary_label = QLabel("尚未开始批量处理")
+        layout.addWidget(self.summary_label)
+
+        self.table = QTableWidget(len(STAGE_LABELS), len(COLUMN_TITLES))
+        self.table.setHorizontalHeaderLabels(COLUMN_TITLES)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table.setSelectionMode(QTableWidget.NoSelection)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        for row, label in enumerate(STAGE_LABELS.values()):
+            for column in range(len(COLUMN_TITLES)):
+                item = QTableWidgetItem(label if column == 0 else "-")
+                if column:
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.table.setItem(row, column, item)
+        self.table.setMaximumHeight(
+            self.table.horizontalHeader().height()
+            + self.table.verticalHeader().defaultSectionSize() * len(STAGE_LABELS) + 4
+        )
+        layout.addWidget(self.table)
+
+        self._timer = QTimer(self)
+        self._timer.setInterval(max(1, int(1000 / max_fps)))
+        self._timer.timeout.connect(self.refresh)
+
+    def start(self, metrics, total):
+        """开始显示一次批处理的指标
+
+        Args:
+            metrics: 流水线指标(PipelineMetrics)
+            total: 本次需要处理的文件数
+        """
+        self.metrics = metrics
+        self.total = total
+        self._started = time.monotonic()
+        self.refresh()
+        self._timer.start()
+
+    def stop(self):
+        """停止刷新，保留最后一次的指标"""
+        self._timer.stop()
+        self.refresh()
+
+    def finished_count(self, snapshot=None):
+        """已完成(含失败)的文件数"""
+        if self.metrics is None:
+            return 0
+        snapshot = snapshot or self.metrics.snapshot()
+        total_stage = snapshot["stages"].get("total", {})
+        return total_stage.get("completed", 0) + total_stage.get("failed", 0)
+
+    def eta(self, finished=None):
+        """按实测吞吐量估计的剩余时间(秒)，无法估计时为None"""
+        if self.metrics is None:
+            return None
+        if finished is None:
+            finished = self.finished_count()
+        return self.metrics.eta(self.total - finished)
+
+    def eta_text(self, finished=None):
+        """剩余时间的文字说明"""
+        return f"预计剩余 {format_duration(self.eta(finished))}"
+
+    def refresh(self):
+        """读取指标并刷新面板"""
+        if self.metrics is None:
+            return
+        snapshot = self.metrics.snapshot()
+        stages = snapshot["stages"]
+        gauges = snapshot["gauges"]
+
+        for row, name in enumerate(STAGE_LABELS):
+            stage = stages.get(name)
+            queued = gauges.get(f"queue.{name}")
+            throughput = stage["throughput"] if stage else None
+            values = [
+                "-" if queued is None else str(queued),
+                str(stage["in_flight"]) if stage else "-",
+                str(stage["completed"]) if stage else "-",
+                str(stage["failed"]) if stage else "-",
+                "-" if throughput is None else f"{throughput * 60:.1f}",
+                format_latency(stage["p50"]) if stage else "-",
+                format_latency(stage["p95"]) if stage else "-",
+            ]
+            for column, value in enumerate(values, start=1):
+                item = self.table.item(row, column)
+                if item.text() != value:
+                    item.setText(value)
+
+        finished = self.finished_count(snapshot)
+        elapsed = time.monotonic() - self._started
+        failed = stages.get("total", {}).get("failed", 0)
+        text = (
+            f"已处理 {finished}/{self.total} 个文件(失败 {failed} 个)，"
+            f"已用 {format_duration(elapsed)}，{self.eta_text(finished)}"
+        )
+        if self.summary_label.text() != text:
+            self.summary_label.setText(text)
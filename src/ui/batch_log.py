@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@File    :   batch_log.py
+@Time    :   2025/04/03
+@Author  :   Maker
+@Version :   1.0
+'''
+
+"""
+批处理日志
+任意线程都可以写入日志，事件先放入队列，由界面线程按限定的帧率批量刷新到日志视图；
+视图只保留最近的若干行，完整日志以JSON Lines格式写入文件，供之后查看
+"""
+
+import json
+import time
+from collections import deque
+from pathlib import Path
+
+from PySide6.QtCore import QObject, QTimer
+from PySide6.QtWidgets import QPlainTextEdit
+
+
+class LogView(QPlainTextEdit):
+    """只读日志视图，超过最大行数时自动丢弃最早的行"""
+
+    def __init__(self, parent=None, max_lines=5000):
+        super().__init__(parent)
+        self.setReadOnly(True)
+        self.setUndoRedoEnabled(False)
+        self.setMaximumBlockCount(max_lines)
+
+
+class BatchLog(QObject):
+    """日志收集器"""
+
+    def __init__(self, view, max_lines=5000, max_fps=10, parent=None):
+        """
+        Args:
+            view: 日志视图(LogView)
+            max_lines: 视图中保留的最大行数
+            max_fps: 每秒最多刷新视图的次数
+            parent: 父对象
+        """
+        super().__init__(parent)
+        self.view = view
+        self.max_lines = max_lines
+        # deque的append和popleft是原子操作，工作线程写入时无需加锁
+        self._queue = deque()
+        self._spill = None
+        self.spill_path = None
+
+        # 界面线程定时取出队列中的日志，刷新频率不超过max_fps，队列为空时几乎没有开销
+        self._timer = QTimer(self)
+        self._timer.setInterval(max(1, int(1000 / max_fps)))
+        self._timer.timeout.connect(self.flush)
+        self._timer.start()
+
+    def log(self, message, level="info", **fields):
+        """写入一条日志(可在任意线程调用)
+
+        Args:
+            message: 日志文本
+            level: 级别(info/warning/error)
+            fields: 附加的结构化字段(如file、stage)，只写入日志文件
+        """
+        event = {"time": time.time(), "level": level, "message": str(message)}
+        event.update(fields)
+        self._queue.append(event)
+
+    def append(self, message):
+        """写入一条普通日志，与QTextEdit.append用法相同"""
+        self.log(message)
+
+    def clear(self):
+        """清空视图和尚未显示的日志"""
+        self.flush()
+        self.view.clear()
+
+    def open_spill(self, path, backups=3):
+        """开始将完整日志写入JSON Lines文件，每次运行一个文件
+
+        Args:
+            path: 日志文件路径
+            backups: 保留之前几次运行的日志(path.1为上一次)，更早的删除
+        """
+        self.close_spill()
+        self.spill_path = Path(path)
+        self.spill_path.parent.mkdir(parents=True, exist_ok=True)
+        # 轮转之前的日志，避免文件随运行次数无限增长
+        for index in range(backups, 0, -1):
+            source = self.spill_path if index == 1 else self.spill_path.with_name(f"{self.spill_path.name}.{index - 1}")
+            target = self.spill_path.with_name(f"{self.spill_path.name}.{index}")
+            if source.exists():
+                source.replace(target)
+        self._spill = open(self.spill_path, "w", encoding="utf-8")
+
+    def close_spill(self):
+        """写入剩余日志并关闭日志文件"""
+        self.flush()
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+    def flush(self):
+        """将队列中的日志写入文件并一次性追加到视图"""
+        if not self._queue:
+            return
+        events = []
+        while self._queue:
+            events.append(self._queue.popleft())
+
+        if self._spill is not None:
+            self._spill.write(
+                "".join(json.dumps(event, ensure_ascii=False) + "\n" for event in events)
+            )
+            self._spill.flush()
+
+        # 视图只保留最后max_lines行，超出部分无需追加
+        lines = []
+        for event in events[-self.max_lines:]:
+            lines.extend(event["message"].split("\n"))
+        self.view.appendPlainText("\n".join(lines[-self.max_lines:]))
+        scrollbar = self.view.verticalScrollBar()
+        scrollbar.setValue(scrollbar.maximum())
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@File    :   document_editor.py
+@Time    :   2025/04/03
+@Author  :   Maker
+@Version :   1.0
+'''
+
+"""
+纯文本文档编辑器
+基于QPlainTextEdit，只做纯文本排版；文本超过阈值时进入大文档模式：关闭撤销记录，
+先载入开头的一段，滚动到底部附近时再分段载入后面的内容。完整文本在未被编辑时
+直接返回缓存的字符串，不必每次都从控件中取出整个文档
+"""
+
+from PySide6.QtWidgets import QPlainTextEdit
+from PySide6.QtGui import QTextCursor, QKeySequence
+
+
+# 超过该字符数时进入大文档模式
+LARGE_DOCUMENT_THRESHOLD = 1_000_000
+
+# 大文档模式下每次载入的字符数
+CHUNK_SIZE = 200_000
+
+
+class DocumentEditor(QPlainTextEdit):
+    """支持大文档分段载入的纯文本编辑器"""
+
+    def __init__(self, parent=None, threshold=LARGE_DOCUMENT_THRESHOLD, chunk_size=CHUNK_SIZE):
+        """
+        Args:
+            parent: 父控件
+            threshold: 进入大文档模式的字符数
+            chunk_size: 大文档模式下每次载入的字符数
+        """
+        super().__init__(parent)
+        self.threshold = threshold
+        self.chunk_size = chunk_size
+        self.large_mode = False
+        # 尚未载入控件的剩余文本：字符串片段列表及第一个片段中已载入的长度
+        self._remaining = []
+        self._remaining_offset = 0
+        # 完整文本的缓存，控件内容被编辑后失效；追加的文本先暂存，取完整文本时再合并
+        self._cache = ""
+        self._appended = []
+        # 程序内部修改控件内容时不使缓存失效
+        self._updating = False
+
+        self.textChanged.connect(self._on_text_changed)
+        self.verticalScrollBar().valueChanged.connect(self._on_scrolled)
+
+    def _on_text_changed(self):
+        if not self._updating:
+            self._cache = None
+            self._appended = []
+
+    def _on_scrolled(self, value):
+        """滚动到已载入内容的底部附近时载入下一段"""
+        if not self._remaining:
+            return
+        scrollbar = self.verticalScrollBar()
+        if value >= scrollbar.maximum() - scrollbar.pageStep():
+            self.load_more()
+
+    def _set_large_mode(self, enabled):
+        if enabled == self.large_mode:
+            return
+        self.large_mode = enabled
+        # 大文档的撤销记录会使内存占用翻倍
+        self.setUndoRedoEnabled(not enabled)
+
+    def set_document_text(self, text):
+        """设置全部文本，超过阈值时只载入开头的一段
+
+        Args:
+            text: 文本内容
+        """
+        text = text or ""
+        self._set_large_mode(len(text) > self.threshold)
+        if self.large_mode:
+            end = self._chunk_end(text, 0)
+            loaded = text[:end]
+            self._remaining = [text] if end < len(text) else []
+            self._remaining_offset = end
+        else:
+            loaded = text
+            self._remaining = []
+            self._remaining_offset = 0
+        self._updating = True
+        try:
+            self.setPlainText(loaded)
+        finally:
+            self._updating = False
+        self._cache = text
+        self._appended = []
+
+    def clear(self):
+        """清空文本并退出大文档模式"""
+        self.set_document_text("")
+
+    def text(self):
+        """获取完整文本(包括尚未载入的部分)"""
+        if self._cache is None:
+            self._cache = self.toPlainText() + self._remaining_text()
+        elif self._appended:
+            self._cache += "".join(self._appended)
+            self._appended = []
+        return self._cache
+
+    def _remaining_text(self):
+        if not self._remaining:
+            return ""
+        return self._remaining[0][self._remaining_offset:] + "".join(self._remaining[1:])
+
+    def _chunk_end(self, text, start):
+        """从start开始的一段的结束位置，尽量在换行处截断"""
+        end = start + self.chunk_size
+        if end >= len(text):
+            return len(text)
+        newline = text.rfind("\n", start, end)
+        return newline + 1 if newline > start else end
+
+    def load_more(self):
+        """载入下一段尚未载入的文本
+
+        Returns:
+            bool: 是否还有未载入的文本
+        """
+        if not self._remaining:
+            return False
+        if len(self._remaining) > 1:
+            # 合并追加的片段，保证分段在换行处截断
+            self._remaining = [self._remaining_text()]
+            self._remaining_offset = 0
+        text = self._remaining[0]
+        start = self._remaining_offset
+        end = self._chunk_end(text, start)
+        self._insert_at_end(text[start:end])
+        if end >= len(text):
+            self._remaining = []
+            self._remaining_offset = 0
+        else:
+            self._remaining_offset = end
+        return bool(self._remaining)
+
+    def load_all(self):
+        """载入全部剩余文本"""
+        if self._remaining:
+            remaining = self._remaining_text()
+            self._remaining = []
+            self._remaining_offset = 0
+            self._insert_at_end(remaining)
+
+    def _insert_at_end(self, text):
+        """在控件末尾插入文本，不移动用户的光标，也不使完整文本缓存失效"""
+        self._updating = True
+        try:
+            cursor = QTextCursor(self.document())
+            cursor.movePosition(QTextCursor.End)
+            cursor.insertText(text)
+        finally:
+            self._updating = False
+
+    def append_text(self, text):
+        """在文档末尾追加文本(如流式输出)，文本超过阈值时自动进入大文档模式
+
+        Args:
+            text: 追加的文本
+        """
+        if not text:
+            return
+        if self._remaining:
+            # 末尾还有未载入的内容，追加到剩余文本中，等滚动到底部时再载入
+            self._remaining.append(text)
+        else:
+            self._insert_at_end(text)
+        if self._cache is not None:
+            self._appended.append(text)
+        if not self.large_mode and self.document().characterCount() > self.threshold:
+            self._set_large_mode(True)
+
+    def keyPressEvent(self, event):
+        # Ctrl+End跳转到文档末尾前先载入全部内容
+        if event.matches(QKeySequence.MoveToEndOfDocument):
+            self.load_all()
+        super().keyPressEvent(event)
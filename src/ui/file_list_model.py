@@ -0,0 +1,478 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@File    :   file_list_model.py
+@Time    :   2025/04/03
+@Author  :   Maker
+@Version :   1.0
+'''
+
+"""
+批处理文件列表模型
+文件信息按列保存在紧凑的数组中(目录编号、文件名、大小、状态码、耗时)，
+视图只绘制可见的行；排序和筛选只重排行号数组，状态变化合并后批量通知视图
+"""
+
+import os
+import time
+from array import array
+from collections import deque
+from pathlib import Path
+
+from PySide6.QtCore import Qt, QAbstractTableModel, QModelIndex, QTimer
+from PySide6.QtGui import QFont
+
+
+# 文件处理状态码
+STATUS_PENDING = 0
+STATUS_RUNNING = 1
+STATUS_DONE = 2
+STATUS_FAILED = 3
+STATUS_SKIPPED = 4
+
+STATUS_LABELS = {
+    STATUS_PENDING: "等待",
+    STATUS_RUNNING: "处理中",
+    STATUS_DONE: "成功",
+    STATUS_FAILED: "失败",
+    STATUS_SKIPPED: "已完成(跳过)",
+}
+
+# 列定义
+COLUMN_THUMBNAIL = 0
+COLUMN_NAME = 1
+COLUMN_TYPE = 2
+COLUMN_SIZE = 3
+COLUMN_STATUS = 4
+COLUMN_ELAPSED = 5
+COLUMN_TITLES = ["预览", "文件名", "类型", "大小", "状态", "耗时"]
+
+# 缩略图边长(像素)
+THUMBNAIL_SIZE = 32
+
+
+def format_size(size):
+    """格式化文件大小"""
+    for unit in ["B", "KB", "MB"]:
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+class FileTable:
+    """按列存储的文件表，10万个文件也只占用少量内存"""
+
+    def __init__(self):
+        self.dirs = []
+        self.dir_index = array("I")
+        self.names = []
+        self.sizes = array("q")
+        self.statuses = array("B")
+        # 耗时(秒)，负数表示未知
+        self.elapsed = array("f")
+        self.errors = {}
+        # 用户指定优先处理的文件行号
+        self.pinned = set()
+        self._dir_ids = {}
+        self._rows = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, path, size):
+        """添加文件"""
+        directory, name = os.path.split(os.fspath(path))
+        self.append(self.dir_id(directory), name, size)
+
+    def dir_id(self, directory):
+        """目录的编号，同一目录下的文件共用一个目录字符串"""
+        dir_id = self._dir_ids.get(directory)
+        if dir_id is None:
+            dir_id = self._dir_ids[directory] = len(self.dirs)
+            self.dirs.append(directory)
+        return dir_id
+
+    def append(self, dir_id, name, size):
+        """按目录编号添加文件"""
+        self.dir_index.append(dir_id)
+        self.names.append(name)
+        self.sizes.append(size)
+        self.statuses.append(STATUS_PENDING)
+        self.elapsed.append(-1.0)
+        self._rows = None
+
+    def path(self, row):
+        """第row个文件的路径"""
+        return Path(self.dirs[self.dir_index[row]]) / self.names[row]
+
+    def paths(self):
+        """所有文件的路径列表"""
+        return [self.path(row) for row in range(len(self.names))]
+
+    def row_of(self, path):
+        """根据路径查找行号，不存在时返回None"""
+        if self._rows is None:
+            self._rows = {
+                os.path.join(self.dirs[dir_id], name): row
+                for row, (dir_id, name) in enumerate(zip(self.dir_index, self.names))
+            }
+        return self._rows.get(str(path))
+
+
+class FileListModel(QAbstractTableModel):
+    """虚拟化的文件列表模型，配合QTableView使用"""
+
+    def __init__(self, parent=None, flush_interval=200, thumbnail_loader=None, image_extensions=()):
+        """
+        Args:
+            parent: 父对象
+            flush_interval: 状态变化合并通知视图的间隔(毫秒)
+            thumbnail_loader: 缩略图加载器(ThumbnailLoader)，提供时图片文件显示缩略图
+            image_extensions: 显示缩略图的扩展名列表
+        """
+        super().__init__(parent)
+        self.table = FileTable()
+        self.thumbnail_loader = thumbnail_loader
+        self.image_extensions = set(image_extensions)
+        # 已加载完成、等待通知视图刷新的缩略图所在行
+        self._dirty_thumbnails = set()
+        if thumbnail_loader is not None:
+            thumbnail_loader.ready.connect(self._on_thumbnail_ready)
+        # 当前显示的行(排序、筛选后)对应的文件行号，以及文件行号到显示位置的映射
+        self._order = array("I")
+        self._position = array("i")
+        self._sort_column = None
+        self._sort_order = Qt.AscendingOrder
+        self._filter_text = ""
+        self._filter_status = None
+        self._dirty = set()
+
+        self._flush_timer = QTimer(self)
+        self._flush_timer.setSingleShot(True)
+        self._flush_timer.setInterval(flush_interval)
+        self._flush_timer.timeout.connect(self.flush)
+
+    # ---- 数据加载 ----
+
+    def load_folder(self, folder, extensions):
+        """扫描文件夹(不含子目录)中指定扩展名的文件
+
+        Args:
+            folder: 文件夹路径
+            extensions: 扩展名列表(小写，含点)
+        Returns:
+            int: 文件数
+        """
+        table = FileTable()
+        extensions = set(extensions)
+        dir_id = table.dir_id(os.fspath(folder))
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                name = entry.name
+                if "." + name.rpartition(".")[2].lower() not in extensions:
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    size = entry.stat().st_size
+                except OSError:
+                    continue
+                table.append(dir_id, name, size)
+        self.set_table(table)
+        return len(table)
+
+    def set_table(self, table):
+        """替换整个文件表"""
+        self.beginResetModel()
+        self.table = table
+        self._dirty.clear()
+        self._dirty_thumbnails.clear()
+        self._rebuild_order()
+        self.endResetModel()
+
+    def files(self):
+        """所有文件的路径列表"""
+        return self.table.paths()
+
+    def file_count(self):
+        return len(self.table)
+
+    def visible_count(self):
+        return len(self._order)
+
+    def path_at(self, index):
+        """视图中某一行对应的文件路径"""
+        return self.table.path(self._order[index.row()])
+
+    # ---- 优先处理 ----
+
+    def set_pinned(self, files, pinned=True):
+        """标记或取消文件的优先处理，批处理时这些文件最先开始
+
+        Args:
+            files: 文件路径列表
+            pinned: True为优先处理，False为取消
+        """
+        rows = set()
+        for file in files:
+            row = self.table.row_of(file)
+            if row is None:
+                continue
+            if pinned:
+                self.table.pinned.add(row)
+            else:
+                self.table.pinned.discard(row)
+            rows.add(row)
+        self._emit_changed(rows, COLUMN_NAME, COLUMN_NAME, [Qt.FontRole, Qt.ToolTipRole])
+
+    def is_pinned(self, file):
+        row = self.table.row_of(file)
+        return row is not None and row in self.table.pinned
+
+    def priorities(self):
+        """调度使用的优先级 {路径: 优先级}，只包含优先处理的文件"""
+        return {self.table.path(row): 1 for row in self.table.pinned}
+
+    # ---- 状态更新 ----
+
+    def set_status(self, file, status, elapsed=None, error=None):
+        """更新文件状态，视图的刷新合并后定时进行
+
+        Args:
+            file: 文件路径
+            status: 状态码(STATUS_*)
+            elapsed: 耗时(秒)
+            error: 失败原因
+        """
+        row = self.table.row_of(file)
+        if row is None:
+            return
+        self.table.statuses[row] = status
+        if elapsed is not None:
+            self.table.elapsed[row] = elapsed
+        if error is not None:
+            self.table.errors[row] = str(error)
+        else:
+            self.table.errors.pop(row, None)
+        self._dirty.add(row)
+        if not self._flush_timer.isActive():
+            self._flush_timer.start()
+
+    def reset_status(self, files=None):
+        """将文件(默认全部)恢复为等待状态"""
+        rows = range(len(self.table)) if files is None else [self.table.row_of(file) for file in files]
+        for row in rows:
+            if row is not None:
+                self.table.statuses[row] = STATUS_PENDING
+                self.table.elapsed[row] = -1.0
+                self.table.errors.pop(row, None)
+                self._dirty.add(row)
+        self.flush()
+
+    def status_counts(self):
+        """各状态的文件数"""
+        counts = dict.fromkeys(STATUS_LABELS, 0)
+        for status in self.table.statuses:
+            counts[status] += 1
+        return counts
+
+    def _on_thumbnail_ready(self, path, size):
+        """缩略图加载完成，合并后刷新所在的行"""
+        if size != THUMBNAIL_SIZE:
+            return
+        row = self.table.row_of(path)
+        if row is None:
+            return
+        self._dirty_thumbnails.add(row)
+        if not self._flush_timer.isActive():
+            self._flush_timer.start()
+
+    def flush(self):
+        """将积累的状态变化通知视图：按显示位置合并为连续区间，每个区间只发出一次dataChanged"""
+        self._flush_timer.stop()
+        if self._dirty_thumbnails:
+            thumbnails = self._dirty_thumbnails
+            self._dirty_thumbnails = set()
+            self._emit_changed(thumbnails, COLUMN_THUMBNAIL, COLUMN_THUMBNAIL, [Qt.DecorationRole])
+        if not self._dirty:
+            return
+        dirty = self._dirty
+        self._dirty = set()
+
+        # 按状态筛选时显示的行数会变化，需要重置模型
+        if self._filter_status is not None:
+            self.beginResetModel()
+            self._rebuild_order()
+            self.endResetModel()
+            return
+        # 按状态或耗时排序时行的位置会变化，重新排列
+        if self._sort_column in (COLUMN_STATUS, COLUMN_ELAPSED):
+            self.layoutAboutToBeChanged.emit()
+            old_order = self._order
+            self._rebuild_order()
+            self._update_persistent_indexes(old_order)
+            self.layoutChanged.emit()
+            return
+
+        self._emit_changed(dirty, COLUMN_STATUS, len(COLUMN_TITLES) - 1)
+
+    def _emit_changed(self, rows, first_column, last_column, roles=()):
+        """按显示位置将变化的行合并为连续区间，每个区间发出一次dataChanged"""
+        positions = sorted(self._position[row] for row in rows if self._position[row] >= 0)
+        start = previous = None
+        for position in positions + [None]:
+            if start is not None and (position is None or position != previous + 1):
+                self.dataChanged.emit(self.index(start, first_column), self.index(previous, last_column), list(roles))
+                start = None
+            if position is not None and start is None:
+                start = position
+            previous = position
+
+    # ---- 排序与筛选 ----
+
+    def set_filter(self, text="", status=None):
+        """按文件名(不区分大小写的子串)和状态筛选"""
+        self._filter_text = (text or "").strip().lower()
+        self._filter_status = status
+        self.beginResetModel()
+        self._rebuild_order()
+        self.endResetModel()
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self._sort_column = column
+        self._sort_order = order
+        self.layoutAboutToBeChanged.emit()
+        old_order = self._order
+        self._rebuild_order()
+        self._update_persistent_indexes(old_order)
+        self.layoutChanged.emit()
+
+    def _sort_key(self, column):
+        table = self.table
+        if column == COLUMN_NAME:
+            return lambda row: table.names[row].lower()
+        if column == COLUMN_TYPE:
+            return lambda row: os.path.splitext(table.names[row])[1].lower()
+        if column == COLUMN_SIZE:
+            return table.sizes.__getitem__
+        if column == COLUMN_STATUS:
+            return table.statuses.__getitem__
+        if column == COLUMN_ELAPSED:
+            return table.elapsed.__getitem__
+        return None
+
+    def _rebuild_order(self):
+        """根据筛选和排序条件重建显示顺序"""
+        table = self.table
+        rows = range(len(table))
+        if self._filter_text:
+            text = self._filter_text
+            rows = [row for row in rows if text in table.names[row].lower()]
+        if self._filter_status is not None:
+            status = self._filter_status
+            rows = [row for row in rows if table.statuses[row] == status]
+
+        key = self._sort_key(self._sort_column)
+        if key is not None:
+            rows = sorted(rows, key=key, reverse=self._sort_order == Qt.DescendingOrder)
+
+        self._order = array("I", rows)
+        self._position = array("i", [-1]) * len(table)
+        for position, row in enumerate(self._order):
+            self._position[row] = position
+
+    def _update_persistent_indexes(self, old_order):
+        """排序后保持视图中的选中行"""
+        persistent = self.persistentIndexList()
+        if not persistent:
+            return
+        new_indexes = []
+        for index in persistent:
+            row = old_order[index.row()] if index.row() < len(old_order) else None
+            position = self._position[row] if row is not None else -1
+            new_indexes.append(self.index(position, index.column()) if position >= 0 else QModelIndex())
+        self.changePersistentIndexList(persistent, new_indexes)
+
+    # ---- QAbstractTableModel接口 ----
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._order)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMN_TITLES)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return COLUMN_TITLES[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = self._order[index.row()]
+        table = self.table
+        column = index.column()
+
+        if role == Qt.DisplayRole:
+            if column == COLUMN_NAME:
+                return table.names[row]
+            if column == COLUMN_TYPE:
+                return os.path.splitext(table.names[row])[1].lower().lstrip(".")
+            if column == COLUMN_SIZE:
+                return format_size(table.sizes[row])
+            if column == COLUMN_STATUS:
+                return STATUS_LABELS.get(table.statuses[row], "")
+            if column == COLUMN_ELAPSED:
+                elapsed = table.elapsed[row]
+                return f"{elapsed:.1f} 秒" if elapsed >= 0 else ""
+        elif role == Qt.DecorationRole:
+            if column == COLUMN_THUMBNAIL and self.thumbnail_loader is not None:
+                name = table.names[row]
+                if "." + name.rpartition(".")[2].lower() in self.image_extensions:
+                    # 只有视图中可见的行会请求缩略图，未加载完成时先返回空
+                    return self.thumbnail_loader.get(table.path(row), THUMBNAIL_SIZE)
+        elif role == Qt.ToolTipRole:
+            if column == COLUMN_STATUS and row in table.errors:
+                return table.errors[row]
+            if column == COLUMN_NAME:
+                if row in table.pinned:
+                    return f"{table.path(row)}(优先处理)"
+                return str(table.path(row))
+        elif role == Qt.FontRole and column == COLUMN_NAME and row in table.pinned:
+            font = QFont()
+            font.setBold(True)
+            return font
+        elif role == Qt.TextAlignmentRole and column in (COLUMN_SIZE, COLUMN_ELAPSED):
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        return None
+
+
+class FileTimer:
+    """记录各文件的处理起止时间，工作线程调用start/finish，主线程读取新开始的文件和耗时"""
+
+    def __init__(self):
+        self._started = {}
+        self._finished = {}
+        self._new = deque()
+
+    def start(self, file):
+        self._started[str(file)] = time.monotonic()
+        self._new.append(file)
+
+    def finish(self, file):
+        self._finished[str(file)] = time.monotonic()
+
+    def pop_started(self):
+        """取出上次调用之后开始处理的文件"""
+        files = []
+        while self._new:
+            files.append(self._new.popleft())
+        return files
+
+    def elapsed(self, file):
+        """文件的处理耗时(秒)，尚未结束时为到现在的耗时，未开始时返回None"""
+        started = self._started.get(str(file))
+        if started is None:
+            return None
+        return self._finished.get(str(file), time.monotonic()) - started
@@ -14,21 +14,46 @@ AI笔记整理工具的主界面
 
 import os
 import sys
-import json
+import time
 from pathlib import Path
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 from PySide6.QtWidgets import (
     QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
     QPushButton, QLabel, QTextEdit, QComboBox, 
     QFileDialog, QMessageBox, QTabWidget, QGroupBox, 
     QFormLayout, QLineEdit, QCheckBox, QSpinBox, QDialog,
-    QApplication, QProgressDialog, QListWidget, QListWidgetItem
+    QApplication, QProgressDialog, QListWidget, QListWidgetItem, QSplitter,
+    QTableView, QHeaderView, QAbstractItemView, QMenu
 )
 from PySide6.QtCore import Qt, QSize, QTimer, QUrl
 from PySide6.QtGui import QPixmap, QDesktopServices
 
 from utils.file_handler import FileHandler
-from models.ai_processor import get_processor
+from utils.settings_service import get_settings_service
+from utils.pipeline_metrics import PipelineMetrics
+from utils.adaptive_limiter import get_limiter_registry
+from models.ai_processor import get_processor, get_router, learned_concurrency, CancelToken, RequestCancelledError
+from models.token_estimator import BatchPlanner, ThroughputHistory, format_duration
+from models.note_packer import NotePacker
+from utils.batch_pipeline import BatchPipeline
+from utils.batch_scheduler import (
+    BatchScheduler, STRATEGY_LONGEST_FIRST, STRATEGY_SHORTEST_FIRST, STRATEGY_INPUT_ORDER
+)
+from utils.job_journal import JobJournal
+from utils.docx_markdown import DOCX_MODE_AUTO, DOCX_MODE_LLM, DOCX_MODE_LOCAL
+from utils.markdown_format import split_format_options, apply_format_options
+from ocr.image_dedup import ImageDeduplicator
 from ocr.ocr_processor import OCRProcessor
+from ui.markdown_preview import MarkdownPreview
+from ui.document_editor import DocumentEditor
+from ui.batch_log import BatchLog, LogView
+from ui.batch_dashboard import BatchDashboard, format_latency, STAGE_LABELS
+from ui.thumbnail_loader import ThumbnailLoader
+from ui.file_list_model import (
+    FileListModel, FileTimer, STATUS_LABELS, STATUS_PENDING, STATUS_RUNNING, STATUS_DONE, STATUS_FAILED, STATUS_SKIPPED,
+    THUMBNAIL_SIZE, COLUMN_THUMBNAIL, COLUMN_NAME
+)
 
 
 class MainWindow(QMainWindow):
@@ -48,6 +73,19 @@ class MainWindow(QMainWindow):
         # 初始化模型信息字典
         self.models_info = {}
         
+        # 设置服务：启动时解析一次设置文件，之后的读取都使用内存中的快照
+        self.settings_service = get_settings_service()
+        
+        # 单个文件读取/OCR的耗时记录，用于估计导入文件所需的时间
+        self.file_metrics = PipelineMetrics()
+        
+        # 缩略图在后台线程解码，按内容哈希缓存在内存和磁盘中
+        self.thumbnail_loader = ThumbnailLoader(parent=self)
+        
+        # 最近一次整理笔记的模型结果和应用格式选项后显示的内容，修改格式选项时在本地重新生成
+        self._last_raw_result = None
+        self._last_rendered_result = None
+        
         # 初始化UI组件
         self.init_ui()
         
@@ -111,7 +149,7 @@ class MainWindow(QMainWindow):
         
         # 笔记内容文本区域
         input_layout = QHBoxLayout()
-        self.input_text = QTextEdit()
+        self.input_text = DocumentEditor()
         self.input_text.setPlaceholderText("在此粘贴笔记内容...")
         self.input_text.setMinimumHeight(200)  # 设置最小高度
         input_layout.addWidget(self.input_text)
@@ -139,33 +177,45 @@ class MainWindow(QMainWindow):
         self.header_level_spin = QSpinBox()
         self.header_level_spin.setRange(1, 6)
         self.header_level_spin.setValue(1)
+        self.header_level_spin.valueChanged.connect(self._reformat_output)
         options_layout.addRow("标题级别:", self.header_level_spin)
         
         # 列表样式
         self.list_style_combo = QComboBox()
         self.list_style_combo.addItems(["无序列表 (-)", "有序列表 (1.)"])
+        self.list_style_combo.currentIndexChanged.connect(self._reformat_output)
         options_layout.addRow("列表样式:", self.list_style_combo)
         
         # 代码块语言
         self.code_language_edit = QLineEdit()
         self.code_language_edit.setText("text")
+        self.code_language_edit.editingFinished.connect(self._reformat_output)
         options_layout.addRow("代码块默认语言:", self.code_language_edit)
         
         layout.addWidget(options_group)
         
         # 处理按钮
-        process_button = QPushButton("整理笔记")
-        process_button.clicked.connect(self.process_note)
-        layout.addWidget(process_button)
+        self.process_button = QPushButton("整理笔记")
+        self.process_button.clicked.connect(self.process_note)
+        layout.addWidget(self.process_button)
         
         # 结果区域
         result_group = QGroupBox("Markdown结果")
         result_layout = QVBoxLayout(result_group)
         
-        self.output_text = QTextEdit()
-        self.output_text.setReadOnly(True)
+        # 左侧为可编辑的Markdown源码，右侧为增量渲染的预览
+        result_splitter = QSplitter(Qt.Horizontal)
+        self.output_text = DocumentEditor()
         self.output_text.setMinimumHeight(250)  # 设置最小高度
-        result_layout.addWidget(self.output_text)
+        self.output_preview = MarkdownPreview()
+        self.output_preview.setMinimumHeight(250)
+        # 预览渲染时才取出完整文本，编辑大文档时每次按键不必复制整个文档
+        self.output_text.textChanged.connect(
+            lambda: self.output_preview.set_markdown_source(self.output_text.text)
+        )
+        result_splitter.addWidget(self.output_text)
+        result_splitter.addWidget(self.output_preview)
+        result_layout.addWidget(result_splitter)
         
         # 导出按钮
         export_button = QPushButton("导出Markdown")
@@ -198,26 +248,152 @@ class MainWindow(QMainWindow):
         files_group = QGroupBox("文件列表")
         files_layout = QVBoxLayout(files_group)
         
-        self.files_list = QTextEdit()
-        self.files_list.setReadOnly(True)
-        self.files_list.setMinimumHeight(150)  # 设置最小高度
-        files_layout.addWidget(self.files_list)
+        # 筛选条件
+        filter_layout = QHBoxLayout()
+        self.files_filter_edit = QLineEdit()
+        self.files_filter_edit.setPlaceholderText("按文件名筛选")
+        self.files_status_filter = QComboBox()
+        self.files_status_filter.addItem("全部状态", None)
+        for status, label in STATUS_LABELS.items():
+            self.files_status_filter.addItem(label, status)
+        self.files_summary_label = QLabel("")
+        filter_layout.addWidget(self.files_filter_edit)
+        filter_layout.addWidget(self.files_status_filter)
+        filter_layout.addWidget(self.files_summary_label)
+        files_layout.addLayout(filter_layout)
+        
+        # 文件表格只绘制可见的行，大文件夹也能流畅滚动
+        self.file_model = FileListModel(
+            self, thumbnail_loader=self.thumbnail_loader, image_extensions=FileHandler.SUPPORTED_IMAGE_FORMATS
+        )
+        self.files_view = QTableView()
+        self.files_view.setModel(self.file_model)
+        self.files_view.setMinimumHeight(150)  # 设置最小高度
+        self.files_view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.files_view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.files_view.verticalHeader().setVisible(False)
+        self.files_view.verticalHeader().setDefaultSectionSize(THUMBNAIL_SIZE + 4)
+        self.files_view.setIconSize(QSize(THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        self.files_view.horizontalHeader().setSectionResizeMode(QHeaderView.Interactive)
+        self.files_view.horizontalHeader().setStretchLastSection(True)
+        self.files_view.setColumnWidth(COLUMN_THUMBNAIL, THUMBNAIL_SIZE + 12)
+        self.files_view.setColumnWidth(COLUMN_NAME, 320)
+        self.files_view.setSortingEnabled(True)
+        self.files_view.sortByColumn(COLUMN_NAME, Qt.AscendingOrder)
+        self.files_view.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.files_view.customContextMenuRequested.connect(self._show_files_menu)
+        files_layout.addWidget(self.files_view)
+        
+        # 输入停止片刻后再筛选，避免每个按键都遍历整个列表
+        self.files_filter_timer = QTimer(self)
+        self.files_filter_timer.setSingleShot(True)
+        self.files_filter_timer.setInterval(200)
+        self.files_filter_timer.timeout.connect(self._apply_file_filter)
+        self.files_filter_edit.textChanged.connect(lambda: self.files_filter_timer.start())
+        self.files_status_filter.currentIndexChanged.connect(self._apply_file_filter)
         
         layout.addWidget(files_group)
         
+        # 多模型负载均衡选项
+        self.batch_router_check = QCheckBox("多模型负载均衡（同时使用所有已配置的模型）")
+        self.batch_router_check.setToolTip("按模型权重和最大并发数将请求分发到所有模型，出错或超时时自动切换")
+        layout.addWidget(self.batch_router_check)
+        
+        # 请求对冲选项
+        hedge_layout = QHBoxLayout()
+        self.batch_hedge_check = QCheckBox("请求对冲")
+        self.batch_hedge_check.setToolTip("请求在历史首字耗时的指定分位数内仍无响应时，向其他模型发送副本请求，先完成者胜出")
+        self.batch_hedge_percentile = QSpinBox()
+        self.batch_hedge_percentile.setRange(50, 99)
+        self.batch_hedge_percentile.setValue(95)
+        self.batch_hedge_percentile.setSuffix(" 分位")
+        hedge_layout.addWidget(self.batch_hedge_check)
+        hedge_layout.addWidget(QLabel("触发阈值:"))
+        hedge_layout.addWidget(self.batch_hedge_percentile)
+        hedge_layout.addStretch()
+        layout.addLayout(hedge_layout)
+        
+        # 离线模式选项
+        self.batch_offline_check = QCheckBox("离线模式（使用服务商的异步批处理接口，适合大批量非实时转换）")
+        self.batch_offline_check.setToolTip("将所有笔记打包为一个批处理任务提交，费用更低、吞吐更高，但通常需要数分钟到数小时才能完成")
+        layout.addWidget(self.batch_offline_check)
+        
+        # 小笔记合并选项
+        self.batch_pack_check = QCheckBox("合并短笔记（多篇短笔记合并为一次请求，适合大量截图和短文本）")
+        self.batch_pack_check.setToolTip("格式选项相同的短笔记在token预算内合并为一个请求，按分隔行拆分回各个文件；分隔行损坏的笔记会单独重试。仅用于实时模式")
+        layout.addWidget(self.batch_pack_check)
+        
+        # 断点续传选项
+        self.batch_resume_check = QCheckBox("断点续传（跳过之前已完成的文件，从中断的阶段继续）")
+        self.batch_resume_check.setChecked(True)
+        self.batch_resume_check.setToolTip("处理进度记录在输出目录的.job_journal.db中，取消勾选则重新处理所有文件")
+        layout.addWidget(self.batch_resume_check)
+        
+        # 重复图片去重选项
+        dedup_layout = QHBoxLayout()
+        self.batch_dedup_check = QCheckBox("重复图片去重")
+        self.batch_dedup_check.setChecked(False)
+        self.batch_dedup_check.setToolTip("重复截图、缩放或重新压缩的副本只OCR一次，其余复用识别结果；只有逐像素比较几乎相同的图片才会复用，哈希索引保存在输出目录的.image_hashes.db中")
+        self.batch_dedup_distance = QSpinBox()
+        self.batch_dedup_distance.setRange(0, 32)
+        self.batch_dedup_distance.setValue(10)
+        self.batch_dedup_distance.setToolTip("感知哈希(256位)相差不超过该位数的图片才会逐像素比较，确认内容相同后复用识别结果")
+        dedup_layout.addWidget(self.batch_dedup_check)
+        dedup_layout.addWidget(QLabel("汉明距离阈值:"))
+        dedup_layout.addWidget(self.batch_dedup_distance)
+        dedup_layout.addStretch()
+        layout.addLayout(dedup_layout)
+        
+        # Word文档处理方式
+        docx_layout = QHBoxLayout()
+        docx_layout.addWidget(QLabel("Word文档处理:"))
+        self.batch_docx_mode = QComboBox()
+        self.batch_docx_mode.addItem("自动（结构清晰的文档直接转换）", DOCX_MODE_AUTO)
+        self.batch_docx_mode.addItem("始终使用AI处理", DOCX_MODE_LLM)
+        self.batch_docx_mode.addItem("仅本地转换", DOCX_MODE_LOCAL)
+        self.batch_docx_mode.setToolTip("使用了标题样式且几乎没有手动排版的Word文档直接保留其结构转换为Markdown，不调用模型；其余文档只让模型整理格式")
+        docx_layout.addWidget(self.batch_docx_mode)
+        docx_layout.addStretch()
+        layout.addLayout(docx_layout)
+        
+        # 处理顺序
+        order_layout = QHBoxLayout()
+        order_layout.addWidget(QLabel("处理顺序:"))
+        self.batch_order_combo = QComboBox()
+        self.batch_order_combo.addItem("耗时长的优先（总耗时最短）", STRATEGY_LONGEST_FIRST)
+        self.batch_order_combo.addItem("耗时短的优先（尽快看到结果）", STRATEGY_SHORTEST_FIRST)
+        self.batch_order_combo.addItem("按文件列表顺序", STRATEGY_INPUT_ORDER)
+        self.batch_order_combo.setToolTip("按文件大小、页数和类型并参考历史实测耗时估算每个文件的处理时间来安排顺序；在文件列表中右键可将文件设为优先处理")
+        order_layout.addWidget(self.batch_order_combo)
+        order_layout.addStretch()
+        layout.addLayout(order_layout)
+        
         # 批量处理按钮
+        batch_buttons_layout = QHBoxLayout()
+        estimate_button = QPushButton("预估成本与耗时")
+        estimate_button.clicked.connect(self.estimate_batch)
         batch_process_button = QPushButton("批量处理")
         batch_process_button.clicked.connect(self.batch_process)
-        layout.addWidget(batch_process_button)
+        retry_button = QPushButton("重试失败文件")
+        retry_button.clicked.connect(self.retry_failed_files)
+        batch_buttons_layout.addWidget(estimate_button)
+        batch_buttons_layout.addWidget(batch_process_button)
+        batch_buttons_layout.addWidget(retry_button)
+        layout.addLayout(batch_buttons_layout)
         
         # 处理状态
         status_group = QGroupBox("处理状态")
         status_layout = QVBoxLayout(status_group)
         
-        self.status_text = QTextEdit()
-        self.status_text.setReadOnly(True)
+        # 各阶段的实时指标和按实测吞吐量估计的剩余时间
+        self.batch_dashboard = BatchDashboard()
+        status_layout.addWidget(self.batch_dashboard)
+        
+        # 日志视图只保留最近的行，工作线程写入的日志按限定帧率批量刷新
+        self.status_text = LogView()
         self.status_text.setMinimumHeight(200)  # 设置最小高度
         status_layout.addWidget(self.status_text)
+        self.batch_log = BatchLog(self.status_text, parent=self)
         
         layout.addWidget(status_group)
     
@@ -266,11 +442,19 @@ class MainWindow(QMainWindow):
         self.custom_api_key = QLineEdit()
         self.custom_api_key.setPlaceholderText("输入API密钥")
         self.custom_api_key.setEchoMode(QLineEdit.Password)
+        self.custom_model_weight = QSpinBox()
+        self.custom_model_weight.setRange(1, 100)
+        self.custom_model_weight.setToolTip("多模型负载均衡时的分配权重")
+        self.custom_model_concurrency = QSpinBox()
+        self.custom_model_concurrency.setRange(1, 64)
+        self.custom_model_concurrency.setToolTip("批量处理时该模型允许的最大并发请求数，实际并发数在此范围内按限流和响应耗时自动调整，并在下次处理时沿用")
         
         model_details_layout.addRow("模型名称:", self.custom_model_name)
         model_details_layout.addRow("显示名称:", self.custom_model_display_name)
         model_details_layout.addRow("API地址:", self.custom_base_url)
         model_details_layout.addRow("API密钥:", self.custom_api_key)
+        model_details_layout.addRow("权重:", self.custom_model_weight)
+        model_details_layout.addRow("最大并发:", self.custom_model_concurrency)
         
         # 保存模型按钮
         self.save_model_button = QPushButton("保存模型设置")
@@ -296,7 +480,7 @@ class MainWindow(QMainWindow):
         type_layout = QHBoxLayout()
         type_layout.addWidget(QLabel("OCR API类型:"))
         self.ocr_api_type = QComboBox()
-        self.ocr_api_type.addItems(["自定义", "百度", "腾讯"])
+        self.ocr_api_type.addItems(["自定义", "百度", "腾讯", "本地"])
         self.ocr_api_type.currentIndexChanged.connect(self.on_ocr_api_type_changed)
         type_layout.addWidget(self.ocr_api_type)
         type_layout.addStretch()  # 添加弹簧，使控件左对齐
@@ -328,6 +512,14 @@ class MainWindow(QMainWindow):
         self.custom_ocr_key.setPlaceholderText("OCRAPI密钥")
         self.custom_ocr_key.setEchoMode(QLineEdit.Password)
         
+        # 创建本地OCR设置控件
+        self.local_ocr_engine = QComboBox()
+        self.local_ocr_engine.addItem("RapidOCR", "rapidocr")
+        self.local_ocr_engine.addItem("Tesseract", "tesseract")
+        self.local_ocr_workers = QSpinBox()
+        self.local_ocr_workers.setRange(0, 64)
+        self.local_ocr_workers.setSpecialValueText("自动(CPU核心数)")
+        
         # 初始显示自定义OCR设置
         self.baidu_ocr_settings = [self.baidu_app_id, self.baidu_api_key, self.baidu_secret_key]
         self.tencent_ocr_settings = [self.tencent_secret_id, self.tencent_secret_key, self.tencent_region]
@@ -354,6 +546,12 @@ class MainWindow(QMainWindow):
         self.custom_ocr_form.addRow("API地址:", self.custom_ocr_url)
         self.custom_ocr_form.addRow("API密钥:", self.custom_ocr_key)
         
+        # 本地OCR设置
+        self.local_group = QGroupBox("本地OCR配置")
+        self.local_ocr_form = QFormLayout(self.local_group)
+        self.local_ocr_form.addRow("识别引擎:", self.local_ocr_engine)
+        self.local_ocr_form.addRow("工作进程数:", self.local_ocr_workers)
+        
         # 添加OCR配置框架
         self.ocr_settings_widget = QWidget()
         self.ocr_settings_layout = QVBoxLayout(self.ocr_settings_widget)
@@ -363,6 +561,7 @@ class MainWindow(QMainWindow):
         self.baidu_group.hide()
         self.tencent_group.hide()
         self.custom_group.hide()
+        self.local_group.hide()
         
         # 显示选中的OCR设置表单
         self.on_ocr_api_type_changed(0)  # 默认显示自定义OCR
@@ -413,28 +612,6 @@ class MainWindow(QMainWindow):
             file_extension = Path(file_path).suffix.lower()
             is_image = file_extension in ['.png', '.jpg', '.jpeg', '.bmp', '.tiff', '.gif']
             
-            # 创建进度对话框
-            progress_title = "OCR识别中" if is_image else "读取文件中"
-            progress = QProgressDialog(f"{progress_title}...", "取消", 0, 100, self)
-            progress.setWindowTitle("文件处理进度")
-            progress.setWindowModality(Qt.WindowModal)
-            progress.setValue(0)
-            progress.show()
-            
-            # 更新进度的计时器
-            timer = QTimer(self)
-            progress_value = 0
-            
-            def update_progress():
-                nonlocal progress_value
-                if progress_value < 90:
-                    progress_value += (5 if is_image else 10)  # OCR处理较慢，进度更新慢一些
-                    progress.setValue(progress_value)
-            
-            # 定时更新进度
-            timer.timeout.connect(update_progress)
-            timer.start(200)  # 每200毫秒更新一次
-            
             try:
                 if is_image:
                     self.status_bar.showMessage(f"正在进行OCR识别，可能需要一些时间...")
@@ -443,15 +620,15 @@ class MainWindow(QMainWindow):
                     # 显示图像预览
                     self.show_image_preview(file_path)
                 
-                # 读取文件内容
-                file_content = FileHandler.read_file(file_path)
-                
-                # 停止计时器，完成进度
-                timer.stop()
-                progress.setValue(100)
+                # 在后台线程中读取文件内容，进度按之前读取同类文件的实测耗时估计
+                progress_title = "OCR识别中" if is_image else "读取文件中"
+                file_content = self._read_file_with_progress(file_path, progress_title, "文件处理进度")
+                if file_content is None:
+                    self.status_bar.showMessage("已取消读取文件", 5000)
+                    return
                 
                 if file_content:
-                    self.input_text.setText(file_content)
+                    self.input_text.set_document_text(file_content)
                     
                     # 如果是图像文件，显示提示
                     if is_image:
@@ -459,12 +636,59 @@ class MainWindow(QMainWindow):
                 else:
                     QMessageBox.warning(self, "读取错误", "无法读取所选文件内容")
             except Exception as e:
-                # 停止计时器
-                timer.stop()
-                progress.close()
-                
                 QMessageBox.warning(self, "读取错误", f"文件处理异常: {str(e)}")
                 self.status_bar.showMessage(f"文件处理异常: {str(e)}", 5000)
+    
+    def _read_file_with_progress(self, file_path, title, window_title):
+        """在后台线程中读取文件(图像文件进行OCR)，并显示进度对话框
+        
+        进度按之前读取同类文件的耗时中位数估计，还没有记录时只显示已用时间
+        
+        Args:
+            file_path: 文件路径
+            title: 进度提示文字
+            window_title: 进度对话框标题
+        Returns:
+            str: 文件内容，读取失败时为空；用户取消时返回None
+        """
+        is_image = Path(file_path).suffix.lower() in FileHandler.SUPPORTED_IMAGE_FORMATS
+        stage = "ocr" if is_image else "read"
+        expected = self.file_metrics.snapshot()["stages"].get(stage, {}).get("p50")
+        
+        # 没有历史耗时时显示忙碌状态，而不是虚构的进度
+        progress = QProgressDialog(f"{title}...", "取消", 0, 100 if expected else 0, self)
+        progress.setWindowTitle(window_title)
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setValue(0)
+        progress.show()
+        
+        def read():
+            with self.file_metrics.measure(stage):
+                return FileHandler.read_file(file_path)
+        
+        executor = ThreadPoolExecutor(max_workers=1)
+        future = executor.submit(read)
+        executor.shutdown(wait=False)
+        started = time.monotonic()
+        try:
+            while not future.done():
+                wait([future], timeout=0.1)
+                elapsed = time.monotonic() - started
+                if expected:
+                    progress.setValue(min(99, int(elapsed / expected * 100)))
+                    remaining = max(0.0, expected - elapsed)
+                    progress.setLabelText(
+                        f"{title}... 已用 {format_duration(elapsed)}，预计还需 {format_duration(remaining)}"
+                    )
+                else:
+                    progress.setLabelText(f"{title}... 已用 {format_duration(elapsed)}")
+                QApplication.processEvents()  # 保持界面响应
+                if progress.wasCanceled():
+                    # 读取在后台继续完成，结果不再使用
+                    return None
+        finally:
+            progress.close()
+        return future.result()
 
     def show_image_preview(self, image_path):
         """显示图像预览"""
@@ -477,19 +701,10 @@ class MainWindow(QMainWindow):
             # 创建布局
             layout = QVBoxLayout(preview_dialog)
             
-            # 添加图像标签
+            # 添加图像标签，缩略图在后台解码，完成后再显示
             image_label = QLabel()
-            pixmap = QPixmap(image_path)
-            
-            # 等比缩放图像
-            scaled_pixmap = pixmap.scaled(
-                580, 350, 
-                Qt.AspectRatioMode.KeepAspectRatio,
-                Qt.TransformationMode.SmoothTransformation
-            )
-            
-            image_label.setPixmap(scaled_pixmap)
             image_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+            self._show_thumbnail(image_label, image_path, 580, 350)
             
             # 添加关闭按钮
             close_button = QPushButton("关闭")
@@ -506,6 +721,67 @@ class MainWindow(QMainWindow):
         except Exception as e:
             self.status_bar.showMessage(f"无法显示图像预览: {str(e)}", 5000)
     
+    def _show_thumbnail(self, label, image_path, width, height):
+        """在标签中显示图片缩略图：已缓存时直接显示，否则在后台解码，完成后再显示
+        
+        Args:
+            label: 显示图片的QLabel
+            image_path: 图片路径
+            width: 最大宽度
+            height: 最大高度
+        """
+        size = max(width, height)
+        
+        def set_image(image):
+            pixmap = QPixmap.fromImage(image)
+            if pixmap.width() > width or pixmap.height() > height:
+                # 缩略图已经很小，在界面线程中缩放的开销可以忽略
+                pixmap = pixmap.scaled(
+                    width, height,
+                    Qt.AspectRatioMode.KeepAspectRatio,
+                    Qt.TransformationMode.SmoothTransformation
+                )
+            label.setPixmap(pixmap)
+        
+        path = os.fspath(image_path)
+        
+        def disconnect():
+            self.thumbnail_loader.ready.disconnect(on_ready)
+            self.thumbnail_loader.failed.disconnect(on_failed)
+        
+        def on_ready(ready_path, ready_size):
+            if ready_path != path or ready_size != size:
+                return
+            disconnect()
+            image = self.thumbnail_loader.get(image_path, size)
+            try:
+                if image is not None:
+                    set_image(image)
+            except RuntimeError:
+                pass  # 对话框已关闭
+        
+        def on_failed(failed_path, failed_size):
+            if failed_path != path or failed_size != size:
+                return
+            disconnect()
+            try:
+                label.setText("无法加载图像预览")
+            except RuntimeError:
+                pass
+        
+        # 先连接信号再请求，避免后台线程在连接之前就已完成
+        self.thumbnail_loader.ready.connect(on_ready)
+        self.thumbnail_loader.failed.connect(on_failed)
+        image = self.thumbnail_loader.get(image_path, size)
+        if image is not None:
+            disconnect()
+            set_image(image)
+        elif self.thumbnail_loader.has_failed(image_path, size):
+            disconnect()
+            label.setText("无法加载图像预览")
+        else:
+            label.setText("正在加载预览...")
+    
     def browse_folder(self):
         """浏览文件夹"""
         folder_dialog = QFileDialog()
@@ -513,43 +789,81 @@ class MainWindow(QMainWindow):
         
         if folder_path:
             self.folder_path_label.setText(folder_path)
-            self.files_list.clear()
             
             # 查找文件夹中所有支持的文件
-            supported_files = []
-            
-            # 获取支持的文件扩展名
-            text_extensions = [".txt", ".docx", ".pdf", ".md"]
-            image_extensions = [".png", ".jpg", ".jpeg", ".bmp", ".tiff", ".gif"]
-            all_extensions = text_extensions + image_extensions
-            
-            # 查找所有支持的文件
-            for ext in all_extensions:
-                files = list(Path(folder_path).glob(f"*{ext}"))
-                supported_files.extend(files)
-            
-            # 在文件列表中显示找到的文件
-            if supported_files:
-                self.files_list.append(f"找到 {len(supported_files)} 个文件:")
-                for i, file in enumerate(supported_files, 1):
-                    file_type = "文本文件" if file.suffix.lower() in text_extensions else "图像文件"
-                    self.files_list.append(f"{i}. {file.name} ({file_type})")
-            else:
-                self.files_list.append("未找到支持的文件。")
-                
-            # 保存文件列表供批处理使用
-            self.supported_files = supported_files
+            count = self.file_model.load_folder(
+                folder_path, FileHandler.SUPPORTED_TEXT_FORMATS + FileHandler.SUPPORTED_IMAGE_FORMATS
+            )
+            self._update_files_summary()
+            if not count:
+                self.status_bar.showMessage("未找到支持的文件。", 5000)
+    
+    def _apply_file_filter(self):
+        """按界面上的条件筛选文件列表"""
+        self.file_model.set_filter(self.files_filter_edit.text(), self.files_status_filter.currentData())
+        self._update_files_summary()
+    
+    def _update_files_summary(self):
+        """更新文件列表上方的统计"""
+        total = self.file_model.file_count()
+        visible = self.file_model.visible_count()
+        if not total:
+            self.files_summary_label.setText("未找到支持的文件")
+        elif visible == total:
+            self.files_summary_label.setText(f"共 {total} 个文件")
+        else:
+            self.files_summary_label.setText(f"共 {total} 个文件，显示 {visible} 个")
+    
+    def _show_files_menu(self, pos):
+        """文件列表的右键菜单：设置或取消优先处理"""
+        files = [self.file_model.path_at(index) for index in self.files_view.selectionModel().selectedRows()]
+        if not files:
+            return
+        menu = QMenu(self)
+        pin_action = menu.addAction("优先处理")
+        unpin_action = menu.addAction("取消优先")
+        action = menu.exec(self.files_view.viewport().mapToGlobal(pos))
+        if action is pin_action:
+            self.file_model.set_pinned(files, True)
+        elif action is unpin_action:
+            self.file_model.set_pinned(files, False)
     
     def batch_process(self):
         """批量处理文件"""
-        folder_path = self.folder_path_label.text()
+        if not self.file_model.file_count():
+            QMessageBox.warning(self, "错误", "所选文件夹中没有找到支持的文件。")
+            return
         
+        self._start_batch(self.file_model.files())
+    
+    def retry_failed_files(self):
+        """仅重新处理任务日志中记录为失败的文件"""
+        folder_path = self.folder_path_label.text()
         if not folder_path:
             QMessageBox.warning(self, "错误", "请先选择一个文件夹。")
             return
         
-        if not hasattr(self, "supported_files") or not self.supported_files:
-            QMessageBox.warning(self, "错误", "所选文件夹中没有找到支持的文件。")
+        journal_file = Path(folder_path) / "markdown_output" / ".job_journal.db"
+        if not journal_file.exists():
+            QMessageBox.information(self, "重试失败文件", "该文件夹还没有批处理记录。")
+            return
+        
+        journal = JobJournal(journal_file)
+        failed_files = [Path(item["path"]) for item in journal.failed_items() if Path(item["path"]).exists()]
+        journal.close()
+        
+        if not failed_files:
+            QMessageBox.information(self, "重试失败文件", "没有失败的文件需要重试。")
+            return
+        
+        self._start_batch(failed_files)
+    
+    def _start_batch(self, files):
+        """对指定文件执行批量处理"""
+        folder_path = self.folder_path_label.text()
+        
+        if not folder_path:
+            QMessageBox.warning(self, "错误", "请先选择一个文件夹。")
             return
         
         # 检查是否选择了模型
@@ -565,127 +879,573 @@ class MainWindow(QMainWindow):
             return
         
         model_info = self.models_info[selected_model_id]
-        api_key = model_info.get("api_key", "")
-        base_url = model_info.get("base_url", "")
-        model_name = model_info.get("name", "")
-        
-        # 清空状态文本区域
-        self.status_text.clear()
-        self.status_text.append("开始批量处理...")
-        self.status_text.append(f"使用模型: {model_info.get('display_name', '未命名模型')}")
-        self.status_bar.showMessage("批量处理中...", 0)  # 0表示不会自动消失
-        
-        # 记录处理计数
-        success_count = 0
-        failed_count = 0
-        image_count = 0
+        offline = self.batch_offline_check.isChecked()
+        
+        # 创建AI处理器：离线模式使用选中模型的批处理接口；
+        # 实时模式使用路由器，负载均衡时包含所有模型，否则只包含选中的模型
+        router = None
+        if offline:
+            processor = get_processor(model_info.get("api_key", ""), model_info.get("base_url", ""))
+            processor.model_name = model_info.get("name", "")
+        else:
+            router_options = {}
+            if self.batch_hedge_check.isChecked():
+                router_options["hedge_percentile"] = self.batch_hedge_percentile.value()
+            try:
+                if self.batch_router_check.isChecked():
+                    router = get_router(self.models_info, **router_options)
+                else:
+                    router = get_router({selected_model_id: model_info}, **router_options)
+            except Exception as e:
+                QMessageBox.warning(self, "模型错误", str(e))
+                return
+            processor = router
+            if self.batch_pack_check.isChecked():
+                # 合并请求由NotePacker的发送线程发出，数量与模型的并发上限相同
+                processor = NotePacker(router, workers=router.total_capacity())
         
         # 获取输出文件夹（默认为源文件夹中的"markdown_output"子文件夹）
         output_folder = Path(folder_path) / "markdown_output"
         output_folder.mkdir(exist_ok=True)
         
+        # 清空状态文本区域；本次运行的完整日志写入输出目录，界面上只显示最近的部分
+        self.batch_log.clear()
+        self.batch_log.open_spill(output_folder / ".batch_log.jsonl")
+        self.batch_log.log("开始批量处理...")
+        if offline:
+            self.batch_log.log(f"离线模式(批处理接口)，使用模型: {model_info.get('display_name', '未命名模型')}")
+        elif self.batch_router_check.isChecked():
+            model_names = ", ".join(endpoint.display_name for endpoint in router.endpoints)
+            self.batch_log.log(f"使用模型(负载均衡): {model_names}")
+        else:
+            self.batch_log.log(f"使用模型: {model_info.get('display_name', '未命名模型')}")
+        self.status_bar.showMessage("批量处理中...", 0)  # 0表示不会自动消失
+        
+        # 打开任务日志，记录每个文件的处理进度以便中断后继续
+        journal = JobJournal(output_folder / ".job_journal.db")
+        journal.register(files)
+        if not self.batch_resume_check.isChecked():
+            journal.reset(files)
+        
+        # 重复图片去重：预先并行计算哈希，统计可复用识别结果的图片
+        deduplicator = None
+        if self.batch_dedup_check.isChecked():
+            deduplicator = ImageDeduplicator(
+                output_folder / ".image_hashes.db", max_distance=self.batch_dedup_distance.value()
+            )
+        metrics = PipelineMetrics()
+        pipeline = BatchPipeline(
+            processor, self._get_format_options(), output_folder, journal, deduplicator=deduplicator,
+            docx_mode=self.batch_docx_mode.currentData(), metrics=metrics
+        )
+        
+        # 跳过之前已处理完成的文件
+        todo_files = []
+        self.file_model.reset_status(files)
+        for file in files:
+            if pipeline.is_done(file):
+                self.file_model.set_status(file, STATUS_SKIPPED)
+            else:
+                todo_files.append(file)
+        skipped_count = len(files) - len(todo_files)
+        if skipped_count:
+            self.batch_log.log(f"跳过之前已完成的文件: {skipped_count} 个")
+        
+        # 按预估耗时安排处理顺序，优先处理的文件最先开始
+        scheduler = BatchScheduler(self.batch_order_combo.currentData())
+        todo_files = scheduler.order(todo_files, self.file_model.priorities())
+        pinned_count = sum(1 for file in todo_files if self.file_model.is_pinned(file))
+        if pinned_count:
+            self.batch_log.log(f"优先处理的文件: {pinned_count} 个")
+        # 从中断的阶段继续的文件耗时不完整，不用于校正预估
+        resumed_files = {
+            str(file) for file in todo_files
+            if (journal.get(file) or {}).get("content") is not None
+        }
+        
+        def record_elapsed(file, seconds):
+            if str(file) not in resumed_files:
+                scheduler.record(file, seconds)
+        if deduplicator is not None:
+            # 计算哈希需要读取所有图片，在后台线程中进行
+            self.status_bar.showMessage("正在计算图片哈希...", 0)
+            executor = ThreadPoolExecutor(max_workers=1)
+            future = executor.submit(deduplicator.prepare, todo_files)
+            while not future.done():
+                wait([future], timeout=0.05)
+                QApplication.processEvents()  # 保持界面响应
+            executor.shutdown(wait=False)
+            self.status_bar.clearMessage()
+            dedup_stats = future.result()
+            if dedup_stats["duplicates"]:
+                self.batch_log.log(
+                    f"图片 {dedup_stats['images']} 张，其中 {dedup_stats['duplicates']} 张与其他图片相同，"
+                    f"只需OCR {dedup_stats['groups']} 张"
+                )
+        
         # 创建总体进度对话框
-        total_files = len(self.supported_files)
+        total_files = len(todo_files)
         progress = QProgressDialog(f"批量处理 0/{total_files} 文件...", "取消", 0, total_files, self)
         progress.setWindowTitle("批量处理进度")
         progress.setWindowModality(Qt.WindowModal)
         progress.setValue(0)
         progress.show()
+        self.batch_dashboard.start(metrics, total_files)
         
-        # 批量处理所有文件
-        for file_index, file in enumerate(self.supported_files):
-            try:
-                # 更新总体进度
-                progress.setValue(file_index)
-                progress.setLabelText(f"批量处理 {file_index}/{total_files} 文件...\n当前: {file.name}")
-                QApplication.processEvents()  # 确保UI更新
-                
-                if progress.wasCanceled():
-                    self.status_text.append("用户取消了处理")
-                    break
-                
-                self.status_text.append(f"处理文件: {file.name}...")
-                
-                # 区分图片和文本文件
-                if file.suffix.lower() in ['.png', '.jpg', '.jpeg', '.bmp', '.tiff', '.gif']:
-                    self.status_text.append(f"  进行OCR识别...")
-                    image_count += 1
-                
-                # 创建文件读取进度对话框
-                file_progress = QProgressDialog(f"读取文件: {file.name}", "取消", 0, 100, self)
-                file_progress.setWindowTitle("文件读取进度")
-                file_progress.setWindowModality(Qt.WindowModal)
-                file_progress.setValue(0)
-                file_progress.show()
-                
-                # 更新文件读取进度的计时器
-                file_timer = QTimer(self)
-                file_progress_value = 0
-                
-                def update_file_progress():
-                    nonlocal file_progress_value
-                    if file_progress_value < 90:
-                        file_progress_value += 10
-                        file_progress.setValue(file_progress_value)
-                
-                # 定时更新进度
-                file_timer.timeout.connect(update_file_progress)
-                file_timer.start(200)  # 每200毫秒更新一次
-                
-                # 读取文件内容
-                content = FileHandler.read_file(str(file))
-                
-                # 停止计时器，完成文件读取进度
-                file_timer.stop()
-                file_progress.setValue(100)
-                
-                if not content:
-                    self.status_text.append(f"  错误: 无法读取文件内容")
+        # 统计图像文件数量
+        image_count = sum(
+            1 for file in todo_files
+            if file.suffix.lower() in FileHandler.SUPPORTED_IMAGE_FORMATS
+        )
+        
+        if offline:
+            # 离线模式：提交到服务商的异步批处理接口
+            success_count, failed_count = self._run_offline_batch(pipeline, todo_files, progress)
+        else:
+            # 工作线程数与模型的并发上限相同；合并短笔记时工作线程读取后即交给NotePacker的队列，不等待请求完成
+            max_workers = router.total_capacity()
+            success_count, failed_count = self._run_online_batch(
+                pipeline, todo_files, max_workers, progress,
+                record=record_elapsed
+            )
+            scheduler.save()
+        
+        # 完成总体进度
+        progress.setValue(total_files)
+        self.batch_dashboard.stop()
+        
+        # 显示处理结果
+        self.batch_log.log("\n处理完成:")
+        self.batch_log.log(f"共处理 {total_files} 个文件")
+        self.batch_log.log(f"其中图像文件: {image_count} 个")
+        self.batch_log.log(f"成功: {success_count} 个")
+        self.batch_log.log(f"失败: {failed_count} 个")
+        self.batch_log.log(f"输出目录: {output_folder}")
+        stages = metrics.snapshot()["stages"]
+        for name, label in STAGE_LABELS.items():
+            stage = stages.get(name)
+            if stage and stage["completed"]:
+                self.batch_log.log(
+                    f"{label}: {stage['completed']} 个, p50 {format_latency(stage['p50'])}, "
+                    f"p95 {format_latency(stage['p95'])}"
+                )
+        if deduplicator is not None:
+            self.batch_log.log(
+                f"图片去重: OCR {deduplicator.ocr_count} 张, 复用识别结果 {deduplicator.reused_count} 张"
+            )
+            deduplicator.close()
+        
+        if offline:
+            self.batch_log.log(self._format_usage(processor.usage_stats))
+        else:
+            usage = {}
+            for stats in router.get_stats():
+                for key, value in stats["usage"].items():
+                    usage[key] = usage.get(key, 0) + value
+            self.batch_log.log(self._format_usage(usage))
+            
+            # 记录各模型的吞吐量，供下次预估使用
+            history = ThroughputHistory()
+            history.record_router_stats(router.get_stats())
+            history.save()
+            
+            if isinstance(processor, NotePacker):
+                self.batch_log.log(processor.summary())
+                processor.close()
+            
+            if self.batch_hedge_check.isChecked():
+                self.batch_log.log(f"对冲请求: {router.hedge_count} 次, 其中副本胜出 {router.hedge_win_count} 次")
+            
+            if self.batch_router_check.isChecked():
+                self.batch_log.log("各模型处理统计:")
+                for stats in router.get_stats():
+                    self.batch_log.log(
+                        f"  {stats['display_name']}: 成功 {stats['success']} 次, 失败 {stats['failure']} 次"
+                    )
+            
+            for stats in router.get_stats():
+                self.batch_log.log(
+                    f"{stats['display_name']} 自适应并发: {stats['concurrency_limit']}/{stats['max_concurrency']}"
+                    f"(被限流 {stats['throttled']} 次)"
+                )
+        
+        # 保存各服务学到的并发数，下次批处理从该水平开始
+        get_limiter_registry().save()
+        
+        if failed_count:
+            self.batch_log.log("失败的文件已记录，可点击\"重试失败文件\"单独重新处理")
+        self.batch_log.log(f"完整日志: {self.batch_log.spill_path}")
+        self.batch_log.close_spill()
+        journal.close()
+        
+        self.status_bar.showMessage(f"批量处理完成: 成功{success_count}个, 失败{failed_count}个", 10000)
+    
+    def estimate_batch(self):
+        """预估批量处理的token数、费用和耗时"""
+        folder_path = self.folder_path_label.text()
+        if not folder_path or not self.file_model.file_count():
+            QMessageBox.warning(self, "错误", "请先选择包含支持文件的文件夹。")
+            return
+        
+        selected_model_id = self.ai_model_combo.currentData()
+        if not selected_model_id or selected_model_id not in self.models_info:
+            QMessageBox.warning(self, "模型错误", "请先在设置中添加并选择一个AI模型")
+            return
+        
+        # 确定参与处理的模型和并发数
+        if self.batch_router_check.isChecked():
+            model_infos = [info for info in self.models_info.values() if info.get("base_url")]
+        else:
+            model_infos = [self.models_info[selected_model_id]]
+        concurrency = sum(learned_concurrency(info) for info in model_infos)
+        if self.batch_offline_check.isChecked():
+            concurrency = self.file_model.file_count()
+        
+        # 每次请求都会附带的指令部分
+        model_info = self.models_info[selected_model_id]
+        processor = get_processor(model_info.get("api_key", ""), model_info.get("base_url", ""))
+        llm_options, _ = split_format_options(self._get_format_options())
+        instructions = processor.build_messages("", llm_options)[0]["content"]
+        
+        self.batch_log.clear()
+        files = self.file_model.files()
+        self.batch_log.log(f"正在预估 {len(files)} 个文件...")
+        self.status_bar.showMessage("正在预估...", 0)
+        
+        planner = BatchPlanner(Path(folder_path) / "markdown_output" / ".token_cache.json")
+        executor = ThreadPoolExecutor(max_workers=1)
+        future = executor.submit(planner.plan, files, model_infos, instructions, concurrency)
+        while not future.done():
+            wait([future], timeout=0.05)
+            QApplication.processEvents()  # 保持界面响应
+        executor.shutdown(wait=False)
+        
+        try:
+            plan = future.result()
+        except Exception as e:
+            self.batch_log.log(f"预估失败: {str(e)}")
+            self.status_bar.showMessage("预估失败", 5000)
+            return
+        
+        for line in plan.summary_lines():
+            self.batch_log.log(line)
+        if self.batch_offline_check.isChecked():
+            self.batch_log.log("离线模式的实际完成时间取决于服务商的批处理队列")
+        self.status_bar.showMessage("预估完成", 5000)
+    
+    def _get_format_options(self):
+        """获取当前界面上的格式选项"""
+        return {
+            'header_level': self.header_level_spin.value(),
+            'list_style': "unordered" if self.list_style_combo.currentIndex() == 0 else "ordered",
+            'code_language': self.code_language_edit.text(),
+            'prompt_template': self.prompt_template_edit.toPlainText()
+        }
+    
+    def _run_online_batch(self, pipeline, files, max_workers, progress, record=None):
+        """实时模式批量处理：并发调用模型接口，返回(成功数, 失败数)
+        
+        Args:
+            pipeline: 批处理流水线
+            files: 按处理顺序排列的文件列表
+            max_workers: 并发数
+            progress: 进度对话框
+            record: 文件处理成功后调用 record(file, seconds)，用于记录实测耗时
+        """
+        # 工作线程数由调用方按所有模型的并发上限确定
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        timer = FileTimer()
+        
+        def convert(file, future):
+            # 已被取消的文件不再处理
+            if not future.set_running_or_notify_cancel():
+                return
+            timer.start(file)
+            
+            def finish(done):
+                timer.finish(file)
+                if done.exception() is not None:
+                    future.set_exception(done.exception())
+                else:
+                    future.set_result(done.result())
+            
+            pipeline.submit_file(file).add_done_callback(finish)
+        
+        # 每个文件对应一个写出后完成的Future；合并短笔记时文件在NotePacker的发送线程中写出
+        pending = {}
+        for file in files:
+            future = Future()
+            pending[future] = file
+            executor.submit(convert, file, future)
+        
+        # 在主线程中等待结果并更新界面
+        total_files = len(files)
+        success_count = 0
+        failed_count = 0
+        finished_count = 0
+        started_count = 0
+        cancelled = False
+        while pending:
+            done, _ = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+            
+            # 文件状态显示在文件列表中，视图定时批量刷新
+            for file in timer.pop_started():
+                self.file_model.set_status(file, STATUS_RUNNING)
+                started_count += 1
+            pipeline.metrics.set_gauge("queue.total", total_files - started_count)
+            for future in done:
+                file = pending.pop(future)
+                if future.cancelled():
+                    continue
+                finished_count += 1
+                try:
+                    future.result()
+                    self.file_model.set_status(file, STATUS_DONE, timer.elapsed(file))
+                    if record is not None:
+                        record(file, timer.elapsed(file))
+                    success_count += 1
+                except Exception as e:
+                    self.file_model.set_status(file, STATUS_FAILED, timer.elapsed(file), e)
+                    self.batch_log.log(
+                        f"处理文件: {file.name}... 错误: {str(e)}", level="error",
+                        file=str(file), stage=getattr(e, "stage", None)
+                    )
+                    failed_count += 1
+            
+            # 更新总体进度
+            if cancelled:
+                progress.setLabelText(f"已取消，等待进行中的 {len(pending)} 个文件完成...")
+            else:
+                progress.setValue(finished_count)
+                progress.setLabelText(
+                    f"批量处理 {finished_count}/{total_files} 文件，{self.batch_dashboard.eta_text(finished_count)}"
+                )
+            QApplication.processEvents()  # 确保UI更新
+            
+            if progress.wasCanceled() and not cancelled:
+                cancelled = True
+                self.batch_log.log("用户取消了处理，已完成的进度已记录，下次可继续")
+                # 取消尚未开始的任务；进行中的请求继续完成并写出，之后才能关闭任务日志
+                for future in pending:
+                    future.cancel()
+        
+        executor.shutdown(wait=True)
+        self.file_model.flush()
+        return success_count, failed_count
+    
+    def _run_offline_batch(self, pipeline, files, progress):
+        """离线模式批量处理：读取全部文件后提交异步批处理任务并轮询结果，返回(成功数, 失败数)"""
+        total_files = len(files)
+        success_count = 0
+        failed_count = 0
+        metrics = pipeline.metrics
+        started = time.monotonic()
+        
+        def record_total(success):
+            # 离线模式下文件的整体耗时为从开始处理到结果写出的时间
+            metrics.begin("total")
+            metrics.end("total", time.monotonic() - started, success)
+        
+        # 并发读取所有文件(图像文件在此进行OCR，已有记录的直接使用日志中的内容)
+        notes = {}
+        results = {}
+        files_by_id = {}
+        read_workers = 4
+        executor = ThreadPoolExecutor(max_workers=read_workers)
+        pending = {
+            executor.submit(pipeline.read, file): (str(index), file)
+            for index, file in enumerate(files)
+        }
+        read_count = 0
+        while pending:
+            done, _ = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+            for future in done:
+                custom_id, file = pending.pop(future)
+                read_count += 1
+                try:
+                    content = future.result()
+                except Exception as e:
+                    self.file_model.set_status(file, STATUS_FAILED, error=e)
+                    self.batch_log.log(
+                        f"读取文件: {file.name}... 错误: {str(e)}", level="error", file=str(file), stage="read"
+                    )
+                    record_total(False)
                     failed_count += 1
                     continue
+                self.file_model.set_status(file, STATUS_RUNNING)
                 
-                # 使用AI处理内容
-                processor = get_processor(api_key, base_url)
-                processor.model_name = model_name  # 设置模型名称
-                result = processor.process_note(
-                    content,
-                    {
-                        'header_level': self.header_level_spin.value(),
-                        'list_style': "unordered" if self.list_style_combo.currentIndex() == 0 else "ordered",
-                        'code_language': self.code_language_edit.text(),
-                        'prompt_template': self.prompt_template_edit.toPlainText()
-                    }
+                files_by_id[custom_id] = file
+                # 之前已获得AI结果的文件无需再次提交
+                cached = pipeline.cached_result(file)
+                if cached is not None:
+                    results[custom_id] = cached
+                elif pipeline.llm_options(file) is None:
+                    # 结构清晰的Word文档直接使用本地转换结果
+                    results[custom_id] = content
+                else:
+                    notes[custom_id] = content
+            
+            metrics.set_gauge("queue.read", max(0, len(pending) - read_workers))
+            metrics.set_gauge("queue.llm", len(notes))
+            progress.setValue(read_count // 2)
+            progress.setLabelText(f"读取文件 {read_count}/{total_files}...")
+            QApplication.processEvents()  # 确保UI更新
+            
+            if progress.wasCanceled():
+                self.batch_log.log("用户取消了处理，已读取的内容已记录，下次可继续")
+                for future in pending:
+                    future.cancel()
+                # 等待正在读取的文件完成并记录，之后才能关闭任务日志
+                running = [future for future in pending if not future.cancelled()]
+                while not all(future.done() for future in running):
+                    wait(running, timeout=0.1)
+                    QApplication.processEvents()  # 保持界面响应
+                executor.shutdown(wait=True)
+                return success_count, failed_count
+        
+        # 提交批处理任务并在后台线程中轮询，之前取消等待的任务继续获取其结果
+        if notes:
+            processor = pipeline.processor
+            cancel_token = CancelToken()
+            batch_status = {}
+            # 之前提交、尚未取得结果的任务 {batch_id: {任务中的custom_id: 本次的custom_id}}
+            resumed = {}
+            new_notes = {}
+            for custom_id, content in notes.items():
+                pending_batch = pipeline.pending_batch(files_by_id[custom_id])
+                if pending_batch is None:
+                    new_notes[custom_id] = content
+                else:
+                    batch_id, batch_custom_id = pending_batch
+                    resumed.setdefault(batch_id, {})[batch_custom_id] = custom_id
+            def on_status(batch):
+                batch_status["id"] = batch.id
+                batch_status["status"] = batch.status
+                batch_status["counts"] = batch.request_counts
+            
+            def submit(batch_notes):
+                batch_id = processor.submit_batch([
+                    processor.build_batch_request(custom_id, content, pipeline.llm_format_options)
+                    for custom_id, content in batch_notes.items()
+                ])
+                # 提交后立即记录任务ID，取消等待或程序退出后下次运行时可以继续获取结果
+                pipeline.record_batch(batch_id, {custom_id: files_by_id[custom_id] for custom_id in batch_notes})
+                return batch_id
+            
+            def collect(batch_id, id_map):
+                batch_results = processor.collect_batch(
+                    batch_id, id_map, poll_interval=30.0, on_status=on_status, cancel_token=cancel_token
                 )
+                for batch_custom_id, custom_id in id_map.items():
+                    results[custom_id] = batch_results[batch_custom_id]
+            
+            def run_batches():
+                batches = dict(resumed)
+                if new_notes:
+                    batches[submit(new_notes)] = {custom_id: custom_id for custom_id in new_notes}
+                retry_notes = {}
+                for batch_id, id_map in batches.items():
+                    try:
+                        collect(batch_id, id_map)
+                    except RequestCancelledError:
+                        raise
+                    except Exception:
+                        if batch_id not in resumed:
+                            raise
+                        # 之前的任务已无法继续(已过期、被取消或不属于当前模型服务)，其中的笔记重新提交
+                        self.batch_log.log(f"之前的批处理任务 {batch_id} 已无法继续，重新提交其中的文件", level="warning")
+                        retry_notes.update((custom_id, notes[custom_id]) for custom_id in id_map.values())
+                if retry_notes:
+                    batch_id = submit(retry_notes)
+                    collect(batch_id, {custom_id: custom_id for custom_id in retry_notes})
+            
+            future = executor.submit(run_batches)
+            resumed_count = sum(len(id_map) for id_map in resumed.values())
+            if resumed_count:
+                self.batch_log.log(f"继续获取之前提交的 {len(resumed)} 个批处理任务的结果，共 {resumed_count} 个文件")
+            if new_notes:
+                self.batch_log.log(f"已读取 {len(files_by_id)} 个文件，提交 {len(new_notes)} 个到批处理任务...")
+            
+            logged_batch_id = None
+            while not future.done():
+                wait([future], timeout=0.1)
                 
-                # 生成输出文件路径
-                output_file = output_folder / f"{file.stem}.md"
+                if batch_status.get("id") and batch_status["id"] != logged_batch_id:
+                    logged_batch_id = batch_status["id"]
+                    self.batch_log.log(f"批处理任务ID: {logged_batch_id}")
                 
-                # 保存结果
-                FileHandler.save_markdown_file(result, str(output_file))
+                counts = batch_status.get("counts")
+                counts_text = f" ({counts.completed}/{counts.total})" if counts and counts.total else ""
+                if counts and counts.total:
+                    metrics.set_gauge("queue.llm", max(0, counts.total - counts.completed - counts.failed))
+                progress.setLabelText(f"等待批处理任务完成: {batch_status.get('status', '提交中')}{counts_text}")
+                QApplication.processEvents()  # 确保UI更新
                 
-                self.status_text.append(f"  成功: 已保存到 {output_file.name}")
+                if progress.wasCanceled() and not cancel_token.cancelled:
+                    cancel_token.cancel()
+                    self.batch_log.log("用户取消了等待，服务端批处理任务仍会继续执行，下次运行时继续获取结果")
+            
+            # 已取得结果的文件照常写出，其余文件视情况保留任务记录或记为失败
+            waiting = [custom_id for custom_id in notes if custom_id not in results]
+            try:
+                future.result()
+            except RequestCancelledError:
+                self.batch_log.log(f"{len(waiting)} 个文件的批处理任务仍在服务端执行，下次运行时将继续获取结果")
+                for custom_id in waiting:
+                    self.file_model.set_status(files_by_id.pop(custom_id), STATUS_PENDING)
+            except Exception as e:
+                self.batch_log.log(f"批处理任务失败: {str(e)}", level="error")
+                waiting_files = [files_by_id.pop(custom_id) for custom_id in waiting]
+                pipeline.clear_batch(waiting_files)
+                for file in waiting_files:
+                    pipeline.fail(file, "llm", e)
+                    self.file_model.set_status(file, STATUS_FAILED, error=e)
+                    record_total(False)
+                failed_count += len(waiting_files)
+        
+        executor.shutdown(wait=False)
+        metrics.set_gauge("queue.llm", 0)
+        
+        # 将结果映射回输出文件
+        for custom_id, file in files_by_id.items():
+            result = results.get(custom_id)
+            try:
+                if isinstance(result, Exception):
+                    # 任务已结束，失败的请求下次运行时重新提交
+                    pipeline.clear_batch([file])
+                    pipeline.fail(file, "llm", result)
+                    raise result
+                pipeline.record_result(file, result)
+                pipeline.write(file, result)
+                self.file_model.set_status(file, STATUS_DONE)
+                record_total(True)
                 success_count += 1
-                
             except Exception as e:
-                self.status_text.append(f"  错误: {str(e)}")
+                self.file_model.set_status(file, STATUS_FAILED, error=e)
+                self.batch_log.log(
+                    f"处理文件: {file.name}... 错误: {str(e)}", level="error",
+                    file=str(file), stage=getattr(e, "stage", None)
+                )
+                record_total(False)
                 failed_count += 1
         
-        # 完成总体进度
-        progress.setValue(total_files)
-        
-        # 显示处理结果
-        self.status_text.append("\n处理完成:")
-        self.status_text.append(f"共处理 {len(self.supported_files)} 个文件")
-        self.status_text.append(f"其中图像文件: {image_count} 个")
-        self.status_text.append(f"成功: {success_count} 个")
-        self.status_text.append(f"失败: {failed_count} 个")
-        self.status_text.append(f"输出目录: {output_folder}")
-        
-        self.status_bar.showMessage(f"批量处理完成: 成功{success_count}个, 失败{failed_count}个", 10000)
+        self.file_model.flush()
+        return success_count, failed_count
+    
+    @staticmethod
+    def _format_usage(usage):
+        """格式化token用量统计"""
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        cached_tokens = usage.get("cached_tokens", 0)
+        hit_rate = f"{cached_tokens / prompt_tokens:.0%}" if prompt_tokens else "0%"
+        return (
+            f"Token用量: 输入 {prompt_tokens} (前缀缓存命中 {cached_tokens}, {hit_rate}), "
+            f"输出 {usage.get('completion_tokens', 0)}"
+        )
     
     def process_note(self):
         """处理笔记"""
-        note_content = self.input_text.toPlainText()
+        note_content = self.input_text.text()
         
         if not note_content:
             QMessageBox.warning(self, "输入错误", "请输入或导入笔记内容")
@@ -709,32 +1469,75 @@ class MainWindow(QMainWindow):
             base_url = model_info.get("base_url", "")
             model_name = model_info.get("name", "")
             
-            # 获取格式选项
-            format_options = {
-                'header_level': self.header_level_spin.value(),
-                'list_style': "unordered" if self.list_style_combo.currentIndex() == 0 else "ordered",
-                'code_language': self.code_language_edit.text(),
-                'prompt_template': self.prompt_template_edit.toPlainText()
-            }
+            # 获取格式选项：标题级别、列表样式和代码块语言不发送给模型，在结果上本地应用
+            format_options, _ = split_format_options(self._get_format_options())
             
             # 获取处理器
             processor = get_processor(api_key, base_url)
             processor.model_name = model_name  # 设置模型名称
             
-            # 处理笔记
-            result = processor.process_note(note_content, format_options)
+            # 在后台线程中流式处理，增量文本追加到结果区域，预览随之增量刷新
+            deltas = deque()
+            executor = ThreadPoolExecutor(max_workers=1)
+            future = executor.submit(processor.process_note, note_content, format_options, on_delta=deltas.append)
+            executor.shutdown(wait=False)
+            self.output_text.clear()
+            self.process_button.setEnabled(False)
+            self.status_bar.showMessage("正在处理笔记...", 0)
+            try:
+                while not future.done():
+                    wait([future], timeout=0.05)
+                    self._append_output_deltas(deltas)
+                    QApplication.processEvents()  # 确保UI更新
+                self._append_output_deltas(deltas)
+            finally:
+                self.process_button.setEnabled(True)
+                self.status_bar.clearMessage()
+            result = future.result()
             
             if result:
-                self.output_text.setText(result)
+                self._last_raw_result = result
+                self._last_rendered_result = None
+                self._reformat_output()
             else:
                 QMessageBox.warning(self, "处理错误", "笔记处理失败")
         
         except Exception as e:
             QMessageBox.critical(self, "处理错误", f"处理笔记时出错: {e}")
     
+    def _reformat_output(self):
+        """按当前格式选项在本地重新生成整理结果，结果已被手动编辑时不做修改"""
+        if self._last_raw_result is None:
+            return
+        current = self.output_text.text()
+        if self._last_rendered_result is not None and current != self._last_rendered_result:
+            # 用户修改过结果，不再跟随格式选项
+            self._last_raw_result = None
+            return
+        rendered = apply_format_options(self._last_raw_result, self._get_format_options())
+        self._last_rendered_result = rendered
+        # 以完整结果为准(如流式输出中途切换了模型)
+        if current != rendered:
+            self.output_text.set_document_text(rendered)
+    
+    def _append_output_deltas(self, deltas):
+        """将后台线程收到的增量文本追加到结果区域，None表示丢弃之前的输出"""
+        if not deltas:
+            return
+        chunks = []
+        while deltas:
+            delta = deltas.popleft()
+            if delta is None:
+                self.output_text.clear()
+                chunks = []
+            else:
+                chunks.append(delta)
+        if chunks:
+            self.output_text.append_text("".join(chunks))
+    
     def export_markdown(self):
         """导出Markdown"""
-        markdown_content = self.output_text.toPlainText()
+        markdown_content = self.output_text.text()
         
         if not markdown_content:
             QMessageBox.warning(self, "导出错误", "没有可导出的内容")
@@ -789,54 +1592,20 @@ class MainWindow(QMainWindow):
             QMessageBox.critical(self, "测试错误", f"连接测试时发生错误: {str(e)}")
 
     def save_settings(self):
-        """保存设置到环境变量和配置文件"""
+        """保存设置到配置文件"""
         try:
-            # 保存OCR配置
-            ocr_api_type = ["CUSTOM", "BAIDU", "TENCENT"][self.ocr_api_type.currentIndex()]
-            os.environ["OCR_API_TYPE"] = ocr_api_type
-            
-            # 根据选择的OCR类型保存对应的配置
-            if ocr_api_type == "BAIDU":
-                if self.baidu_app_id.text():
-                    os.environ["BAIDU_APP_ID"] = self.baidu_app_id.text()
-                if self.baidu_api_key.text():
-                    os.environ["BAIDU_API_KEY"] = self.baidu_api_key.text()
-                if self.baidu_secret_key.text():
-                    os.environ["BAIDU_SECRET_KEY"] = self.baidu_secret_key.text()
-            
-            elif ocr_api_type == "TENCENT":
-                if self.tencent_secret_id.text():
-                    os.environ["TENCENT_SECRET_ID"] = self.tencent_secret_id.text()
-                if self.tencent_secret_key.text():
-                    os.environ["TENCENT_SECRET_KEY"] = self.tencent_secret_key.text()
-                if self.tencent_region.text():
-                    os.environ["TENCENT_REGION"] = self.tencent_region.text()
-            
-            else:  # CUSTOM
-                if self.custom_ocr_url.text():
-                    os.environ["CUSTOM_OCR_ENDPOINT"] = self.custom_ocr_url.text()
-                if self.custom_ocr_key.text():
-                    os.environ["CUSTOM_OCR_KEY"] = self.custom_ocr_key.text()
-            
-            # 保存提示词模板设置
-            os.environ["PROMPT_TEMPLATE"] = self.prompt_template_edit.toPlainText()
-            
-            # 如果有选中的模型，确保其设置已保存并更新环境变量
+            # 如果有选中的模型，在状态栏中显示
             selected_index = self.ai_model_combo.currentIndex()
             if selected_index >= 0:
                 selected_model_id = self.ai_model_combo.currentData()
                 if selected_model_id in self.models_info:
                     model_info = self.models_info[selected_model_id]
-                    # 更新环境变量
-                    os.environ["CUSTOM_MODEL"] = model_info.get("name", "")
-                    os.environ["CUSTOM_BASE_URL"] = model_info.get("base_url", "")
-                    os.environ["CUSTOM_API_KEY"] = model_info.get("api_key", "")
-                    
                     # 同步更新到UI显示
                     self.status_bar.showMessage(f"当前选中模型: {model_info.get('display_name', '未命名')}", 3000)
             
-            # 保存设置到文件
+            # 保存设置到文件(点击保存按钮时立即写入，不等待延迟合并)
             self._save_settings_to_file()
+            self.settings_service.flush()
             
             # 显示成功消息
             QMessageBox.information(self, "保存成功", "所有设置已保存")
@@ -853,6 +1622,7 @@ class MainWindow(QMainWindow):
         self.baidu_group.hide()
         self.tencent_group.hide()
         self.custom_group.hide()
+        self.local_group.hide()
         
         # 清除现有布局中的所有小部件
         if hasattr(self, 'ocr_settings_layout'):
@@ -879,6 +1649,11 @@ class MainWindow(QMainWindow):
             self.tencent_group.show()
             self.ocr_settings_layout.addWidget(self.tencent_group)
             self.status_bar.showMessage("已切换到腾讯OCR设置", 3000)
+        elif index == 3:  # 本地
+            # 显示本地OCR表单
+            self.local_group.show()
+            self.ocr_settings_layout.addWidget(self.local_group)
+            self.status_bar.showMessage("已切换到本地OCR设置", 3000)
 
     def test_ocr_connection(self):
         """测试OCR连接"""
@@ -920,6 +1695,13 @@ class MainWindow(QMainWindow):
                     "TENCENT_REGION": region
                 }
                 
+            elif ocr_type == "本地":
+                config = {
+                    "OCR_API_TYPE": "LOCAL",
+                    "LOCAL_OCR_ENGINE": self.local_ocr_engine.currentData(),
+                    "LOCAL_OCR_WORKERS": self.local_ocr_workers.value()
+                }
+                
             else:  # 自定义
                 api_url = self.custom_ocr_url.text().strip()
                 
@@ -964,6 +1746,8 @@ class MainWindow(QMainWindow):
                     test_result = processor.test_baidu_connection()
                 elif ocr_type == "腾讯":
                     test_result = processor.test_tencent_connection()
+                elif ocr_type == "本地":
+                    test_result = processor.test_local_connection()
                 else:
                     test_result = processor.test_custom_connection()
                 
@@ -1024,19 +1808,10 @@ class MainWindow(QMainWindow):
                         image_group = QGroupBox("图像预览")
                         image_layout = QVBoxLayout(image_group)
                         
-                        # 添加图像标签
+                        # 添加图像标签，缩略图在后台解码
                         image_label = QLabel()
-                        pixmap = QPixmap(image_path)
-                        
-                        # 等比缩放图像
-                        scaled_pixmap = pixmap.scaled(
-                            350, 500, 
-                            Qt.AspectRatioMode.KeepAspectRatio,
-                            Qt.TransformationMode.SmoothTransformation
-                        )
-                        
-                        image_label.setPixmap(scaled_pixmap)
                         image_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+                        self._show_thumbnail(image_label, image_path, 350, 500)
                         image_layout.addWidget(image_label)
                         image_result_layout.addWidget(image_group)
                         
@@ -1073,36 +1848,10 @@ class MainWindow(QMainWindow):
             self.status_bar.showMessage(f"OCR测试出错: {str(e)}", 5000)
 
     def load_settings(self):
-        """从环境变量和配置文件加载设置"""
+        """重新读取设置文件并刷新界面"""
         try:
-            # 先从文件加载设置
-            self._load_settings_from_file()
-            
-            # 加载提示词模板设置
-            self.prompt_template_edit.setText(os.environ.get("PROMPT_TEMPLATE", "请将以下笔记内容转换为Markdown格式:\n\n"))
-            
-            # 加载OCR类型设置
-            ocr_api_type = os.environ.get("OCR_API_TYPE", "CUSTOM")
-            index_map = {"CUSTOM": 0, "BAIDU": 1, "TENCENT": 2}
-            self.ocr_api_type.setCurrentIndex(index_map.get(ocr_api_type, 0))
-            
-            # 加载百度OCR设置
-            self.baidu_app_id.setText(os.environ.get("BAIDU_APP_ID", ""))
-            self.baidu_api_key.setText(os.environ.get("BAIDU_API_KEY", ""))
-            self.baidu_secret_key.setText(os.environ.get("BAIDU_SECRET_KEY", ""))
-            
-            # 加载腾讯OCR设置
-            self.tencent_secret_id.setText(os.environ.get("TENCENT_SECRET_ID", ""))
-            self.tencent_secret_key.setText(os.environ.get("TENCENT_SECRET_KEY", ""))
-            self.tencent_region.setText(os.environ.get("TENCENT_REGION", "ap-beijing"))
-            
-            # 加载自定义OCR设置
-            self.custom_ocr_url.setText(os.environ.get("CUSTOM_OCR_ENDPOINT", ""))
-            self.custom_ocr_key.setText(os.environ.get("CUSTOM_OCR_KEY", ""))
-            
-            # 更新模型下拉列表
-            self.update_models_dropdown()
-            
+            settings = self.settings_service.reload()
+            self._apply_settings(settings)
             self.status_bar.showMessage("设置已加载", 3000)
             
         except Exception as e:
@@ -1110,189 +1859,99 @@ class MainWindow(QMainWindow):
             import traceback
             traceback.print_exc()
     
-    def _save_settings_to_file(self):
-        """保存设置到文件"""
-        try:
-            # 获取项目根目录
-            project_dir = self._get_project_root()
-            settings_file = project_dir / "settings.json"
-            
-            # 检查原始设置文件是否存在
-            original_settings = {}
-            if settings_file.exists():
-                try:
-                    with open(settings_file, 'r', encoding='utf-8') as f:
-                        original_settings = json.load(f)
-                except:
-                    pass
-            
-            # 获取当前设置
-            settings = {
-                # 保留原来的单个模型设置以兼容旧版本
-                "CUSTOM_MODEL": os.environ.get("CUSTOM_MODEL", ""),
-                "CUSTOM_BASE_URL": os.environ.get("CUSTOM_BASE_URL", ""),
-                "CUSTOM_API_KEY": os.environ.get("CUSTOM_API_KEY", ""),
-                
-                # 模型配置
-                "MODELS": self.models_info,
-                
-                # 提示词模板设置
-                "PROMPT_TEMPLATE": self.prompt_template_edit.toPlainText(),
-                
-                # OCR设置
-                "OCR_API_TYPE": ["CUSTOM", "BAIDU", "TENCENT"][self.ocr_api_type.currentIndex()],
-                
-                # 百度OCR设置
-                "BAIDU_APP_ID": self.baidu_app_id.text(),
-                "BAIDU_API_KEY": self.baidu_api_key.text(),
-                "BAIDU_SECRET_KEY": self.baidu_secret_key.text(),
-                
-                # 腾讯OCR设置
-                "TENCENT_SECRET_ID": self.tencent_secret_id.text(),
-                "TENCENT_SECRET_KEY": self.tencent_secret_key.text(),
-                "TENCENT_REGION": self.tencent_region.text(),
-                
-                # 自定义OCR设置
-                "CUSTOM_OCR_ENDPOINT": self.custom_ocr_url.text(),
-                "CUSTOM_OCR_KEY": self.custom_ocr_key.text()
-            }
-            
-            # 如果有选中的当前模型，将其设为默认模型
-            selected_index = self.ai_model_combo.currentIndex()
-            if selected_index >= 0:
-                selected_model_id = self.ai_model_combo.currentData()
-                if selected_model_id in self.models_info:
-                    model_info = self.models_info[selected_model_id]
-                    # 更新单独的模型字段
-                    settings["CUSTOM_MODEL"] = model_info.get("name", "")
-                    settings["CUSTOM_BASE_URL"] = model_info.get("base_url", "")
-                    settings["CUSTOM_API_KEY"] = model_info.get("api_key", "")
-            
-            # 保存设置到JSON文件
-            with open(settings_file, 'w', encoding='utf-8') as f:
-                json.dump(settings, f, ensure_ascii=False, indent=4)
-            
-            # 打印确认消息
-            print(f"设置已保存到: {settings_file}")
-            
-        except Exception as e:
-            raise Exception(f"保存设置到文件时出错: {str(e)}")
+    def _apply_settings(self, settings):
+        """用设置快照填充界面
+        
+        Args:
+            settings: 设置快照(Settings)
+        """
+        # 加载模型设置(兼容原来的单模型配置)
+        self.models_info = {model_id: dict(model_info) for model_id, model_info in settings.models.items()}
+        self.models_list.clear()
+        for model_id, model_info in self.models_info.items():
+            item = QListWidgetItem(model_info.get("name", "未命名模型"))
+            item.setData(Qt.UserRole, model_id)
+            self.models_list.addItem(item)
+        if "MODELS" not in settings and self.models_info:
+            # 选择由旧版配置生成的默认模型
+            self.models_list.setCurrentRow(0)
+        
+        # 加载提示词模板设置
+        self.prompt_template_edit.setText(settings.prompt_template)
+        
+        # 加载OCR类型设置
+        index_map = {"CUSTOM": 0, "BAIDU": 1, "TENCENT": 2, "LOCAL": 3}
+        self.ocr_api_type.setCurrentIndex(index_map.get(settings.ocr_api_type, 0))
+        
+        # 加载百度OCR设置
+        self.baidu_app_id.setText(settings.get("BAIDU_APP_ID", ""))
+        self.baidu_api_key.setText(settings.get("BAIDU_API_KEY", ""))
+        self.baidu_secret_key.setText(settings.get("BAIDU_SECRET_KEY", ""))
+        
+        # 加载腾讯OCR设置
+        self.tencent_secret_id.setText(settings.get("TENCENT_SECRET_ID", ""))
+        self.tencent_secret_key.setText(settings.get("TENCENT_SECRET_KEY", ""))
+        self.tencent_region.setText(settings.get("TENCENT_REGION", "ap-beijing"))
+        
+        # 加载自定义OCR设置
+        self.custom_ocr_url.setText(settings.get("CUSTOM_OCR_ENDPOINT", ""))
+        self.custom_ocr_key.setText(settings.get("CUSTOM_OCR_KEY", ""))
+        
+        # 加载本地OCR设置
+        engine_index = self.local_ocr_engine.findData(settings.get("LOCAL_OCR_ENGINE", "rapidocr"))
+        self.local_ocr_engine.setCurrentIndex(max(0, engine_index))
+        self.local_ocr_workers.setValue(int(settings.get("LOCAL_OCR_WORKERS") or 0))
+        
+        # 更新模型下拉列表
+        self.update_models_dropdown()
     
-    def _load_settings_from_file(self):
-        """从文件加载设置"""
-        try:
-            # 获取项目根目录
-            project_dir = self._get_project_root()
-            settings_file = project_dir / "settings.json"
-            
-            # 检查文件是否存在
-            if not settings_file.exists():
-                return
-            
-            # 读取设置
-            with open(settings_file, 'r', encoding='utf-8') as f:
-                settings = json.load(f)
-            
-            # 加载多模型设置
-            if "MODELS" in settings and isinstance(settings["MODELS"], dict):
-                self.models_info = settings["MODELS"]
-                
-                # 清空模型列表
-                self.models_list.clear()
-                
-                # 重新填充模型列表
-                for model_id, model_info in self.models_info.items():
-                    item = QListWidgetItem(model_info.get("name", "未命名模型"))
-                    item.setData(Qt.UserRole, model_id)
-                    self.models_list.addItem(item)
-                
-                # 设置环境变量用于默认模型
-                if self.models_info:
-                    # 使用第一个模型作为默认
-                    default_model_id = next(iter(self.models_info))
-                    default_model = self.models_info[default_model_id]
-                    
-                    os.environ["CUSTOM_MODEL"] = default_model.get("name", "")
-                    os.environ["CUSTOM_BASE_URL"] = default_model.get("base_url", "")
-                    os.environ["CUSTOM_API_KEY"] = default_model.get("api_key", "")
-            # 向后兼容原来的单模型配置
-            elif "CUSTOM_MODEL" in settings or "CUSTOM_BASE_URL" in settings or "CUSTOM_API_KEY" in settings:
-                # 创建一个默认模型
-                model_id = "default_model"
-                model_info = {
-                    "id": model_id,
-                    "name": settings.get("CUSTOM_MODEL", "默认模型"),
-                    "display_name": "默认模型",
-                    "base_url": settings.get("CUSTOM_BASE_URL", ""),
-                    "api_key": settings.get("CUSTOM_API_KEY", "")
-                }
-                
-                self.models_info[model_id] = model_info
-                
-                # 添加到列表显示
-                item = QListWidgetItem(model_info["name"])
-                item.setData(Qt.UserRole, model_id)
-                self.models_list.addItem(item)
-                
-                # 选择新添加的模型
-                self.models_list.setCurrentRow(0)
-            
-            # 加载提示词模板设置
-            if "PROMPT_TEMPLATE" in settings:
-                os.environ["PROMPT_TEMPLATE"] = settings["PROMPT_TEMPLATE"]
-            
-            # 加载OCR类型设置
-            if "OCR_API_TYPE" in settings:
-                os.environ["OCR_API_TYPE"] = settings["OCR_API_TYPE"]
-            
-            # 加载百度OCR设置
-            if "BAIDU_APP_ID" in settings:
-                os.environ["BAIDU_APP_ID"] = settings["BAIDU_APP_ID"]
-            
-            if "BAIDU_API_KEY" in settings:
-                os.environ["BAIDU_API_KEY"] = settings["BAIDU_API_KEY"]
-            
-            if "BAIDU_SECRET_KEY" in settings:
-                os.environ["BAIDU_SECRET_KEY"] = settings["BAIDU_SECRET_KEY"]
-            
-            # 加载腾讯OCR设置
-            if "TENCENT_SECRET_ID" in settings:
-                os.environ["TENCENT_SECRET_ID"] = settings["TENCENT_SECRET_ID"]
-            
-            if "TENCENT_SECRET_KEY" in settings:
-                os.environ["TENCENT_SECRET_KEY"] = settings["TENCENT_SECRET_KEY"]
-            
-            if "TENCENT_REGION" in settings:
-                os.environ["TENCENT_REGION"] = settings["TENCENT_REGION"]
-            
-            # 加载自定义OCR设置
-            if "CUSTOM_OCR_ENDPOINT" in settings:
-                os.environ["CUSTOM_OCR_ENDPOINT"] = settings["CUSTOM_OCR_ENDPOINT"]
-            
-            if "CUSTOM_OCR_KEY" in settings:
-                os.environ["CUSTOM_OCR_KEY"] = settings["CUSTOM_OCR_KEY"]
-            
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
-            raise Exception(f"从文件加载设置时出错: {str(e)}")
+    def _save_settings_to_file(self):
+        """将界面中的设置提交到设置服务，由其延迟合并后原子地写入文件"""
+        # 当前选中的模型作为默认模型(保留单独的模型字段以兼容旧版本)，否则使用第一个模型
+        default_model = {}
+        selected_model_id = self.ai_model_combo.currentData() if self.ai_model_combo.currentIndex() >= 0 else None
+        if selected_model_id in self.models_info:
+            default_model = self.models_info[selected_model_id]
+        elif self.models_info:
+            default_model = next(iter(self.models_info.values()))
+        
+        settings = {
+            # 保留原来的单个模型设置以兼容旧版本
+            "CUSTOM_MODEL": default_model.get("name", ""),
+            "CUSTOM_BASE_URL": default_model.get("base_url", ""),
+            "CUSTOM_API_KEY": default_model.get("api_key", ""),
+            
+            # 模型配置
+            "MODELS": self.models_info,
+            
+            # 提示词模板设置
+            "PROMPT_TEMPLATE": self.prompt_template_edit.toPlainText(),
+            
+            # OCR设置
+            "OCR_API_TYPE": ["CUSTOM", "BAIDU", "TENCENT", "LOCAL"][self.ocr_api_type.currentIndex()],
+            
+            # 百度OCR设置
+            "BAIDU_APP_ID": self.baidu_app_id.text(),
+            "BAIDU_API_KEY": self.baidu_api_key.text(),
+            "BAIDU_SECRET_KEY": self.baidu_secret_key.text(),
+            
+            # 腾讯OCR设置
+            "TENCENT_SECRET_ID": self.tencent_secret_id.text(),
+            "TENCENT_SECRET_KEY": self.tencent_secret_key.text(),
+            "TENCENT_REGION": self.tencent_region.text(),
+            
+            # 自定义OCR设置
+            "CUSTOM_OCR_ENDPOINT": self.custom_ocr_url.text(),
+            "CUSTOM_OCR_KEY": self.custom_ocr_key.text(),
+            
+            # 本地OCR设置
+            "LOCAL_OCR_ENGINE": self.local_ocr_engine.currentData(),
+            "LOCAL_OCR_WORKERS": str(self.local_ocr_workers.value())
+        }
+        
+        # 设置文件中的其他项保持不变，只有变化的项会通知订阅者(如OCR设置变化时重建OCR客户端)
+        self.settings_service.update(settings)
     
-    def _get_project_root(self):
-        """获取项目根目录"""
-        try:
-            # 获取当前文件所在目录
-            current_dir = Path(__file__).resolve().parent
-            
-            # 向上查找，找到项目根目录（有main.py的父目录）
-            while current_dir.name != "src" and current_dir.parent != current_dir:
-                current_dir = current_dir.parent
-            
-            # 返回项目根目录
-            return current_dir.parent
-            
-        except Exception as e:
-            raise Exception(f"获取项目根目录时出错: {str(e)}")
-
     def import_note(self):
         """导入笔记"""
         file_dialog = QFileDialog()
@@ -1305,36 +1964,14 @@ class MainWindow(QMainWindow):
         
         if file_path:
             try:
-                # 显示进度对话框
-                progress = QProgressDialog("读取文件中...", "取消", 0, 100, self)
-                progress.setWindowTitle("文件读取进度")
-                progress.setWindowModality(Qt.WindowModal)
-                progress.setValue(0)
-                progress.show()
-                
-                # 更新进度的计时器
-                timer = QTimer(self)
-                progress_value = 0
-                
-                def update_progress():
-                    nonlocal progress_value
-                    if progress_value < 90:
-                        progress_value += 10
-                        progress.setValue(progress_value)
-                
-                # 定时更新进度
-                timer.timeout.connect(update_progress)
-                timer.start(100)  # 每100毫秒更新一次
-                
-                # 读取文件内容
-                content = FileHandler.read_file(file_path)
-                
-                # 停止计时器，完成进度
-                timer.stop()
-                progress.setValue(100)
+                # 在后台线程中读取文件内容，进度按实测耗时估计
+                content = self._read_file_with_progress(file_path, "读取文件中", "文件读取进度")
+                if content is None:
+                    self.status_bar.showMessage("已取消导入", 5000)
+                    return
                 
                 if content:
-                    self.input_text.setText(content)
+                    self.input_text.set_document_text(content)
                     self.status_bar.showMessage(f"已导入文件: {os.path.basename(file_path)}", 5000)
                 else:
                     QMessageBox.warning(self, "导入错误", "无法读取文件内容")
@@ -1362,7 +1999,9 @@ class MainWindow(QMainWindow):
             "name": f"自定义模型 {self.models_list.count() + 1}",
             "display_name": f"模型 {self.models_list.count() + 1}",
             "base_url": "",
-            "api_key": ""
+            "api_key": "",
+            "weight": 1,
+            "max_concurrency": 8
         }
         
         # 添加到模型字典
@@ -1381,6 +2020,8 @@ class MainWindow(QMainWindow):
         self.custom_model_display_name.setText(model_info["display_name"])
         self.custom_base_url.setText("")
         self.custom_api_key.setText("")
+        self.custom_model_weight.setValue(1)
+        self.custom_model_concurrency.setValue(model_info["max_concurrency"])
     
     def remove_selected_model(self):
         """删除选中的模型"""
@@ -1433,6 +2074,8 @@ class MainWindow(QMainWindow):
             self.custom_model_display_name.setText(model_info.get("display_name", ""))
             self.custom_base_url.setText(model_info.get("base_url", ""))
             self.custom_api_key.setText(model_info.get("api_key", ""))
+            self.custom_model_weight.setValue(int(model_info.get("weight", 1)))
+            self.custom_model_concurrency.setValue(int(model_info.get("max_concurrency", 1)))
     
     def save_model_details(self):
         """保存当前编辑的模型详细信息"""
@@ -1456,13 +2099,16 @@ class MainWindow(QMainWindow):
             QMessageBox.warning(self, "输入错误", "模型名称和显示名称不能为空")
             return
         
-        # 更新模型信息
+        # 更新模型信息（保留timeout等未在界面中编辑的配置项）
         self.models_info[model_id] = {
+            **self.models_info.get(model_id, {}),
             "id": model_id,
             "name": model_name,
             "display_name": model_display_name,
             "base_url": base_url,
-            "api_key": api_key
+            "api_key": api_key,
+            "weight": self.custom_model_weight.value(),
+            "max_concurrency": self.custom_model_concurrency.value()
         }
         
         # 更新列表显示
@@ -1478,11 +2124,6 @@ class MainWindow(QMainWindow):
                 self.ai_model_combo.setCurrentIndex(i)
                 break
         
-        # 设置为系统环境变量（默认模型）
-        os.environ["CUSTOM_MODEL"] = model_name
-        os.environ["CUSTOM_BASE_URL"] = base_url
-        os.environ["CUSTOM_API_KEY"] = api_key
-        
         # 保存设置到文件
         try:
             self._save_settings_to_file()
@@ -1504,7 +2145,8 @@ class MainWindow(QMainWindow):
     def delayed_load_settings(self):
         """延迟加载设置，确保UI组件已完全创建"""
         try:
-            self.load_settings()
+            # 设置在启动时已解析，直接使用当前快照
+            self._apply_settings(self.settings_service.snapshot())
         except Exception as e:
             self.status_bar.showMessage(f"加载设置失败: {str(e)}", 5000)
             import traceback
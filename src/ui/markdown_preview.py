@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@File    :   markdown_preview.py
+@Time    :   2025/04/03
+@Author  :   Maker
+@Version :   1.0
+'''
+
+"""
+Markdown增量预览
+将Markdown按空行拆分为块，每块渲染的HTML按内容哈希缓存；相邻的块按内容确定的边界
+组成片段，每个片段放在文档的一个独立框架中。文本变化时只替换发生变化的片段，
+未变化的块直接使用缓存，流式输出或编辑超大文档时界面也不会卡顿
+"""
+
+import re
+import time
+import bisect
+
+import markdown
+from PySide6.QtWidgets import QTextBrowser
+from PySide6.QtCore import QTimer
+from PySide6.QtGui import QTextCursor, QTextFrameFormat
+
+from utils.lru_cache import LRUCache
+
+
+# 渲染使用的Markdown扩展
+MARKDOWN_EXTENSIONS = ["tables", "fenced_code", "sane_lists"]
+
+# 片段平均包含的块数(内容确定的边界：块哈希能被该值整除时结束当前片段)
+SEGMENT_BLOCKS = 16
+
+FENCE_PATTERN = re.compile(r"^\s{0,3}(```|~~~)")
+LIST_ITEM_PATTERN = re.compile(r"^\s{0,3}(?:[-*+]|\d+[.)])\s")
+
+
+def split_blocks(text):
+    """将Markdown文本拆分为可独立渲染的块
+
+    以空行分隔；代码块内的空行不拆分，缩进的续行(如列表项中的段落)和
+    相邻的列表项与前一块合并，避免拆分后渲染结果与整体渲染不一致
+
+    Args:
+        text: Markdown文本
+    Returns:
+        list: 块文本列表
+    """
+    return _split_blocks(text)[0]
+
+
+def _split_blocks(text, start=0):
+    """从start(某一块的起始位置)开始拆分，返回(块列表, 各块在text中的起始位置)"""
+    blocks = []
+    starts = []
+    current = []
+    current_start = start
+    fence = None
+
+    def flush():
+        if not current:
+            return
+        block = "\n".join(current)
+        first_line = current[0]
+        if blocks and (
+            first_line[:1] in (" ", "\t")
+            or (LIST_ITEM_PATTERN.match(first_line) and LIST_ITEM_PATTERN.match(blocks[-1]))
+        ):
+            blocks[-1] = blocks[-1] + "\n\n" + block
+        else:
+            blocks.append(block)
+            starts.append(current_start)
+        current.clear()
+
+    position = start
+    for line in text[start:].split("\n"):
+        line_start = position
+        position += len(line) + 1
+        match = FENCE_PATTERN.match(line)
+        if fence is not None:
+            current.append(line)
+            if match and match.group(1) == fence:
+                fence = None
+            continue
+        if not current:
+            current_start = line_start
+        if match:
+            fence = match.group(1)
+            current.append(line)
+            continue
+        if line.strip():
+            current.append(line)
+        else:
+            flush()
+    flush()
+    return blocks, starts
+
+
+def _common_prefix_length(a, b):
+    """两个字符串相同前缀的长度(二分查找，比较在C层完成)"""
+    low, high = 0, min(len(a), len(b))
+    if a[:high] == b[:high]:
+        return high
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+class MarkdownPreview(QTextBrowser):
+    """增量渲染的Markdown预览控件"""
+
+    def __init__(self, parent=None, delay=150, max_delay=500, slice_ms=40, cache_size=20000):
+        """
+        Args:
+            parent: 父控件
+            delay: 文本停止变化多久(毫秒)后渲染
+            max_delay: 文本持续变化(如流式输出)时两次渲染的最大间隔(毫秒)
+            slice_ms: 每次渲染占用界面线程的时间上限(毫秒)，超出后让出事件循环分批继续
+            cache_size: 最多缓存的块数
+        """
+        super().__init__(parent)
+        self.setOpenExternalLinks(True)
+        # 只读预览不需要撤销记录，删除旧片段时也就不用保存其内容
+        self.document().setUndoRedoEnabled(False)
+        self.delay = delay
+        self.max_delay = max_delay
+        self.slice_ms = slice_ms
+        self.cache = LRUCache(cache_size)
+
+        self._converter = markdown.Markdown(extensions=MARKDOWN_EXTENSIONS)
+        self._text = ""
+        self._source = None
+        self._rendered_text = None
+        self._pending_since = None
+        # 文档中各框架对应的片段，片段以其包含的块的键组成的元组表示
+        self._segment_keys = []
+        # 上次拆分的结果，文本只在末尾变化(流式输出)时只需重新拆分最后几块
+        self._split_text = ""
+        self._blocks = []
+        self._block_starts = []
+        self._block_keys = []
+        # 上次分组的片段及拆分后第一个发生变化的块
+        self._segment_cache = []
+        self._first_changed = 0
+
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._render)
+
+    def set_markdown(self, text):
+        """设置Markdown文本，延迟合并后渲染"""
+        self._text = text or ""
+        self._source = None
+        self._schedule()
+
+    def set_markdown_source(self, source):
+        """设置获取Markdown文本的函数，渲染时才调用，文本频繁变化(如编辑大文档)时
+        不必每次变化都取出完整文本
+
+        Args:
+            source: 无参数、返回Markdown文本的函数
+        """
+        self._source = source
+        self._schedule()
+
+    def _current_text(self):
+        if self._source is not None:
+            self._text = self._source() or ""
+            self._source = None
+        return self._text
+
+    def _schedule(self):
+        now = time.monotonic()
+        if self._pending_since is None:
+            self._pending_since = now
+        # 持续变化时不再推迟，保证流式输出期间预览按max_delay的间隔刷新
+        if (now - self._pending_since) * 1000 < self.max_delay or not self._timer.isActive():
+            self._timer.start(self.delay)
+
+    def markdown_text(self):
+        """当前的Markdown文本"""
+        return self._current_text()
+
+    def flush(self):
+        """立即完成所有待处理的渲染(如导出或测试前)"""
+        self._timer.stop()
+        while self._rendered_text != self._current_text():
+            self._render(time_limit=None)
+
+    def clear(self):
+        """清空预览"""
+        self._timer.stop()
+        self._text = ""
+        self._source = None
+        self._rendered_text = ""
+        self._pending_since = None
+        self._segment_keys = []
+        self._split_text = ""
+        self._blocks, self._block_starts, self._block_keys = [], [], []
+        self._segment_cache = []
+        self._first_changed = 0
+        self.document().clear()
+
+    def _block_html(self, block, key):
+        """渲染单个块，结果按块哈希缓存"""
+        html = self.cache.get(key)
+        if html is None:
+            html = self._converter.reset().convert(block)
+            self.cache.put(key, html)
+        return html
+
+    def _split(self, text):
+        """拆分文本并计算各块的键，复用上次拆分结果中未变化的前部"""
+        if text is self._split_text or text == self._split_text:
+            return self._blocks, self._block_keys
+
+        changed = _common_prefix_length(self._split_text, text)
+        # 从变化位置所在块的前一块重新拆分(该块可能与后面的内容合并)
+        index = bisect.bisect_right(self._block_starts, changed) - 2
+        self._first_changed = max(0, index)
+        if index > 0:
+            restart = self._block_starts[index]
+            blocks, starts = _split_blocks(text, restart)
+            self._blocks = self._blocks[:index] + blocks
+            self._block_starts = self._block_starts[:index] + starts
+            self._block_keys = self._block_keys[:index] + [(len(block), hash(block)) for block in blocks]
+        else:
+            self._blocks, self._block_starts = _split_blocks(text)
+            self._block_keys = [(len(block), hash(block)) for block in self._blocks]
+        self._split_text = text
+        return self._blocks, self._block_keys
+
+    def _segments(self, blocks, keys):
+        """按内容确定的边界将块分组为片段，插入或删除块只影响附近的片段；
+        完全位于变化位置之前的片段直接复用上次的分组结果"""
+        segments = []
+        start = 0
+        for segment in self._segment_cache:
+            end = start + len(segment[0])
+            if end > self._first_changed:
+                break
+            segments.append(segment)
+            start = end
+        self._first_changed = len(keys)
+
+        for index in range(start, len(keys)):
+            if keys[index][1] % SEGMENT_BLOCKS == 0 or index == len(keys) - 1:
+                segments.append((tuple(keys[start:index + 1]), blocks[start:index + 1]))
+                start = index + 1
+        self._segment_cache = segments
+        return segments
+
+    def _render(self, time_limit=-1):
+        """渲染变化的片段；超过时间上限时保存进度并在下一轮事件循环中继续"""
+        if time_limit == -1:
+            time_limit = self.slice_ms
+        deadline = None if time_limit is None else time.monotonic() + time_limit / 1000
+        text = self._current_text()
+
+        blocks, keys = self._split(text)
+        segments = self._segments(blocks, keys)
+        new_keys = [segment_keys for segment_keys, _ in segments]
+
+        # 只替换首尾相同部分之间的片段
+        old_keys = self._segment_keys
+        prefix = 0
+        limit = min(len(old_keys), len(new_keys))
+        while prefix < limit and old_keys[prefix] == new_keys[prefix]:
+            prefix += 1
+        suffix = 0
+        while (suffix < limit - prefix
+               and old_keys[len(old_keys) - 1 - suffix] == new_keys[len(new_keys) - 1 - suffix]):
+            suffix += 1
+        old_end = len(old_keys) - suffix
+        new_end = len(new_keys) - suffix
+
+        document = self.document()
+        frames = document.rootFrame().childFrames()
+        cursor = QTextCursor(document)
+        cursor.beginEditBlock()
+        finished = True
+        try:
+            inserted = 0
+            for index in range(prefix, new_end):
+                segment_keys, segment_blocks = segments[index]
+                html = "".join(
+                    self._block_html(block, key) for block, key in zip(segment_blocks, segment_keys)
+                )
+                self._insert_frame(cursor, frames, prefix + inserted, html)
+                frames = document.rootFrame().childFrames()
+                self._segment_keys.insert(prefix + inserted, segment_keys)
+                inserted += 1
+                if deadline is not None and time.monotonic() > deadline and index < new_end - 1:
+                    finished = False
+                    break
+
+            if finished:
+                # 删除被替换的旧片段
+                first = prefix + inserted
+                for _ in range(old_end - prefix):
+                    frame = frames[first]
+                    cursor.setPosition(frame.firstPosition() - 1)
+                    cursor.setPosition(frame.lastPosition() + 1, QTextCursor.KeepAnchor)
+                    cursor.removeSelectedText()
+                    frames = document.rootFrame().childFrames()
+                    del self._segment_keys[first]
+        finally:
+            cursor.endEditBlock()
+
+        if finished:
+            self._rendered_text = text
+            self._pending_since = None
+            if self._source is not None or self._text != text:
+                self._timer.start(self.delay)
+        else:
+            self._timer.start(0)
+
+    @staticmethod
+    def _insert_frame(cursor, frames, index, html):
+        """在第index个框架之前(或文档末尾)插入包含html的新框架"""
+        if index < len(frames):
+            cursor.setPosition(frames[index].firstPosition() - 1)
+        else:
+            cursor.movePosition(QTextCursor.End)
+        cursor.insertFrame(QTextFrameFormat())
+        cursor.insertHtml(html)
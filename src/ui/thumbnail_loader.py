@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@File    :   thumbnail_loader.py
+@Time    :   2025/04/03
+@Author  :   Maker
+@Version :   1.0
+'''
+
+"""
+后台缩略图加载
+在工作线程中解码缩略图并转换为QImage，完成后通过信号通知界面线程，界面线程不再解码原图
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PySide6.QtCore import QObject, Signal
+from PySide6.QtGui import QImage
+
+from utils.lru_cache import LRUCache
+from utils.thumbnail_cache import ThumbnailCache
+
+
+def pil_to_qimage(image):
+    """将RGBA格式的Pillow图片转换为QImage(复制数据，不依赖原图片)"""
+    data = image.tobytes("raw", "RGBA")
+    qimage = QImage(data, image.width, image.height, image.width * 4, QImage.Format_RGBA8888)
+    return qimage.copy()
+
+
+class ThumbnailLoader(QObject):
+    """缩略图加载器"""
+
+    # 缩略图加载完成(路径, 边长)
+    ready = Signal(str, int)
+    # 缩略图加载失败(路径, 边长)
+    failed = Signal(str, int)
+
+    def __init__(self, cache=None, workers=2, max_items=300, parent=None):
+        """
+        Args:
+            cache: 缩略图缓存(ThumbnailCache)，为None时使用默认的磁盘缓存目录
+            workers: 解码线程数
+            max_items: 内存中最多保留的QImage数
+            parent: 父对象
+        """
+        super().__init__(parent)
+        self.cache = cache or ThumbnailCache()
+        self._images = LRUCache(max_items)
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._failed = set()
+
+    def get(self, image_path, size):
+        """获取已加载的缩略图；尚未加载时在后台加载并返回None，加载完成后发出ready信号
+
+        Args:
+            image_path: 图片路径
+            size: 缩略图最大边长(像素)
+        Returns:
+            QImage: 缩略图，尚未加载或加载失败时为None
+        """
+        key = (os.fspath(image_path), size)
+        image = self._images.get(key)
+        if image is not None:
+            return image
+        with self._lock:
+            if key in self._pending or key in self._failed:
+                return None
+            self._pending.add(key)
+        self._executor.submit(self._load, key)
+        return None
+
+    def has_failed(self, image_path, size):
+        """缩略图是否加载失败(如文件损坏)"""
+        with self._lock:
+            return (os.fspath(image_path), size) in self._failed
+
+    def _load(self, key):
+        path, size = key
+        try:
+            image = pil_to_qimage(self.cache.get(path, size))
+        except Exception as e:
+            print(f"加载缩略图失败 {path}: {e}")
+            with self._lock:
+                self._failed.add(key)
+            self.failed.emit(path, size)
+            return None
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+        self._images.put(key, image)
+        self.ready.emit(path, size)
+        return image
+
+    def shutdown(self):
+        """停止后台线程(不等待正在进行的解码)"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@File    :   adaptive_limiter.py
+@Time    :   2025/04/03
+@Author  :   Maker
+@Version :   1.0
+'''
+
+"""
+自适应并发控制(AIMD)
+每个后端(OCR服务、模型接口)一个限流器：请求正常且并发已用满时每完成一轮(约等于当前上限个请求)
+并发上限加1；遇到限流(429、QPS超限等)、超时或耗时突增时上限乘以0.5。耗时只使用与输出长度无关的值
+(模型接口为首token耗时，OCR为单张图片的识别耗时)，长笔记正常的生成时间不会被当作过载。学到的上限保存在项目根目录的
+concurrency_limits.json中，下次批处理直接从该水平开始
+"""
+
+import re
+import json
+import time
+import atexit
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+
+
+# 默认的状态文件
+LIMITS_FILE = Path(__file__).resolve().parent.parent.parent / "concurrency_limits.json"
+
+# 识别限流错误的关键字(HTTP 429、OpenAI RateLimitError、百度QPS超限、腾讯云LimitExceeded等)
+_THROTTLE_PATTERN = re.compile(
+    r"\b429\b|rate.?limit|too many requests|qps|limit reached|limitexceeded|限流|频率",
+    re.IGNORECASE
+)
+_TIMEOUT_PATTERN = re.compile(r"timed? ?out|timeout|超时", re.IGNORECASE)
+
+
+def _error_chain(error):
+    """异常及其原因链(raise ... from ...)"""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        yield error
+        error = error.__cause__ or error.__context__
+
+
+def is_throttle_error(error):
+    """是否为服务端限流错误"""
+    for item in _error_chain(error):
+        status = getattr(item, "status_code", None)
+        if status is None:
+            status = getattr(getattr(item, "response", None), "status_code", None)
+        if status == 429 or "RateLimit" in type(item).__name__:
+            return True
+        if _THROTTLE_PATTERN.search(str(item)):
+            return True
+    return False
+
+
+def is_timeout_error(error):
+    """是否为超时错误"""
+    for item in _error_chain(error):
+        if isinstance(item, TimeoutError) or "Timeout" in type(item).__name__:
+            return True
+        if _TIMEOUT_PATTERN.search(str(item)):
+            return True
+    return False
+
+
+class AdaptiveLimiter:
+    """单个后端的AIMD并发限制器，线程安全"""
+
+    def __init__(self, name, initial=4, min_limit=1, max_limit=32, increase=1.0, decrease=0.5,
+                 latency_factor=3.0, smoothing=0.1):
+        """
+        Args:
+            name: 后端名称
+            initial: 初始并发上限
+            min_limit: 并发上限的下限
+            max_limit: 并发上限的上限
+            increase: 每一轮请求正常完成后增加的并发数
+            decrease: 限流或耗时突增时并发上限乘以的系数
+            latency_factor: 耗时超过基准耗时的倍数时视为耗时突增
+            smoothing: 基准耗时(指数移动平均)的平滑系数
+        """
+        self.name = name
+        self.min_limit = max(1, int(min_limit))
+        self.max_limit = max(self.min_limit, int(max_limit))
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.smoothing = smoothing
+
+        self.limit = float(min(self.max_limit, max(self.min_limit, initial)))
+        self.in_flight = 0
+        self.baseline_latency = None
+        self.increase_count = 0
+        self.decrease_count = 0
+        self.throttle_count = 0
+        # 最近一次降低上限的时间，在此之前发出的请求不再触发降低
+        self._decreased_at = 0.0
+        self._condition = threading.Condition()
+
+    def set_max_limit(self, max_limit):
+        """修改并发上限的上限(如设置中的最大并发数变化)，当前上限超出时立即降低"""
+        with self._condition:
+            self.max_limit = max(self.min_limit, int(max_limit))
+            self.limit = min(self.limit, float(self.max_limit))
+            # 上限提高时等待中的请求可能已经可以开始
+            self._condition.notify_all()
+
+    def current(self):
+        """当前的并发上限(整数)"""
+        return int(self.limit)
+
+    def has_capacity(self, in_flight=None):
+        """是否还有空闲的并发额度
+
+        Args:
+            in_flight: 调用方自行统计的在途请求数，为None时使用acquire统计的数量
+        """
+        if in_flight is None:
+            in_flight = self.in_flight
+        return in_flight < self.current()
+
+    def acquire(self):
+        """占用一个并发额度，额度用完时阻塞等待
+
+        Returns:
+            float: 请求开始的时间，释放时传给release
+        """
+        with self._condition:
+            while self.in_flight >= self.current():
+                self._condition.wait(timeout=1.0)
+            self.in_flight += 1
+            return time.monotonic()
+
+    def release(self, started, error=None, latency=None):
+        """释放acquire占用的额度并根据结果调整上限
+
+        Args:
+            started: acquire返回的开始时间
+            error: 请求失败时的异常
+            latency: 与输出长度无关的耗时(秒)，为None时使用从acquire到释放的耗时
+        """
+        with self._condition:
+            saturated = self.in_flight >= self.current()
+            self.in_flight -= 1
+            if latency is None:
+                latency = time.monotonic() - started
+            self.record(started, latency, error, saturated)
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self):
+        """占用一个并发额度执行请求，请求结束后自动释放并调整上限"""
+        started = self.acquire()
+        try:
+            yield
+        except BaseException as e:
+            self.release(started, e)
+            raise
+        self.release(started)
+
+    def record(self, started, latency=None, error=None, saturated=True):
+        """根据一次请求的结果调整并发上限(调用方自行管理并发时使用)
+
+        Args:
+            started: 请求开始的时间(time.monotonic)
+            latency: 与输出长度无关的耗时(秒)，如首token耗时；为None时只根据限流和超时降低上限
+            error: 请求失败时的异常
+            saturated: 请求结束时并发是否已用满，未用满时不增加上限
+        """
+        with self._condition:
+            if error is not None:
+                throttled = is_throttle_error(error)
+                if throttled:
+                    self.throttle_count += 1
+                if throttled or is_timeout_error(error):
+                    self._decrease(started)
+                # 其他错误(如参数错误、认证失败)与并发无关，不调整上限
+                return
+
+            if latency is not None:
+                if self.baseline_latency is not None and latency > self.baseline_latency * self.latency_factor:
+                    self._decrease(started)
+                    return
+                if self.baseline_latency is None:
+                    self.baseline_latency = latency
+                elif latency < self.baseline_latency:
+                    # 基准耗时接近无负载时的耗时：变快时很快跟上，变慢时缓慢跟随
+                    self.baseline_latency += (latency - self.baseline_latency) * 0.5
+                else:
+                    self.baseline_latency += (latency - self.baseline_latency) * self.smoothing
+
+            if saturated and self.limit < self.max_limit:
+                # 每完成约limit个请求增加increase，即每一轮增加一次
+                previous = self.current()
+                self.limit = min(self.max_limit, self.limit + self.increase / max(1.0, self.limit))
+                if self.current() > previous:
+                    self.increase_count += 1
+            self._condition.notify_all()
+
+    def _decrease(self, started):
+        """乘性降低上限；同一次拥塞中已在途的请求只降低一次"""
+        if started is not None and started < self._decreased_at:
+            return
+        self.limit = max(float(self.min_limit), self.limit * self.decrease)
+        self.decrease_count += 1
+        self._decreased_at = time.monotonic()
+
+    def stats(self):
+        """运行统计"""
+        with self._condition:
+            return {
+                "name": self.name,
+                "limit": self.current(),
+                "in_flight": self.in_flight,
+                "baseline_latency": self.baseline_latency,
+                "increases": self.increase_count,
+                "decreases": self.decrease_count,
+                "throttled": self.throttle_count,
+            }
+
+
+class LimiterRegistry:
+    """按后端管理限流器，并在多次运行之间保存学到的并发上限"""
+
+    def __init__(self, path=None):
+        """
+        Args:
+            path: 状态文件路径，为None时使用项目根目录下的concurrency_limits.json
+        """
+        self.path = Path(path) if path else LIMITS_FILE
+        self._limiters = {}
+        self._saved = {}
+        self._lock = threading.Lock()
+
+        if self.path.exists():
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._saved = json.load(f)
+            except Exception as e:
+                print(f"读取并发上限记录时出错: {e}")
+
+    def get(self, key, initial=4, max_limit=32, **kwargs):
+        """获取后端的限流器，首次获取时从之前保存的上限开始；已有的限流器使用新的max_limit
+
+        Args:
+            key: 后端标识(如 "llm:<base_url>:<model>"、"ocr:BAIDU:<app_id>")
+            initial: 没有历史记录时的初始并发上限
+            max_limit: 并发上限的上限
+            kwargs: 传给AdaptiveLimiter的其他参数
+        Returns:
+            AdaptiveLimiter: 限流器
+        """
+        with self._lock:
+            limiter = self._limiters.get(key)
+            if limiter is None:
+                saved = self._saved.get(key, {})
+                limiter = AdaptiveLimiter(key, saved.get("limit", initial), max_limit=max_limit, **kwargs)
+                self._limiters[key] = limiter
+        if limiter.max_limit != max(limiter.min_limit, int(max_limit)):
+            limiter.set_max_limit(max_limit)
+        return limiter
+
+    def saved_limit(self, key, default=None):
+        """后端当前(或之前保存)的并发上限，没有记录时返回default"""
+        with self._lock:
+            limiter = self._limiters.get(key)
+            if limiter is not None:
+                return limiter.current()
+            return self._saved.get(key, {}).get("limit", default)
+
+    def save(self):
+        """保存各后端的并发上限"""
+        with self._lock:
+            for key, limiter in self._limiters.items():
+                self._saved[key] = {"limit": round(limiter.limit, 2), "updated": time.time()}
+            data = dict(self._saved)
+        try:
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=4)
+        except Exception as e:
+            print(f"保存并发上限记录时出错: {e}")
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_limiter_registry():
+    """获取全局的限流器注册表，程序退出时保存学到的并发上限"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = LimiterRegistry()
+            atexit.register(_registry.save)
+        return _registry
+
+
+def get_limiter(key, **kwargs):
+    """获取后端的限流器，参数见LimiterRegistry.get"""
+    return get_limiter_registry().get(key, **kwargs)
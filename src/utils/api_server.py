@@ -0,0 +1,435 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@File    :   api_server.py
+@Time    :   2025/04/03
+@Author  :   Maker
+@Version :   1.0
+'''
+
+"""
+本地HTTP服务模式
+以HTTP接口提供笔记转换功能，所有请求共享同一个工作线程池、OCR/AI结果缓存和模型连接，
+适合被脚本、编辑器插件等其他工具长期调用
+
+接口:
+    POST /convert   转换文件，请求体为JSON或文件原始内容
+                    JSON: {"path": "本地文件路径"} 或 {"filename": "a.png", "content_base64": "..."}，
+                          可选 "options"(格式选项) 和 "stream"(是否流式返回)
+                    原始内容: POST /convert?filename=a.png[&stream=1]
+    GET  /health    健康检查，返回队列深度和在途数量
+    GET  /metrics   运行指标，包括各阶段延迟分位数、缓存命中和模型用量
+"""
+
+import json
+import time
+import queue
+import base64
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from utils.file_handler import FileHandler
+from utils.job_journal import options_key
+from utils.lru_cache import LRUCache
+from utils.batch_pipeline import PipelineError
+from utils.markdown_format import split_format_options, apply_format_options
+from utils.pipeline_metrics import PipelineMetrics
+
+
+# 允许通过请求覆盖的格式选项
+REQUEST_OPTION_KEYS = ("header_level", "list_style", "code_language")
+
+
+class ServiceBusyError(Exception):
+    """等待队列已满"""
+    pass
+
+
+class RequestError(Exception):
+    """请求参数错误，status为返回的HTTP状态码"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ConversionService:
+    """转换服务：管理共享的工作线程池、缓存和指标，不依赖HTTP，可单独调用"""
+
+    def __init__(self, processor, format_options, workers=2, max_queue=16, cache_size=256,
+                 allowed_roots=None):
+        """
+        Args:
+            processor: AI处理器(CustomProcessor或ModelRouter)
+            format_options: 默认格式选项
+            workers: 工作线程数
+            max_queue: 除正在处理的任务外，最多允许排队的任务数
+            cache_size: OCR结果和AI结果缓存的最大条目数
+            allowed_roots: 允许通过路径访问的目录列表，为空时不限制
+        """
+        self.processor = processor
+        self.format_options = dict(format_options or {})
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self.allowed_roots = [Path(root).resolve() for root in (allowed_roots or [])]
+
+        self.read_cache = LRUCache(cache_size)
+        self.llm_cache = LRUCache(cache_size)
+        self.metrics = PipelineMetrics()
+
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="convert")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self._update_gauges()
+
+    def _update_gauges(self):
+        """更新队列相关的瞬时指标(调用方持有锁)"""
+        self.metrics.set_gauge("queue_depth", self._pending - self._running)
+        self.metrics.set_gauge("in_flight", self._running)
+
+    def queue_depth(self):
+        """排队等待的任务数"""
+        with self._lock:
+            return self._pending - self._running
+
+    def in_flight(self):
+        """正在处理的任务数"""
+        with self._lock:
+            return self._running
+
+    def resolve_path(self, path):
+        """校验请求中的本地文件路径"""
+        file = Path(path).expanduser().resolve()
+        if self.allowed_roots and not any(file.is_relative_to(root) for root in self.allowed_roots):
+            raise RequestError(403, f"不允许访问该路径: {path}")
+        if not file.is_file():
+            raise RequestError(404, f"文件不存在: {path}")
+        return file
+
+    def request_options(self, overrides=None):
+        """合并默认格式选项和请求中的覆盖项
+
+        Raises:
+            RequestError: 覆盖项不是JSON对象
+        """
+        if overrides is not None and not isinstance(overrides, dict):
+            raise RequestError(400, f"options必须是JSON对象，而不是{type(overrides).__name__}")
+        options = dict(self.format_options)
+        for key in REQUEST_OPTION_KEYS:
+            if overrides and overrides.get(key) is not None:
+                options[key] = overrides[key]
+        return options
+
+    def submit(self, filename, data=None, path=None, options=None, on_event=None):
+        """提交转换任务
+        Args:
+            filename: 文件名，用于判断文件类型
+            data: 上传的文件内容(bytes)，与path二选一
+            path: 本地文件路径
+            options: 请求中的格式选项覆盖项
+            on_event: 事件回调 on_event(event, payload)，用于流式返回处理进度和增量文本
+        Returns:
+            Future: 结果为 {"markdown", "cached", "timings"}
+        Raises:
+            ServiceBusyError: 等待队列已满
+        """
+        suffix = Path(filename).suffix.lower()
+        if suffix not in FileHandler.SUPPORTED_TEXT_FORMATS + FileHandler.SUPPORTED_IMAGE_FORMATS:
+            raise RequestError(415, f"不支持的文件类型: {suffix or filename}")
+        options = self.request_options(options)
+
+        with self._lock:
+            if self._pending >= self.workers + self.max_queue:
+                raise ServiceBusyError("服务繁忙，等待队列已满")
+            self._pending += 1
+            self._update_gauges()
+
+        try:
+            return self._executor.submit(
+                self._run, suffix, data, path, options, on_event, time.monotonic()
+            )
+        except Exception:
+            self._finish(started=False)
+            raise
+
+    def _finish(self, started=True):
+        with self._lock:
+            self._pending -= 1
+            if started:
+                self._running -= 1
+            self._update_gauges()
+
+    def _run(self, suffix, data, path, options, on_event, submitted_at):
+        """工作线程中执行的转换流程：读取(OCR) → AI处理"""
+        with self._lock:
+            self._running += 1
+            self._update_gauges()
+
+        emit = on_event or (lambda event, payload: None)
+        timings = {"queue": time.monotonic() - submitted_at}
+        self.metrics.end("queue", timings["queue"])
+        try:
+            with self.metrics.measure("total"):
+                if data is None:
+                    data = Path(path).read_bytes()
+
+                emit("stage", {"stage": "read"})
+                start = time.monotonic()
+                content, read_cached = self._read(suffix, data, path)
+                timings["read"] = time.monotonic() - start
+
+                emit("stage", {"stage": "llm"})
+                start = time.monotonic()
+                llm_options, local_options = split_format_options(options)
+                markdown, llm_cached = self._transform(content, llm_options, emit if on_event else None)
+                timings["llm"] = time.monotonic() - start
+                # 标题级别、列表样式和代码块语言在本地应用，只修改这些选项的请求可以直接使用缓存的AI结果
+                markdown = apply_format_options(markdown, local_options)
+
+            return {
+                "markdown": markdown,
+                "cached": {"read": read_cached, "llm": llm_cached},
+                "timings": timings
+            }
+        finally:
+            self._finish()
+
+    def _read(self, suffix, data, path):
+        """读取阶段，相同内容的文件只读取(OCR)一次"""
+        key = suffix + ":" + hashlib.sha256(data).hexdigest()
+        content = self.read_cache.get(key)
+        if content is not None:
+            return content, True
+
+        try:
+            with self.metrics.measure("read"):
+                if path is not None:
+                    content = FileHandler.read_file(str(path))
+                else:
+                    content = self._read_upload(suffix, data)
+        except Exception as e:
+            raise PipelineError("read", str(e))
+        if not content:
+            raise PipelineError("read", "无法读取文件内容")
+
+        self.read_cache.put(key, content)
+        return content, False
+
+    @staticmethod
+    def _read_upload(suffix, data):
+        """将上传内容写入临时文件后读取"""
+        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+            f.write(data)
+            temp_path = f.name
+        try:
+            return FileHandler.read_file(temp_path)
+        finally:
+            Path(temp_path).unlink(missing_ok=True)
+
+    def _transform(self, content, options, emit=None):
+        """AI处理阶段，相同内容和格式选项只请求一次模型，提供emit时流式输出增量文本"""
+        key = options_key(options) + ":" + hashlib.sha256(content.encode("utf-8")).hexdigest()
+        result = self.llm_cache.get(key)
+        if result is not None:
+            return result, True
+
+        def on_delta(text):
+            if text is None:
+                emit("reset", {})
+            else:
+                emit("delta", {"text": text})
+
+        try:
+            with self.metrics.measure("llm"):
+                if emit:
+                    result = self.processor.process_note(content, dict(options), on_delta=on_delta)
+                else:
+                    result = self.processor.process_note(content, dict(options))
+        except Exception as e:
+            raise PipelineError("llm", str(e))
+        if not result:
+            raise PipelineError("llm", "模型未返回结果")
+
+        self.llm_cache.put(key, result)
+        return result, False
+
+    def health(self):
+        """健康检查信息"""
+        with self._lock:
+            return {
+                "status": "ok",
+                "workers": self.workers,
+                "queue_depth": self._pending - self._running,
+                "queue_limit": self.max_queue,
+                "in_flight": self._running
+            }
+
+    def metrics_snapshot(self):
+        """运行指标"""
+        snapshot = self.metrics.snapshot()
+        snapshot["cache"] = {"read": self.read_cache.stats(), "llm": self.llm_cache.stats()}
+        if hasattr(self.processor, "get_stats"):
+            snapshot["models"] = self.processor.get_stats()
+        elif hasattr(self.processor, "usage_stats"):
+            snapshot["usage"] = dict(self.processor.usage_stats)
+        return snapshot
+
+    def shutdown(self):
+        """停止工作线程池，等待在途任务完成"""
+        self._executor.shutdown(wait=True)
+
+
+class ConversionRequestHandler(BaseHTTPRequestHandler):
+    """HTTP请求处理，每个连接由独立的线程处理，转换工作交给共享的线程池"""
+
+    service = None
+    max_upload_bytes = 50 * 1024 * 1024
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/health":
+            self._send_json(200, self.service.health())
+        elif path == "/metrics":
+            self._send_json(200, self.service.metrics_snapshot())
+        else:
+            self._send_json(404, {"error": "未知的接口"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/convert":
+            self._send_json(404, {"error": "未知的接口"})
+            return
+
+        try:
+            request = self._parse_convert_request(url)
+            if request["stream"]:
+                self._convert_streaming(request)
+                return
+            future = self.service.submit(
+                request["filename"], data=request["data"], path=request["path"], options=request["options"]
+            )
+            self._send_json(200, future.result())
+        except RequestError as e:
+            self._send_json(e.status, {"error": str(e)})
+        except ServiceBusyError as e:
+            self._send_json(503, {"error": str(e)}, headers={"Retry-After": "1"})
+        except PipelineError as e:
+            self._send_json(500, {"error": str(e), "stage": e.stage})
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+
+    def _parse_convert_request(self, url):
+        """解析转换请求，返回文件名、内容或路径、格式选项和是否流式"""
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > self.max_upload_bytes:
+            raise RequestError(413, "上传的文件过大")
+        body = self.rfile.read(length) if length else b""
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        content_type = (self.headers.get("Content-Type") or "").split(";")[0].strip()
+        if content_type == "application/json":
+            try:
+                payload = json.loads(body.decode("utf-8") or "{}")
+            except ValueError as e:
+                raise RequestError(400, f"无效的JSON: {e}")
+            if not isinstance(payload, dict):
+                raise RequestError(400, "请求体必须是JSON对象")
+        else:
+            payload = {"filename": query.get("filename"), "data": body}
+
+        stream = payload.get("stream", query.get("stream"))
+        request = {
+            "stream": stream in (True, 1, "1", "true"),
+            "options": payload.get("options"),
+            "path": None,
+            "data": None
+        }
+        if payload.get("path"):
+            request["path"] = self.service.resolve_path(payload["path"])
+            request["filename"] = request["path"].name
+        elif payload.get("content_base64") is not None:
+            try:
+                request["data"] = base64.b64decode(payload["content_base64"])
+            except ValueError as e:
+                raise RequestError(400, f"无效的base64内容: {e}")
+            request["filename"] = payload.get("filename") or ""
+        elif payload.get("data"):
+            request["data"] = payload["data"]
+            request["filename"] = payload.get("filename") or ""
+        else:
+            raise RequestError(400, "请求中缺少文件路径或文件内容")
+
+        if not request["filename"]:
+            raise RequestError(400, "缺少filename，无法判断文件类型")
+        return request
+
+    def _convert_streaming(self, request):
+        """以Server-Sent Events方式返回处理阶段、增量文本和最终结果"""
+        events = queue.Queue()
+        future = self.service.submit(
+            request["filename"], data=request["data"], path=request["path"], options=request["options"],
+            on_event=lambda event, payload: events.put((event, payload))
+        )
+        future.add_done_callback(lambda f: events.put(None))
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        try:
+            while True:
+                item = events.get()
+                if item is None:
+                    break
+                self._write_event(*item)
+
+            error = future.exception()
+            if error is None:
+                self._write_event("done", future.result())
+            else:
+                self._write_event("error", {"error": str(error), "stage": getattr(error, "stage", None)})
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端已断开，任务继续完成并写入缓存
+            pass
+
+    def _write_event(self, event, payload):
+        data = json.dumps(payload, ensure_ascii=False)
+        self.wfile.write(f"event: {event}\ndata: {data}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # 默认会把每个请求输出到stderr，服务模式下保持安静
+        pass
+
+
+def start_api_server(service, host="127.0.0.1", port=8000):
+    """在后台线程中启动HTTP服务
+    Args:
+        service: ConversionService实例
+        host: 监听地址
+        port: 监听端口，为0时自动选择
+    Returns:
+        ThreadingHTTPServer: 服务实例，server.server_address[1] 为实际端口
+    """
+    handler = type("BoundConversionRequestHandler", (ConversionRequestHandler,), {"service": service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
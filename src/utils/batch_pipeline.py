@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@File    :   batch_pipeline.py
+@Time    :   2025/04/03
+@Author  :   Maker 
+@Version :   1.0
+'''
+
+"""
+批量转换流水线
+将单个文件的处理拆分为 读取(OCR) → AI处理 → 写出 三个阶段，
+配合任务日志(JobJournal)记录每个阶段的结果，重新运行时从中断的阶段继续。
+标题级别、列表样式和代码块语言在写出前于本地应用，AI结果与这些选项无关，修改它们后重新运行不需要调用模型
+"""
+
+import time
+from pathlib import Path
+from contextlib import nullcontext
+from concurrent.futures import Future
+
+from utils.file_handler import FileHandler
+from utils.job_journal import options_key, STAGE_WRITTEN
+from utils.docx_markdown import DOCX_MODE_AUTO, docx_llm_options
+from utils.markdown_format import split_format_options, apply_format_options
+
+
+class PipelineError(Exception):
+    """流水线处理错误，stage为出错的阶段"""
+    
+    def __init__(self, stage, message):
+        super().__init__(message)
+        self.stage = stage
+
+
+class BatchPipeline:
+    """批量转换流水线，不依赖界面，可在工作线程中并发调用"""
+    
+    def __init__(self, processor, format_options, output_folder, journal=None, source_root=None,
+                 deduplicator=None, docx_mode=DOCX_MODE_AUTO, metrics=None):
+        """
+        Args:
+            processor: AI处理器(CustomProcessor或ModelRouter)
+            format_options: 格式选项
+            output_folder: 输出文件夹
+            journal: 任务日志(JobJournal)，为None时不记录进度
+            source_root: 源文件根目录，提供时输出文件保持相对于该目录的子目录结构
+            deduplicator: 重复图片去重器(ImageDeduplicator)，提供时内容相同的图片只OCR一次
+            docx_mode: Word文档的处理方式(DOCX_MODE_*)，默认结构清晰的文档跳过AI处理
+            metrics: 流水线指标(PipelineMetrics)，提供时记录各阶段(read/ocr/llm/write/total)的耗时
+        """
+        self.processor = processor
+        self.format_options = dict(format_options or {})
+        self.output_folder = Path(output_folder)
+        self.journal = journal
+        self.source_root = Path(source_root) if source_root else None
+        self.deduplicator = deduplicator
+        self.docx_mode = docx_mode
+        self.metrics = metrics
+        # Word文档的结构统计，决定是否需要AI处理
+        self._docx_reports = {}
+        # 发送给模型的选项决定AI结果的缓存，本地应用的选项只影响写出的文件
+        self.llm_format_options, self.local_format_options = split_format_options(self.format_options)
+        self.options_key = options_key(self.llm_format_options)
+        self.render_key = options_key(self.local_format_options)
+        # Word文档本地转换时不标注代码块语言，由写出阶段统一补充
+        self._docx_options = dict(self.format_options, code_language="")
+    
+    def output_path(self, file):
+        """获取文件对应的输出路径"""
+        file = Path(file)
+        if self.source_root is not None:
+            try:
+                relative_dir = file.parent.relative_to(self.source_root)
+                return self.output_folder / relative_dir / f"{file.stem}.md"
+            except ValueError:
+                pass
+        return self.output_folder / f"{file.stem}.md"
+    
+    def _measure(self, stage):
+        """阶段计时，未提供指标时不做任何事"""
+        return self.metrics.measure(stage) if self.metrics is not None else nullcontext()
+    
+    def _begin(self, stage):
+        """开始跨线程的阶段计时，返回开始时间"""
+        if self.metrics is not None:
+            self.metrics.begin(stage)
+        return time.monotonic()
+    
+    def _end(self, stage, started, success):
+        if self.metrics is not None:
+            self.metrics.end(stage, time.monotonic() - started, success)
+    
+    def file_options_key(self, file):
+        """文件的AI结果对应的选项指纹：Word文档还包括处理方式和按文档结构实际使用的模型选项"""
+        if Path(file).suffix.lower() != '.docx':
+            return self.options_key
+        return options_key({"docx_mode": self.docx_mode, "llm_options": self.llm_options(file)})
+    
+    def is_done(self, file):
+        """文件是否已在之前的运行中处理完成"""
+        if self.journal is None:
+            return False
+        # 未写出的文件不必计算选项指纹(Word文档需要统计文档结构)
+        row = self.journal.get(file)
+        if not row or row["stage"] != STAGE_WRITTEN:
+            return False
+        return self.journal.is_done(file, self.file_options_key(file), self.render_key)
+    
+    def read(self, file):
+        """读取阶段：优先使用日志中保存的内容，否则读取文件(图像文件进行OCR)"""
+        row = self.journal.get(file) if self.journal else None
+        if row and row.get("content") is not None:
+            return row["content"]
+        
+        stage = "ocr" if Path(file).suffix.lower() in FileHandler.SUPPORTED_IMAGE_FORMATS else "read"
+        with self._measure(stage):
+            content = self._read_file(file, row)
+        
+        if self.journal:
+            self.journal.mark_ocr_done(file, content)
+        return content
+    
+    def _read_file(self, file, row):
+        """读取文件内容，失败时记录并抛出PipelineError"""
+        try:
+            if self.deduplicator is not None and self.deduplicator.is_image(file):
+                content = self.deduplicator.read_image(file, FileHandler.read_file)
+            elif Path(file).suffix.lower() in FileHandler.PLAIN_TEXT_FORMATS:
+                # 使用日志中缓存的编码，省去检测
+                cached_encoding = row.get("encoding") if row else None
+                content, encoding = FileHandler.load_text_file(str(file), cached_encoding)
+                if self.journal and encoding and encoding != cached_encoding:
+                    self.journal.set_encoding(file, encoding)
+            elif Path(file).suffix.lower() == '.docx':
+                content, self._docx_reports[str(file)] = FileHandler.load_docx_file(
+                    str(file), self._docx_options
+                )
+            else:
+                content = FileHandler.read_file(str(file))
+        except Exception as e:
+            self._fail(file, "read", e)
+        if not content:
+            self._fail(file, "read", "无法读取文件内容")
+        return content
+    
+    def cached_result(self, file):
+        """获取日志中保存的、按相同格式选项生成的AI结果，没有时返回None"""
+        row = self.journal.get(file) if self.journal else None
+        if row and row.get("result") is not None and row.get("options_key") == self.file_options_key(file):
+            return row["result"]
+        return None
+    
+    def record_result(self, file, result):
+        """记录AI处理结果(离线批处理模式下由调用方获得结果后调用)"""
+        if not result:
+            self._fail(file, "llm", "模型未返回结果")
+        if self.journal:
+            self.journal.mark_llm_done(file, result, self.file_options_key(file))
+        return result
+    
+    def pending_batch(self, file):
+        """获取文件之前提交、尚未取得结果的离线批处理任务
+        
+        Returns:
+            tuple: (batch_id, custom_id)；没有记录或格式选项已变化时返回None
+        """
+        row = self.journal.batch_request(file) if self.journal else None
+        if row and row["options_key"] == self.file_options_key(file):
+            return row["batch_id"], row["custom_id"]
+        return None
+    
+    def record_batch(self, batch_id, files):
+        """记录已提交到离线批处理任务的文件
+        
+        Args:
+            batch_id: 批处理任务ID
+            files: {custom_id: 源文件路径}
+        """
+        if self.journal:
+            self.journal.mark_batch_submitted(
+                batch_id, {custom_id: (file, self.file_options_key(file)) for custom_id, file in files.items()}
+            )
+    
+    def clear_batch(self, files):
+        """清除文件的离线批处理任务记录，下次运行时重新提交"""
+        if self.journal:
+            self.journal.clear_batch_requests(files)
+    
+    def llm_options(self, file):
+        """获取文件调用模型使用的格式选项
+        
+        Returns:
+            dict: 格式选项；结构清晰的Word文档返回None，表示直接使用本地转换结果
+        """
+        if Path(file).suffix.lower() != '.docx':
+            return dict(self.llm_format_options)
+        report = self._docx_reports.get(str(file))
+        if report is None:
+            # 内容来自任务日志(继续之前的运行)，重新统计文档结构
+            try:
+                _, report = FileHandler.load_docx_file(str(file), self._docx_options)
+            except Exception:
+                return dict(self.llm_format_options)
+            self._docx_reports[str(file)] = report
+        return docx_llm_options(report, self.llm_format_options, self.docx_mode)
+    
+    def transform(self, file, content):
+        """AI处理阶段：格式选项未变化时复用日志中保存的结果"""
+        result = self.cached_result(file)
+        if result is not None:
+            return result
+        
+        options = self.llm_options(file)
+        if options is None:
+            return self.record_result(file, content)
+        try:
+            with self._measure("llm"):
+                result = self.processor.process_note(content, options)
+        except Exception as e:
+            self._fail(file, "llm", e)
+        return self.record_result(file, result)
+    
+    def fail(self, file, stage, error):
+        """记录外部阶段(如离线批处理)的失败，不抛出异常"""
+        if self.journal:
+            self.journal.mark_failed(file, stage, error)
+    
+    def render(self, file, result):
+        """在AI结果上应用本地格式选项(标题级别、列表样式、代码块语言)
+        
+        Args:
+            file: 源文件路径
+            result: AI结果(或Word文档的本地转换结果)
+        Returns:
+            str: 写出的Markdown内容
+        """
+        # 本地转换的Word文档已按原文的编号类型生成列表，不再统一列表样式
+        restyle_lists = Path(file).suffix.lower() != '.docx' or self.llm_options(file) is not None
+        return apply_format_options(result, self.local_format_options, restyle_lists)
+    
+    def write(self, file, result):
+        """写出阶段：应用本地格式选项后保存Markdown文件"""
+        output_file = self.output_path(file)
+        with self._measure("write"):
+            saved = FileHandler.save_markdown_file(self.render(file, result), str(output_file))
+        if not saved:
+            self._fail(file, "write", "保存Markdown文件失败")
+        
+        if self.journal:
+            self.journal.mark_written(file, output_file, self.render_key)
+        return output_file
+    
+    def convert_file(self, file):
+        """完整处理单个文件，返回输出文件路径"""
+        with self._measure("total"):
+            content = self.read(file)
+            result = self.transform(file, content)
+            return self.write(file, result)
+    
+    def submit_file(self, file):
+        """处理单个文件，返回写出后完成的Future
+        
+        AI处理器提供submit_note(如NotePacker)时，需要调用模型的文件在读取后即返回，
+        由处理器凑成请求后在其发送线程中写出，调用线程可以继续处理下一个文件；否则与convert_file相同
+        """
+        future = Future()
+        submit_note = getattr(self.processor, "submit_note", None)
+        if submit_note is None:
+            try:
+                future.set_result(self.convert_file(file))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        
+        started = self._begin("total")
+        try:
+            content = self.read(file)
+            options = None if self.cached_result(file) is not None else self.llm_options(file)
+            if options is None:
+                # 已有AI结果或不需要AI处理，直接写出
+                future.set_result(self.write(file, self.transform(file, content)))
+        except Exception as e:
+            future.set_exception(e)
+        if future.done():
+            self._end("total", started, future.exception() is None)
+            return future
+        
+        llm_started = self._begin("llm")
+        
+        def on_result(note_future):
+            error = note_future.exception()
+            self._end("llm", llm_started, error is None)
+            try:
+                if error is not None:
+                    self._fail(file, "llm", error)
+                future.set_result(self.write(file, self.record_result(file, note_future.result())))
+            except Exception as e:
+                future.set_exception(e)
+            self._end("total", started, future.exception() is None)
+        
+        submit_note(content, options).add_done_callback(on_result)
+        return future
+    
+    def _fail(self, file, stage, error):
+        """记录失败并抛出PipelineError"""
+        if self.journal:
+            self.journal.mark_failed(file, stage, error)
+        raise PipelineError(stage, str(error))
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@File    :   batch_scheduler.py
+@Time    :   2025/04/03
+@Author  :   Maker
+@Version :   1.0
+'''
+
+"""
+批处理调度
+按文件大小、页数/帧数和类型估算每个文件的处理耗时，并用各类型的历史实测耗时校正，
+再按策略确定处理顺序：最长优先(LPT)让耗时长的PDF和图片先开始，避免最后只剩几个
+工作线程在处理大文件；最短优先则尽早产出结果。用户置顶的文件始终最先处理
+"""
+
+import os
+import json
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.file_handler import FileHandler
+from models.token_estimator import (
+    IMAGE_TOKENS_ESTIMATE, OUTPUT_TOKEN_RATIO, DEFAULT_REQUEST_OVERHEAD, DEFAULT_OUTPUT_TOKENS_PER_SECOND
+)
+
+
+# 调度策略
+STRATEGY_LONGEST_FIRST = "longest_first"
+STRATEGY_SHORTEST_FIRST = "shortest_first"
+STRATEGY_INPUT_ORDER = "input_order"
+
+# 没有历史数据时的默认假设
+DEFAULT_OCR_SECONDS_PER_FRAME = 3.0
+DEFAULT_PDF_SECONDS_PER_PAGE = 0.05
+PDF_TOKENS_PER_PAGE = 500
+# 纯文本每个token约占的字节数(中文UTF-8约3字节1个token，英文约4字节1个token)
+BYTES_PER_TOKEN = 3.5
+# Word文档为压缩格式，每个token约占的字节数
+DOCX_BYTES_PER_TOKEN = 10
+
+# 历史记录中的样本数达到该值后才用于校正
+MIN_HISTORY_SAMPLES = 3
+
+
+class FileCost:
+    """单个文件的预估处理耗时"""
+
+    def __init__(self, path, size=0, units=1, base_seconds=0.0, factor=1.0, error=None):
+        """
+        Args:
+            path: 文件路径
+            size: 文件大小(字节)
+            units: 页数(PDF)或帧数(图片)，其他文件为1
+            base_seconds: 按默认假设预估的耗时(秒)
+            factor: 按历史数据得到的校正系数
+            error: 无法获取文件信息时的错误
+        """
+        self.path = Path(path)
+        self.size = size
+        self.units = units
+        self.base_seconds = base_seconds
+        self.factor = factor
+        self.error = error
+
+    @property
+    def seconds(self):
+        """校正后的预估耗时(秒)"""
+        return self.base_seconds * self.factor
+
+
+class FileCostHistory:
+    """各文件类型的实测耗时与预估耗时之比，保存在项目根目录的file_cost_stats.json中"""
+
+    def __init__(self, stats_file=None):
+        """
+        Args:
+            stats_file: 统计文件路径，为None时使用项目根目录下的file_cost_stats.json
+        """
+        if stats_file is None:
+            stats_file = Path(__file__).resolve().parent.parent.parent / "file_cost_stats.json"
+        self.stats_file = Path(stats_file)
+        self.stats = {}
+        self._lock = threading.Lock()
+
+        if self.stats_file.exists():
+            try:
+                with open(self.stats_file, 'r', encoding='utf-8') as f:
+                    self.stats = json.load(f)
+            except Exception as e:
+                print(f"读取文件耗时统计时出错: {e}")
+
+    def record(self, extension, predicted, actual):
+        """记录一个文件的预估耗时和实测耗时"""
+        if predicted <= 0 or actual <= 0:
+            return
+        with self._lock:
+            entry = self.stats.setdefault(extension, {"count": 0, "predicted": 0.0, "actual": 0.0})
+            entry["count"] += 1
+            entry["predicted"] += predicted
+            entry["actual"] += actual
+
+    def factor(self, extension):
+        """某类型文件的校正系数(实测/预估)，样本不足时为1"""
+        with self._lock:
+            entry = self.stats.get(extension)
+        if not entry or entry.get("count", 0) < MIN_HISTORY_SAMPLES or not entry.get("predicted"):
+            return 1.0
+        return entry["actual"] / entry["predicted"]
+
+    def save(self):
+        """保存统计数据"""
+        with self._lock:
+            stats = json.loads(json.dumps(self.stats))
+        try:
+            with open(self.stats_file, 'w', encoding='utf-8') as f:
+                json.dump(stats, f, ensure_ascii=False, indent=4)
+        except Exception as e:
+            print(f"保存文件耗时统计时出错: {e}")
+
+
+def count_units(file_path):
+    """获取PDF的页数或图片的帧数，无法获取时返回1"""
+    extension = Path(file_path).suffix.lower()
+    try:
+        if extension == '.pdf':
+            import PyPDF2
+            with open(file_path, 'rb') as f:
+                return max(1, len(PyPDF2.PdfReader(f, strict=False).pages))
+        if extension in ('.tiff', '.gif'):
+            from PIL import Image
+            with Image.open(file_path) as img:
+                return max(1, getattr(img, "n_frames", 1))
+    except Exception:
+        pass
+    return 1
+
+
+def _llm_seconds(tokens):
+    """按默认的输出速度估算模型处理耗时"""
+    return DEFAULT_REQUEST_OVERHEAD + tokens * OUTPUT_TOKEN_RATIO / DEFAULT_OUTPUT_TOKENS_PER_SECOND
+
+
+def base_cost(extension, size, units):
+    """不考虑历史数据时的预估耗时(秒)：OCR/解析耗时 + 模型处理耗时"""
+    if extension in FileHandler.SUPPORTED_IMAGE_FORMATS:
+        return units * DEFAULT_OCR_SECONDS_PER_FRAME + _llm_seconds(units * IMAGE_TOKENS_ESTIMATE)
+    if extension == '.pdf':
+        return units * DEFAULT_PDF_SECONDS_PER_PAGE + _llm_seconds(units * PDF_TOKENS_PER_PAGE)
+    if extension == '.docx':
+        return _llm_seconds(size / DOCX_BYTES_PER_TOKEN)
+    return _llm_seconds(size / BYTES_PER_TOKEN)
+
+
+class BatchScheduler:
+    """批处理调度器"""
+
+    def __init__(self, strategy=STRATEGY_LONGEST_FIRST, history=None, max_workers=None):
+        """
+        Args:
+            strategy: 调度策略(STRATEGY_*)
+            history: FileCostHistory实例，为None时自动加载
+            max_workers: 并行获取文件信息的线程数
+        """
+        self.strategy = strategy
+        self.history = history or FileCostHistory()
+        self.max_workers = max_workers or min(32, (os.cpu_count() or 1) * 4)
+        self._costs = {}
+        self._lock = threading.Lock()
+
+    def estimate(self, file_path):
+        """预估单个文件的处理耗时"""
+        file_path = Path(file_path)
+        extension = file_path.suffix.lower()
+        try:
+            size = file_path.stat().st_size
+        except OSError as e:
+            return FileCost(file_path, error=str(e))
+        units = count_units(file_path)
+        cost = FileCost(file_path, size, units, base_cost(extension, size, units), self.history.factor(extension))
+        with self._lock:
+            self._costs[str(file_path)] = cost
+        return cost
+
+    def order(self, files, priorities=None):
+        """按策略确定处理顺序
+
+        Args:
+            files: 文件路径列表
+            priorities: 用户指定的优先级 {路径: 优先级}，数值大的先处理，未指定的为0
+        Returns:
+            list: 排序后的文件路径列表
+        """
+        files = list(files)
+        priorities = {str(path): value for path, value in (priorities or {}).items()}
+
+        if self.strategy == STRATEGY_INPUT_ORDER:
+            costs = None
+        else:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                costs = list(executor.map(self.estimate, files))
+
+        def key(index):
+            priority = priorities.get(str(files[index]), 0)
+            if costs is None:
+                return (-priority, index)
+            seconds = costs[index].seconds
+            if self.strategy == STRATEGY_LONGEST_FIRST:
+                seconds = -seconds
+            return (-priority, seconds, index)
+
+        return [files[index] for index in sorted(range(len(files)), key=key)]
+
+    def record(self, file_path, seconds):
+        """记录文件的实测耗时，用于校正之后的预估"""
+        with self._lock:
+            cost = self._costs.get(str(file_path))
+        if cost is not None and seconds is not None:
+            self.history.record(cost.path.suffix.lower(), cost.base_seconds, seconds)
+
+    def save(self):
+        """保存历史统计"""
+        self.history.save()
@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@File    :   docx_markdown.py
+@Time    :   2025/04/03
+@Author  :   Maker
+@Version :   1.0
+'''
+
+"""
+Word文档转Markdown
+按文档正文顺序一次遍历段落和表格，将标题样式、项目编号、表格、代码样式和
+加粗/斜体/删除线/链接等行内格式直接映射为Markdown，同时统计文档的结构化程度。
+结构清晰的文档可以不经过AI处理，其余文档也只需让模型做简单的整理
+"""
+
+import re
+
+import docx
+from docx.oxml.ns import qn
+from docx.table import Table
+from docx.text.paragraph import Paragraph
+from docx.text.hyperlink import Hyperlink
+
+
+# Word文档的处理方式
+DOCX_MODE_AUTO = "auto"    # 结构清晰的文档直接使用本地转换结果，其余使用整理提示词调用模型
+DOCX_MODE_LLM = "llm"      # 始终调用模型(使用原有的提示词)
+DOCX_MODE_LOCAL = "local"  # 始终只使用本地转换结果
+
+# 结构不清晰的文档使用的整理提示词，模型只需修正格式而不用重建结构
+DOCX_CLEANUP_PROMPT = (
+    "以下内容已从Word文档转换为Markdown，标题、列表和表格已基本保留。"
+    "请只修正其中的格式问题(如手动输入编号的列表、用加粗文字代替的标题)，不要改写或删减正文内容:\n\n"
+)
+
+# 等宽字体，整段使用时视为代码
+MONOSPACE_FONTS = {"consolas", "courier", "courier new", "menlo", "monaco", "source code pro", "fira code"}
+
+HEADING_STYLE_PATTERN = re.compile(r"^(?:heading|标题)\s*(\d)$", re.IGNORECASE)
+# 手动输入的列表标记(未使用Word的项目编号)
+MANUAL_LIST_PATTERN = re.compile(
+    r"^\s*(?:[•·●○■◆▪\-\*]\s|\d+[\.、\)]\s*\S|[（(]\d+[)）]|[一二三四五六七八九十]+、)"
+)
+
+
+class StructureReport:
+    """文档结构统计"""
+
+    def __init__(self):
+        self.paragraphs = 0
+        self.headings = 0
+        self.list_items = 0
+        self.tables = 0
+        self.code_lines = 0
+        # 疑似未使用样式的结构：手动编号的列表、用加粗短句代替的标题
+        self.manual_list_items = 0
+        self.fake_headings = 0
+
+    @property
+    def unstructured_hints(self):
+        return self.manual_list_items + self.fake_headings
+
+    @property
+    def well_structured(self):
+        """有标题样式，且疑似手动排版的段落不超过段落总数的5%"""
+        blocks = self.paragraphs + self.tables
+        return self.headings > 0 and self.unstructured_hints <= blocks * 0.05
+
+    def to_dict(self):
+        return {
+            "paragraphs": self.paragraphs,
+            "headings": self.headings,
+            "list_items": self.list_items,
+            "tables": self.tables,
+            "code_lines": self.code_lines,
+            "manual_list_items": self.manual_list_items,
+            "fake_headings": self.fake_headings,
+            "well_structured": self.well_structured
+        }
+
+
+class DocxMarkdownConverter:
+    """Word文档转Markdown转换器"""
+
+    def __init__(self, format_options=None):
+        """
+        Args:
+            format_options: 格式选项，使用其中的header_level(顶级标题级别)、
+                            list_style(无法判断编号类型时的列表样式)和code_language(代码块语言)
+        """
+        format_options = format_options or {}
+        self.header_level = int(format_options.get("header_level") or 1)
+        self.list_style = format_options.get("list_style") or "unordered"
+        self.code_language = format_options.get("code_language") or ""
+
+    def convert(self, file_path):
+        """转换Word文档
+
+        Returns:
+            tuple: (Markdown文本, StructureReport)
+        """
+        document = docx.Document(file_path)
+        self._numbering = self._load_numbering(document)
+        self._counters = {}
+        report = StructureReport()
+
+        blocks = []
+        code_lines = []
+        list_lines = []
+
+        def flush():
+            if code_lines:
+                blocks.append(f"```{self.code_language}\n" + "\n".join(code_lines) + "\n```")
+                code_lines.clear()
+            if list_lines:
+                blocks.append("\n".join(list_lines))
+                list_lines.clear()
+
+        # 按正文中的先后顺序遍历段落和表格
+        for element in document.element.body.iterchildren():
+            if element.tag == qn("w:p"):
+                paragraph = Paragraph(element, document)
+                kind, text = self._convert_paragraph(paragraph, report)
+                if kind is None:
+                    continue
+                if kind == "code":
+                    if list_lines:
+                        flush()
+                    code_lines.append(text)
+                    continue
+                if kind == "list":
+                    if code_lines:
+                        flush()
+                    list_lines.append(text)
+                    continue
+                flush()
+                # 非列表段落会打断编号，之后的同一编号重新计数
+                self._counters.clear()
+                blocks.append(text)
+            elif element.tag == qn("w:tbl"):
+                flush()
+                self._counters.clear()
+                report.tables += 1
+                table_text = self._convert_table(Table(element, document))
+                if table_text:
+                    blocks.append(table_text)
+        flush()
+
+        return "\n\n".join(blocks) + "\n", report
+
+    def _load_numbering(self, document):
+        """读取编号定义：{(numId, ilvl): 是否为有序编号}"""
+        numbering = {}
+        try:
+            root = document.part.numbering_part.element
+        except (KeyError, NotImplementedError, AttributeError):
+            return numbering
+
+        abstract_formats = {}
+        for abstract in root.findall(qn("w:abstractNum")):
+            levels = {}
+            for lvl in abstract.findall(qn("w:lvl")):
+                fmt = lvl.find(qn("w:numFmt"))
+                levels[int(lvl.get(qn("w:ilvl")))] = fmt is None or fmt.get(qn("w:val")) != "bullet"
+            abstract_formats[abstract.get(qn("w:abstractNumId"))] = levels
+
+        for num in root.findall(qn("w:num")):
+            abstract_id = num.find(qn("w:abstractNumId"))
+            if abstract_id is None:
+                continue
+            for ilvl, ordered in abstract_formats.get(abstract_id.get(qn("w:val")), {}).items():
+                numbering[(num.get(qn("w:numId")), ilvl)] = ordered
+        return numbering
+
+    @staticmethod
+    def _style_name(paragraph):
+        try:
+            return paragraph.style.name if paragraph.style is not None else ""
+        except (KeyError, ValueError):
+            return ""
+
+    @staticmethod
+    def _num_pr(paragraph):
+        """获取段落的项目编号设置(段落自身或其样式中定义)"""
+        p_pr = paragraph._p.pPr
+        if p_pr is not None and p_pr.numPr is not None:
+            return p_pr.numPr
+        try:
+            style_p_pr = paragraph.style.element.pPr if paragraph.style is not None else None
+        except (KeyError, ValueError):
+            style_p_pr = None
+        if style_p_pr is not None and style_p_pr.numPr is not None:
+            return style_p_pr.numPr
+        return None
+
+    def _heading_level(self, paragraph, style_name):
+        """段落的标题级别(1起)，不是标题时返回None"""
+        if style_name.lower() == "title" or style_name == "标题":
+            return 1
+        match = HEADING_STYLE_PATTERN.match(style_name.strip())
+        if match:
+            return int(match.group(1))
+        p_pr = paragraph._p.pPr
+        outline = p_pr.find(qn("w:outlineLvl")) if p_pr is not None else None
+        if outline is not None:
+            level = int(outline.get(qn("w:val"))) + 1
+            if level <= 6:
+                return level
+        return None
+
+    def _is_code(self, paragraph, style_name):
+        """整段为代码样式或等宽字体"""
+        lowered = style_name.lower()
+        if "code" in lowered or "代码" in style_name:
+            return True
+        runs = [run for run in paragraph.runs if run.text.strip()]
+        return bool(runs) and all(
+            (run.font.name or "").lower() in MONOSPACE_FONTS for run in runs
+        )
+
+    def _convert_paragraph(self, paragraph, report):
+        """转换单个段落，返回(类型, 文本)，空段落返回(None, None)"""
+        style_name = self._style_name(paragraph)
+        plain_text = paragraph.text
+
+        if self._is_code(paragraph, style_name):
+            report.code_lines += 1
+            return "code", plain_text
+
+        if not plain_text.strip():
+            return None, None
+        report.paragraphs += 1
+
+        heading_level = self._heading_level(paragraph, style_name)
+        if heading_level is not None:
+            report.headings += 1
+            level = min(6, self.header_level + heading_level - 1)
+            # 标题中不再保留加粗等行内格式
+            return "heading", "#" * level + " " + plain_text.strip()
+
+        text = self._convert_inline(paragraph)
+
+        num_pr = self._num_pr(paragraph)
+        lowered = style_name.lower()
+        if num_pr is not None or lowered.startswith("list"):
+            report.list_items += 1
+            return "list", self._list_item(num_pr, lowered, text)
+
+        if MANUAL_LIST_PATTERN.match(plain_text):
+            report.manual_list_items += 1
+        elif self._looks_like_fake_heading(paragraph, plain_text):
+            report.fake_headings += 1
+
+        if "quote" in lowered or "引用" in style_name:
+            return "paragraph", "> " + text
+        return "paragraph", text
+
+    def _list_item(self, num_pr, lowered_style, text):
+        """生成列表项，有序编号按(编号, 级别)分别计数"""
+        # "List Bullet 2"等样式名末尾的数字表示列表级别
+        style_level = int(lowered_style[-1]) - 1 if lowered_style[-1:].isdigit() else 0
+        if num_pr is not None:
+            num_id = num_pr.numId.val if num_pr.numId is not None else None
+            level = num_pr.ilvl.val if num_pr.ilvl is not None else style_level
+            ordered = self._numbering.get((str(num_id), level))
+        else:
+            num_id, level = lowered_style, style_level
+            ordered = None
+            if "number" in lowered_style:
+                ordered = True
+            elif "bullet" in lowered_style:
+                ordered = False
+        if ordered is None:
+            ordered = self.list_style == "ordered"
+
+        # 回到上级时，下级编号重新开始
+        for key in [key for key in self._counters if key[0] == num_id and key[1] > level]:
+            del self._counters[key]
+
+        indent = "    " * level
+        if ordered:
+            key = (num_id, level)
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return f"{indent}{self._counters[key]}. {text}"
+        return f"{indent}- {text}"
+
+    @staticmethod
+    def _looks_like_fake_heading(paragraph, plain_text):
+        """整段加粗、较短且不以标点结尾的段落，多半是没有使用标题样式的标题"""
+        text = plain_text.strip()
+        if len(text) > 30 or text[-1] in "。.，,；;：:！!？?":
+            return False
+        runs = [run for run in paragraph.runs if run.text.strip()]
+        return bool(runs) and all(run.bold for run in runs)
+
+    def _convert_inline(self, paragraph):
+        """转换段落中的行内格式，相邻且格式相同的文字合并后再加标记"""
+        segments = []
+        for item in paragraph.iter_inner_content():
+            if isinstance(item, Hyperlink):
+                if item.text:
+                    link = f"[{item.text}]({item.address})" if item.address else item.text
+                    segments.append((link, (False, False, False, False), True))
+                continue
+            text = item.text
+            if not text:
+                continue
+            font_name = (item.font.name or "").lower()
+            style = (bool(item.bold), bool(item.italic), bool(item.font.strike), font_name in MONOSPACE_FONTS)
+            if segments and not segments[-1][2] and segments[-1][1] == style:
+                segments[-1] = (segments[-1][0] + text, style, False)
+            else:
+                segments.append((text, style, False))
+
+        parts = []
+        for text, (bold, italic, strike, monospace), raw in segments:
+            if raw or not text.strip():
+                parts.append(text)
+                continue
+            # 标记放在首尾空白之内，否则Markdown不会识别
+            leading = text[:len(text) - len(text.lstrip())]
+            trailing = text[len(text.rstrip()):]
+            core = text.strip()
+            if monospace:
+                core = f"`{core}`"
+            else:
+                if bold and italic:
+                    core = f"***{core}***"
+                elif bold:
+                    core = f"**{core}**"
+                elif italic:
+                    core = f"*{core}*"
+                if strike:
+                    core = f"~~{core}~~"
+            parts.append(leading + core + trailing)
+        # 段落内的软换行在Markdown中用行尾两个空格表示
+        return "".join(parts).replace("\n", "  \n")
+
+    def _convert_table(self, table):
+        """将表格转换为Markdown表格，第一行作为表头"""
+        rows = []
+        for row in table.rows:
+            cells = []
+            for cell in row.cells:
+                text = "<br>".join(p.text.strip() for p in cell.paragraphs if p.text.strip())
+                cells.append(text.replace("|", "\\|"))
+            rows.append(cells)
+        if not rows:
+            return ""
+
+        width = max(len(cells) for cells in rows)
+        lines = []
+        for index, cells in enumerate(rows):
+            cells = cells + [""] * (width - len(cells))
+            lines.append("| " + " | ".join(cells) + " |")
+            if index == 0:
+                lines.append("| " + " | ".join(["---"] * width) + " |")
+        return "\n".join(lines)
+
+
+def docx_llm_options(report, format_options, mode=DOCX_MODE_AUTO):
+    """根据文档结构和处理方式决定如何调用模型
+
+    Args:
+        report: StructureReport
+        format_options: 原始格式选项
+        mode: 处理方式(DOCX_MODE_*)
+    Returns:
+        dict: 调用模型使用的格式选项；返回None表示直接使用本地转换结果
+    """
+    if mode == DOCX_MODE_LOCAL or (mode == DOCX_MODE_AUTO and report.well_structured):
+        return None
+    options = dict(format_options or {})
+    if mode == DOCX_MODE_AUTO:
+        options["prompt_template"] = DOCX_CLEANUP_PROMPT
+    return options
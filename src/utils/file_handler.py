@@ -13,47 +13,69 @@
 """
 
 import os
-import docx
 import PyPDF2
 from pathlib import Path
 
 # 导入OCR处理器
-from ocr.ocr_processor import OCRProcessor, OCRProcessingError
+from ocr.ocr_processor import get_ocr_processor, OCRProcessingError
+from utils.text_decoder import read_text
+from utils.docx_markdown import DocxMarkdownConverter
 
 
 class FileHandler:
     """文件处理类，用于处理不同格式的文件导入和导出"""
     
+    # 支持的文本格式
+    SUPPORTED_TEXT_FORMATS = ['.txt', '.docx', '.pdf', '.md']
+    
+    # 纯文本格式(需要检测编码)
+    PLAIN_TEXT_FORMATS = ['.txt', '.md']
+    
     # 支持的图像格式
     SUPPORTED_IMAGE_FORMATS = ['.png', '.jpg', '.jpeg', '.bmp', '.tiff', '.gif']
     
     @staticmethod
-    def read_text_file(file_path):
-        """读取文本文件"""
+    def read_text_file(file_path, encoding=None):
+        """读取文本文件，自动检测编码(UTF-8/UTF-16/GBK/Big5等)"""
+        return FileHandler.load_text_file(file_path, encoding)[0]
+    
+    @staticmethod
+    def load_text_file(file_path, encoding=None):
+        """读取文本文件并返回检测到的编码，文件只读取一次
+        
+        Args:
+            file_path: 文件路径
+            encoding: 已知的编码(如任务日志中缓存的结果)，为None时自动检测
+        Returns:
+            tuple: (文本内容, 编码)，读取失败时为 (None, None)
+        """
         try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                return file.read()
-        except UnicodeDecodeError:
-            # 尝试使用其他编码
-            with open(file_path, 'r', encoding='gbk') as file:
-                return file.read()
+            return read_text(file_path, encoding)
         except Exception as e:
             print(f"读取文本文件时出错: {e}")
-            return None
+            return None, None
     
     @staticmethod
-    def read_docx_file(file_path):
-        """读取Word文档"""
+    def read_docx_file(file_path, format_options=None):
+        """读取Word文档，标题、列表、表格和行内格式转换为Markdown"""
         try:
-            doc = docx.Document(file_path)
-            full_text = []
-            for para in doc.paragraphs:
-                full_text.append(para.text)
-            return '\n'.join(full_text)
+            return FileHandler.load_docx_file(file_path, format_options)[0]
         except Exception as e:
             print(f"读取Word文档时出错: {e}")
             return None
     
+    @staticmethod
+    def load_docx_file(file_path, format_options=None):
+        """读取Word文档并返回结构统计
+        
+        Args:
+            file_path: 文件路径
+            format_options: 格式选项(使用其中的标题级别、列表样式和代码语言)
+        Returns:
+            tuple: (Markdown文本, StructureReport)
+        """
+        return DocxMarkdownConverter(format_options).convert(file_path)
+    
     @staticmethod
     def read_pdf_file(file_path):
         """读取PDF文件"""
@@ -78,8 +100,8 @@ class FileHandler:
     def read_image_file(file_path):
         """读取图片文件并使用OCR提取文本"""
         try:
-            # 创建OCR处理器
-            ocr_processor = OCRProcessor()
+            # 获取共享的OCR处理器(按当前设置创建，设置变化时自动重建)
+            ocr_processor = get_ocr_processor()
             
             # 处理图片并获取文本
             text = ocr_processor.process_image(Path(file_path))
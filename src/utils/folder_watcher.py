@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@File    :   folder_watcher.py
+@Time    :   2025/04/03
+@Author  :   Maker 
+@Version :   1.0
+'''
+
+"""
+文件夹监视模块
+监视笔记文件夹中新增或修改的文件，对连续写入进行防抖，文件稳定后才通知处理。
+优先使用watchdog(Linux下为inotify)接收系统事件，未安装时退化为轮询
+"""
+
+import os
+import time
+import threading
+from pathlib import Path
+
+
+class FolderWatcher:
+    """文件夹监视器"""
+    
+    def __init__(self, folders, callback, extensions, debounce=2.0, poll_interval=1.0,
+                 full_scan_interval=30.0, exclude_dirs=("markdown_output",), use_native=True):
+        """
+        Args:
+            folders: 要监视的文件夹列表
+            callback: 文件稳定后的回调，参数为Path；回调阻塞时监视器会暂停投递(背压)，
+                期间的变化会被合并
+            extensions: 需要关注的文件扩展名(小写，含点)
+            debounce: 文件最后一次变化后需保持不变的时间(秒)
+            poll_interval: 轮询模式下的扫描间隔(秒)
+            full_scan_interval: 轮询模式下完整扫描的间隔(秒)，用于发现原地修改的文件
+            exclude_dirs: 忽略的目录名(如输出目录，避免处理自身的输出)
+            use_native: 是否尝试使用watchdog接收系统文件事件
+        """
+        self.folders = [Path(folder).resolve() for folder in folders]
+        self.callback = callback
+        self.extensions = set(ext.lower() for ext in extensions)
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.full_scan_interval = full_scan_interval
+        self.exclude_dirs = set(exclude_dirs)
+        self.use_native = use_native
+        
+        self.backend = None
+        self._lock = threading.Lock()
+        self._pending = {}       # 路径 -> (最后一次变化时间, 当时的文件大小)
+        self._snapshot = {}      # 路径 -> (大小, 修改时间)
+        self._dir_mtimes = {}    # 目录 -> 修改时间(轮询模式)
+        self._stop_event = threading.Event()
+        self._threads = []
+        self._observer = None
+    
+    def _is_relevant(self, path):
+        """文件是否需要关注"""
+        path = Path(path)
+        if path.suffix.lower() not in self.extensions or path.name.startswith("."):
+            return False
+        return not any(part in self.exclude_dirs for part in path.parts)
+    
+    def _note_change(self, path):
+        """记录一次文件变化，等待防抖"""
+        path = Path(path)
+        if not self._is_relevant(path):
+            return
+        try:
+            size = path.stat().st_size
+        except OSError:
+            return
+        with self._lock:
+            self._pending[path] = (time.monotonic(), size)
+    
+    def _scan_dir(self, directory, full=True):
+        """扫描目录，记录新增或变化的文件
+        
+        非完整扫描时只列出目录项(不stat文件)，仅对修改时间发生变化的目录检查其中的文件
+        """
+        directory = Path(directory)
+        try:
+            mtime = directory.stat().st_mtime
+            entries = list(os.scandir(directory))
+        except OSError:
+            return
+        dir_changed = self._dir_mtimes.get(directory) != mtime
+        self._dir_mtimes[directory] = mtime
+        
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name in self.exclude_dirs or entry.name.startswith("."):
+                        continue
+                    self._scan_dir(entry.path, full)
+                elif (full or dir_changed) and entry.is_file(follow_symlinks=False):
+                    path = Path(entry.path)
+                    if not self._is_relevant(path):
+                        continue
+                    stat = entry.stat()
+                    signature = (stat.st_size, stat.st_mtime)
+                    if self._snapshot.get(path) != signature:
+                        self._snapshot[path] = signature
+                        with self._lock:
+                            self._pending[path] = (time.monotonic(), stat.st_size)
+            except OSError:
+                continue
+    
+    def scan_existing(self):
+        """扫描现有文件，全部加入待处理(启动时调用，配合任务日志跳过已完成的文件)"""
+        for folder in self.folders:
+            self._scan_dir(folder, full=True)
+    
+    def _poll_loop(self):
+        """轮询模式：定期检查目录，只检查发生变化的目录中的文件，并定期完整扫描"""
+        last_full_scan = time.monotonic()
+        while not self._stop_event.wait(self.poll_interval):
+            full = time.monotonic() - last_full_scan >= self.full_scan_interval
+            if full:
+                last_full_scan = time.monotonic()
+            for folder in self.folders:
+                self._scan_dir(folder, full)
+    
+    def _debounce_loop(self):
+        """防抖循环：文件在防抖时间内没有再变化且大小稳定后才投递"""
+        while not self._stop_event.wait(0.2):
+            now = time.monotonic()
+            ready = []
+            with self._lock:
+                for path, (changed_at, size) in list(self._pending.items()):
+                    if now - changed_at >= self.debounce:
+                        ready.append((path, size))
+            
+            for path, size in ready:
+                try:
+                    current_size = path.stat().st_size
+                except OSError:
+                    # 文件已被删除
+                    with self._lock:
+                        self._pending.pop(path, None)
+                    continue
+                
+                with self._lock:
+                    entry = self._pending.get(path)
+                    if entry is None or entry[1] != size or current_size != size:
+                        # 期间仍有写入，重新计时
+                        if entry is not None:
+                            self._pending[path] = (time.monotonic(), current_size)
+                        continue
+                    del self._pending[path]
+                
+                if self._stop_event.is_set():
+                    return
+                # 回调可能阻塞(下游队列已满)，此时新的变化继续在_pending中合并
+                self.callback(path)
+    
+    def _start_native(self):
+        """尝试使用watchdog监视文件系统事件"""
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+        except ImportError:
+            return False
+        
+        watcher = self
+        
+        class _Handler(FileSystemEventHandler):
+            def on_created(self, event):
+                if not event.is_directory:
+                    watcher._note_change(event.src_path)
+            
+            def on_modified(self, event):
+                if not event.is_directory:
+                    watcher._note_change(event.src_path)
+            
+            def on_moved(self, event):
+                if not event.is_directory:
+                    watcher._note_change(event.dest_path)
+        
+        observer = Observer()
+        handler = _Handler()
+        for folder in self.folders:
+            observer.schedule(handler, str(folder), recursive=True)
+        observer.start()
+        self._observer = observer
+        return True
+    
+    def start(self, process_existing=True):
+        """启动监视
+        Args:
+            process_existing: 是否把已有文件也加入待处理
+        """
+        if process_existing:
+            self.scan_existing()
+        else:
+            # 只记录快照，不投递
+            self.scan_existing()
+            with self._lock:
+                self._pending.clear()
+        
+        if self.use_native and self._start_native():
+            self.backend = "native"
+        else:
+            self.backend = "polling"
+            self._threads.append(threading.Thread(target=self._poll_loop, daemon=True))
+        
+        self._threads.append(threading.Thread(target=self._debounce_loop, daemon=True))
+        for thread in self._threads:
+            thread.start()
+    
+    def stop(self):
+        """停止监视"""
+        self._stop_event.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join(timeout=5)
+        for thread in self._threads:
+            thread.join(timeout=5)
+    
+    def pending_count(self):
+        """等待防抖的文件数"""
+        with self._lock:
+            return len(self._pending)
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@File    :   job_journal.py
+@Time    :   2025/04/03
+@Author  :   Maker 
+@Version :   1.0
+'''
+
+"""
+批处理任务日志
+使用SQLite(WAL模式)持久化记录每个文件的处理阶段、OCR/读取文本和AI结果，
+程序崩溃或用户取消后再次运行时可以从中断处继续，失败的文件也可以单独重试
+"""
+
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+
+
+# 处理阶段
+STAGE_PENDING = "pending"      # 等待处理
+STAGE_OCR_DONE = "ocr_done"    # 已读取内容(图像文件为OCR完成)
+STAGE_LLM_DONE = "llm_done"    # AI处理完成
+STAGE_WRITTEN = "written"      # 已写出Markdown文件
+STAGE_FAILED = "failed"        # 失败，failed_stage记录失败时所处的阶段
+
+STAGE_NAMES = {
+    STAGE_PENDING: "等待处理",
+    STAGE_OCR_DONE: "读取/OCR完成",
+    STAGE_LLM_DONE: "AI处理完成",
+    STAGE_WRITTEN: "已完成",
+    STAGE_FAILED: "失败"
+}
+
+
+def options_key(format_options):
+    """计算格式选项的指纹，格式选项变化后需要重新进行AI处理"""
+    data = json.dumps(format_options or {}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+class JobJournal:
+    """批处理任务日志，每个文件一行，记录其所处阶段和中间结果"""
+    
+    def __init__(self, db_path):
+        """
+        Args:
+            db_path: SQLite数据库文件路径
+        """
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        
+        # 多个工作线程共享同一连接，由锁保证串行访问
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS items (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER,
+                    mtime REAL,
+                    stage TEXT NOT NULL,
+                    failed_stage TEXT,
+                    content TEXT,
+                    result TEXT,
+                    options_key TEXT,
+                    output_path TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    updated_at REAL,
+                    encoding TEXT,
+                    render_key TEXT
+                )
+            """)
+            # 旧版本创建的日志没有encoding和render_key列
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(items)")}
+            if "encoding" not in columns:
+                self._conn.execute("ALTER TABLE items ADD COLUMN encoding TEXT")
+            if "render_key" not in columns:
+                self._conn.execute("ALTER TABLE items ADD COLUMN render_key TEXT")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_items_stage ON items(stage)")
+            # 已提交到离线批处理接口、尚未取得结果的文件，取消等待后下次运行时继续获取该任务的结果
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS batch_requests (
+                    path TEXT PRIMARY KEY,
+                    batch_id TEXT NOT NULL,
+                    custom_id TEXT NOT NULL,
+                    options_key TEXT,
+                    submitted_at REAL
+                )
+            """)
+            self._conn.commit()
+    
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
+    
+    def _execute(self, sql, params=()):
+        with self._lock:
+            self._conn.execute(sql, params)
+            self._conn.commit()
+    
+    def register(self, files):
+        """登记一批文件：新文件记为等待处理，内容已变化的文件清空其中间结果"""
+        rows = []
+        for file in files:
+            try:
+                stat = Path(file).stat()
+            except OSError:
+                continue
+            rows.append((str(file), stat.st_size, stat.st_mtime))
+        
+        now = time.time()
+        with self._lock:
+            existing = {
+                row["path"]: (row["size"], row["mtime"])
+                for row in self._conn.execute("SELECT path, size, mtime FROM items")
+            }
+            for path, size, mtime in rows:
+                if path not in existing:
+                    self._conn.execute(
+                        "INSERT INTO items (path, size, mtime, stage, updated_at) VALUES (?, ?, ?, ?, ?)",
+                        (path, size, mtime, STAGE_PENDING, now)
+                    )
+                elif existing[path] != (size, mtime):
+                    self._conn.execute(
+                        """UPDATE items SET size=?, mtime=?, stage=?, failed_stage=NULL, content=NULL,
+                           result=NULL, options_key=NULL, output_path=NULL, render_key=NULL, error=NULL,
+                           attempts=0, updated_at=? WHERE path=?""",
+                        (size, mtime, STAGE_PENDING, now, path)
+                    )
+                    self._conn.execute("DELETE FROM batch_requests WHERE path=?", (path,))
+            self._conn.commit()
+    
+    def get(self, file):
+        """获取文件的日志记录，不存在时返回None"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM items WHERE path=?", (str(file),)).fetchone()
+        return dict(row) if row else None
+    
+    def mark_ocr_done(self, file, content):
+        """记录文件内容已读取(OCR完成)"""
+        self._execute(
+            "UPDATE items SET stage=?, content=?, error=NULL, updated_at=? WHERE path=?",
+            (STAGE_OCR_DONE, content, time.time(), str(file))
+        )
+    
+    def set_encoding(self, file, encoding):
+        """缓存文本文件检测到的编码，文件内容变化后仍保留(同一文件的编码通常不变)"""
+        self._execute("UPDATE items SET encoding=? WHERE path=?", (encoding, str(file)))
+    
+    def mark_llm_done(self, file, result, key):
+        """记录AI处理完成"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE items SET stage=?, result=?, options_key=?, error=NULL, updated_at=? WHERE path=?",
+                (STAGE_LLM_DONE, result, key, time.time(), str(file))
+            )
+            self._conn.execute("DELETE FROM batch_requests WHERE path=?", (str(file),))
+            self._conn.commit()
+    
+    def mark_batch_submitted(self, batch_id, requests):
+        """记录已提交到离线批处理任务的文件
+        
+        Args:
+            batch_id: 批处理任务ID
+            requests: {custom_id: (源文件路径, 格式选项的指纹)}
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                """INSERT OR REPLACE INTO batch_requests (path, batch_id, custom_id, options_key, submitted_at)
+                   VALUES (?, ?, ?, ?, ?)""",
+                [(str(file), batch_id, str(custom_id), key, now) for custom_id, (file, key) in requests.items()]
+            )
+            self._conn.commit()
+    
+    def batch_request(self, file):
+        """获取文件所在的、尚未取得结果的离线批处理任务记录，不存在时返回None"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM batch_requests WHERE path=?", (str(file),)).fetchone()
+        return dict(row) if row else None
+    
+    def clear_batch_requests(self, files):
+        """清除文件的离线批处理任务记录(任务已结束或无法继续)，下次运行时重新提交"""
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM batch_requests WHERE path=?", [(str(file),) for file in files]
+            )
+            self._conn.commit()
+    
+    def mark_written(self, file, output_path, render_key=None):
+        """记录Markdown文件已写出
+        
+        Args:
+            file: 源文件路径
+            output_path: 输出文件路径
+            render_key: 写出时在本地应用的格式选项的指纹
+        """
+        self._execute(
+            "UPDATE items SET stage=?, output_path=?, render_key=?, error=NULL, updated_at=? WHERE path=?",
+            (STAGE_WRITTEN, str(output_path), render_key, time.time(), str(file))
+        )
+    
+    def mark_failed(self, file, failed_stage, error):
+        """记录处理失败，保留已完成阶段的中间结果以便重试"""
+        self._execute(
+            """UPDATE items SET stage=?, failed_stage=?, error=?, attempts=attempts+1,
+               updated_at=? WHERE path=?""",
+            (STAGE_FAILED, failed_stage, str(error), time.time(), str(file))
+        )
+    
+    def is_done(self, file, key, render_key=None):
+        """文件是否已按相同的格式选项处理完成且输出文件仍然存在
+        
+        Args:
+            file: 源文件路径
+            key: AI处理使用的格式选项的指纹
+            render_key: 本地应用的格式选项的指纹，提供时也必须相同
+        """
+        row = self.get(file)
+        return bool(
+            row
+            and row["stage"] == STAGE_WRITTEN
+            and row["options_key"] == key
+            and (render_key is None or row["render_key"] == render_key)
+            and row["output_path"]
+            and Path(row["output_path"]).exists()
+        )
+    
+    def reset(self, files=None):
+        """清除文件的处理记录(为None时清除全部)，下次运行时重新处理"""
+        now = time.time()
+        sql = """UPDATE items SET stage=?, failed_stage=NULL, content=NULL, result=NULL,
+                 options_key=NULL, output_path=NULL, render_key=NULL, error=NULL, attempts=0, updated_at=?"""
+        with self._lock:
+            if files is None:
+                self._conn.execute(sql, (STAGE_PENDING, now))
+                self._conn.execute("DELETE FROM batch_requests")
+            else:
+                self._conn.executemany(
+                    sql + " WHERE path=?",
+                    [(STAGE_PENDING, now, str(file)) for file in files]
+                )
+                self._conn.executemany(
+                    "DELETE FROM batch_requests WHERE path=?", [(str(file),) for file in files]
+                )
+            self._conn.commit()
+    
+    def failed_items(self):
+        """获取所有失败的记录"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path, failed_stage, error, attempts FROM items WHERE stage=? ORDER BY path",
+                (STAGE_FAILED,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+    
+    def summary(self):
+        """按阶段统计文件数量"""
+        with self._lock:
+            rows = self._conn.execute("SELECT stage, COUNT(*) AS count FROM items GROUP BY stage").fetchall()
+        return {row["stage"]: row["count"] for row in rows}
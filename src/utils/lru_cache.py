@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@File    :   lru_cache.py
+@Time    :   2025/04/03
+@Author  :   Maker 
+@Version :   1.0
+'''
+
+"""
+线程安全的LRU缓存
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """按条目数限制大小的线程安全LRU缓存"""
+    
+    def __init__(self, max_items=1000):
+        """
+        Args:
+            max_items: 最多缓存的条目数
+        """
+        self.max_items = max_items
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+    
+    def get(self, key, default=None):
+        """读取缓存，命中时将条目移到最近使用的位置"""
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+            self.misses += 1
+            return default
+    
+    def put(self, key, value):
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+    
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+    
+    def stats(self):
+        """缓存统计"""
+        with self._lock:
+            return {"size": len(self._items), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@File    :   markdown_format.py
+@Time    :   2025/04/03
+@Author  :   Maker
+@Version :   1.0
+'''
+
+"""
+Markdown格式后处理
+将模型输出解析为块级语法树(代码块、标题、列表项、引用、分隔线、段落)，再按格式选项在本地确定地改写：
+header_level(最高一级标题的级别)、list_style(有序/无序列表)和code_language(未标注语言的代码块)。
+这些选项不再发送给模型，模型结果可以与它们无关地缓存，修改选项后只需在本地重新生成输出
+"""
+
+import re
+
+
+# 在本地应用、不发送给模型的格式选项
+LOCAL_FORMAT_KEYS = ("header_level", "list_style", "code_language")
+
+_FENCE_PATTERN = re.compile(r"^(\s*)(`{3,}|~{3,})(.*)$")
+_ATX_PATTERN = re.compile(r"^( {0,3})(#{1,6})(?=[ \t]|$)(.*)$")
+_SETEXT_PATTERN = re.compile(r"^ {0,3}(=+|-+)[ \t]*$")
+_BREAK_PATTERN = re.compile(r"^ {0,3}([-*_])([ \t]*\1){2,}[ \t]*$")
+_ITEM_PATTERN = re.compile(r"^(\s*)([-*+]|\d{1,9}[.)])([ \t]+|$)(.*)$")
+_QUOTE_PATTERN = re.compile(r"^( {0,3}> ?)(.*)$")
+
+
+def split_format_options(format_options):
+    """将格式选项分为发送给模型的部分和在本地应用的部分
+
+    Args:
+        format_options: 格式选项
+    Returns:
+        tuple: (模型使用的选项, 本地应用的选项)
+    """
+    llm_options = {}
+    local_options = {}
+    for key, value in (format_options or {}).items():
+        if key in LOCAL_FORMAT_KEYS:
+            local_options[key] = value
+        else:
+            llm_options[key] = value
+    return llm_options, local_options
+
+
+def _indent_width(text):
+    return len(text.expandtabs(4)) - len(text.expandtabs(4).lstrip(" "))
+
+
+class Block:
+    """块级语法树节点
+
+    kind取值:
+        blank   空行
+        text    段落中的一行
+        heading 标题(level为级别，text为标题文字，setext为原来是否为下划线式标题)
+        item    列表项的首行(marker为列表标记，content为标记之后的内容)
+        fence   围栏代码块(lines为全部原始行，info为语言标注，closed为是否有结束行)
+        quote   引用块(children为去掉引用前缀后解析出的子节点)
+        break   分隔线
+    """
+
+    def __init__(self, kind, indent=0, **fields):
+        self.kind = kind
+        self.indent = indent
+        self.__dict__.update(fields)
+
+
+def parse_blocks(text):
+    """将Markdown文本解析为块级节点列表"""
+    return _parse_lines(text.split("\n"))
+
+
+def _parse_lines(lines):
+    blocks = []
+    index = 0
+    # 是否处于列表中：列表中以数字开头的后续行仍是列表项
+    in_list = False
+    while index < len(lines):
+        line = lines[index]
+        if blocks and blocks[-1].kind != "blank":
+            in_list = in_list and blocks[-1].kind in ("item", "text", "fence")
+        if in_list and line.strip() and blocks and blocks[-1].kind == "blank" and _indent_width(line) == 0:
+            in_list = bool(_ITEM_PATTERN.match(line))
+
+        fence = _FENCE_PATTERN.match(line)
+        if fence and not (fence.group(2)[0] == "`" and "`" in fence.group(3)):
+            # 围栏代码块：到相同字符、长度不小于开始行的结束行为止，未结束时到文末
+            indent, marks = fence.group(1), fence.group(2)
+            close = re.compile(rf"^\s*{re.escape(marks[0])}{{{len(marks)},}}[ \t]*$")
+            end = index + 1
+            while end < len(lines) and not close.match(lines[end]):
+                end += 1
+            closed = end < len(lines)
+            blocks.append(Block(
+                "fence", _indent_width(indent), info=fence.group(3).strip(),
+                lines=lines[index:end + 1 if closed else end], closed=closed
+            ))
+            index = end + 1
+            continue
+
+        if not line.strip():
+            blocks.append(Block("blank"))
+            index += 1
+            continue
+
+        quote = _QUOTE_PATTERN.match(line)
+        if quote:
+            # 连续的引用行去掉一层前缀后递归解析
+            end = index
+            inner = []
+            while end < len(lines):
+                match = _QUOTE_PATTERN.match(lines[end])
+                if not match:
+                    break
+                inner.append(match.group(2))
+                end += 1
+            blocks.append(Block("quote", children=_parse_lines(inner), prefix=quote.group(1).rstrip() + " "))
+            index = end
+            continue
+
+        heading = _ATX_PATTERN.match(line)
+        if heading:
+            title = re.sub(r"[ \t]+#+[ \t]*$|^[ \t]*#+[ \t]*$", "", heading.group(3)).strip()
+            blocks.append(Block(
+                "heading", len(heading.group(1)), level=len(heading.group(2)), text=title, setext=False, line=line
+            ))
+            index += 1
+            continue
+
+        previous = blocks[-1] if blocks else None
+        setext = _SETEXT_PATTERN.match(line)
+        if setext and previous is not None and previous.kind == "text" and previous.indent <= 3:
+            # 下划线式标题：上面连续的段落行组成标题文字
+            start = len(blocks) - 1
+            while start > 0 and blocks[start - 1].kind == "text":
+                start -= 1
+            paragraph = blocks[start:]
+            del blocks[start:]
+            blocks.append(Block(
+                "heading", 0, level=1 if setext.group(1)[0] == "=" else 2,
+                text=" ".join(block.line.strip() for block in paragraph), setext=True,
+                line="\n".join([block.line for block in paragraph] + [line])
+            ))
+            index += 1
+            continue
+
+        if _BREAK_PATTERN.match(line):
+            blocks.append(Block("break", _indent_width(line), line=line))
+            index += 1
+            continue
+
+        item = _ITEM_PATTERN.match(line)
+        if item and (in_list or not _interrupts_paragraph(item, previous)):
+            in_list = True
+            blocks.append(Block(
+                "item", _indent_width(item.group(1)), marker=item.group(2),
+                spacing=item.group(3), content=item.group(4), line=line
+            ))
+            index += 1
+            continue
+
+        blocks.append(Block("text", _indent_width(line), line=line))
+        index += 1
+    return blocks
+
+
+def _interrupts_paragraph(item, previous):
+    """段落中以数字开头的行(如“2024. 年”)不是列表项：有序列表只能以1开始打断段落，空列表项不能打断段落"""
+    if previous is None or previous.kind != "text":
+        return False
+    marker = item.group(2)
+    if not item.group(4).strip():
+        return True
+    return marker[0].isdigit() and int(marker[:-1]) != 1
+
+
+class _ListLevel:
+    """正在改写的列表中的一层：原来和改写后的标记缩进、内容缩进，以及有序编号"""
+
+    def __init__(self, old_indent, old_content, new_indent, new_content, number):
+        self.old_indent = old_indent
+        self.old_content = old_content
+        self.new_indent = new_indent
+        self.new_content = new_content
+        self.number = number
+
+
+class MarkdownFormatter:
+    """按格式选项改写Markdown"""
+
+    def __init__(self, format_options=None, restyle_lists=True):
+        """
+        Args:
+            format_options: 格式选项，只使用header_level、list_style和code_language，缺少的项不做改写
+            restyle_lists: 是否按list_style改写列表(本地转换的Word文档已保留原有的编号类型)
+        """
+        options = format_options or {}
+        try:
+            self.header_level = int(options.get("header_level")) if options.get("header_level") else None
+        except (TypeError, ValueError):
+            self.header_level = None
+        list_style = options.get("list_style") if restyle_lists else None
+        self.list_style = list_style if list_style in ("ordered", "unordered") else None
+        self.code_language = (options.get("code_language") or "").strip()
+
+    def format(self, text):
+        """改写Markdown文本"""
+        if not text:
+            return text
+        blocks = parse_blocks(text)
+        shift = 0
+        if self.header_level is not None:
+            levels = list(self._heading_levels(blocks))
+            if levels:
+                shift = self.header_level - min(levels)
+        return "\n".join(self._render(blocks, shift))
+
+    def _heading_levels(self, blocks):
+        for block in blocks:
+            if block.kind == "heading":
+                yield block.level
+            elif block.kind == "quote":
+                yield from self._heading_levels(block.children)
+
+    def _render(self, blocks, shift):
+        output = []
+        levels = []
+        previous_blank = False
+        for block in blocks:
+            if block.kind == "blank":
+                output.append("")
+                previous_blank = True
+                continue
+
+            if block.kind == "item" and self.list_style:
+                output.append(self._render_item(block, levels))
+                previous_blank = False
+                continue
+
+            # 列表中的后续内容按改写后的缩进调整；缩进不足且前面是空行时列表结束
+            delta = 0
+            if levels:
+                level = self._container(levels, block.indent)
+                if level is not None:
+                    delta = level.new_content - level.old_content
+                elif previous_blank or block.kind != "text":
+                    levels.clear()
+
+            lines = self._render_block(block, shift)
+            output.extend(self._reindent(line, delta) for line in lines)
+            previous_blank = False
+        return output
+
+    def _render_block(self, block, shift):
+        """渲染除列表项标记之外的节点，返回行列表"""
+        if block.kind == "heading":
+            if shift == 0:
+                return block.line.split("\n")
+            level = min(6, max(1, block.level + shift))
+            return [" " * block.indent + "#" * level + (" " + block.text if block.text else "")]
+        if block.kind == "fence":
+            lines = list(block.lines)
+            if not block.info and self.code_language:
+                match = _FENCE_PATTERN.match(lines[0])
+                lines[0] = match.group(1) + match.group(2) + self.code_language
+            return lines
+        if block.kind == "quote":
+            return [(block.prefix + line).rstrip() if line else block.prefix.rstrip()
+                    for line in self._render(block.children, shift)]
+        return block.line.split("\n")
+
+    def _render_item(self, block, levels):
+        """按list_style改写列表项标记，有序列表按层级重新编号，嵌套内容随标记宽度调整缩进"""
+        indent = block.indent
+        sibling = None
+        while levels and indent < levels[-1].old_content:
+            level = levels.pop()
+            if level.old_indent <= indent:
+                sibling = level
+                break
+
+        parent = levels[-1] if levels else None
+        if sibling is not None:
+            new_indent = sibling.new_indent
+            number = sibling.number + 1
+        elif parent is not None:
+            new_indent = parent.new_content + (indent - parent.old_content)
+            number = 1
+        else:
+            new_indent = indent
+            number = 1
+
+        marker = f"{number}." if self.list_style == "ordered" else "-"
+        spacing = block.spacing if block.spacing and not block.spacing.startswith("\t") else " "
+        if len(spacing) > 4:
+            spacing = " "
+        old_content = indent + len(block.marker) + len(block.spacing.expandtabs(4) or " ")
+        new_content = new_indent + len(marker) + len(spacing)
+        levels.append(_ListLevel(indent, old_content, new_indent, new_content, number))
+
+        line = " " * new_indent + marker
+        return line + spacing + block.content if block.content else line
+
+    @staticmethod
+    def _container(levels, indent):
+        """包含该缩进内容的最内层列表"""
+        for level in reversed(levels):
+            if indent >= level.old_content:
+                return level
+        return None
+
+    @staticmethod
+    def _reindent(line, delta):
+        if delta == 0 or not line.strip():
+            return line
+        if delta > 0:
+            return " " * delta + line
+        width = _indent_width(line)
+        stripped = line.expandtabs(4).lstrip(" ")
+        return " " * max(0, width + delta) + stripped
+
+
+def apply_format_options(text, format_options, restyle_lists=True):
+    """按格式选项改写Markdown文本
+
+    Args:
+        text: Markdown文本(通常为模型输出)
+        format_options: 格式选项
+        restyle_lists: 是否按list_style改写列表
+    Returns:
+        str: 改写后的文本
+    """
+    return MarkdownFormatter(format_options, restyle_lists).format(text)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@File    :   pipeline_metrics.py
+@Time    :   2025/04/03
+@Author  :   Maker 
+@Version :   1.0
+'''
+
+"""
+流水线指标统计
+记录各处理阶段(读取/OCR、AI处理、写出)的耗时样本、处理数量和在途数量，
+提供分位数延迟、滑动窗口吞吐量和剩余时间预估，供服务模式的健康检查接口和批处理面板使用
+"""
+
+import time
+import bisect
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+
+def percentile(sorted_samples, percent):
+    """计算已排序样本的分位数，没有样本时返回None"""
+    if not sorted_samples:
+        return None
+    index = min(len(sorted_samples) - 1, int(len(sorted_samples) * percent / 100))
+    return sorted_samples[index]
+
+
+class StageStats:
+    """单个阶段的统计数据"""
+    
+    def __init__(self, max_samples=1000):
+        self.samples = deque(maxlen=max_samples)
+        # 最近完成(含失败)任务的时间，用于计算吞吐量
+        self.finished_at = deque(maxlen=max_samples)
+        self.completed = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.total_seconds = 0.0
+
+
+class PipelineMetrics:
+    """线程安全的流水线指标"""
+    
+    def __init__(self, max_samples=1000, rate_window=60.0):
+        """
+        Args:
+            max_samples: 每个阶段保留的最近耗时样本数
+            rate_window: 计算吞吐量的滑动窗口(秒)
+        """
+        self.max_samples = max_samples
+        self.rate_window = rate_window
+        self.started_at = time.time()
+        self._started_monotonic = time.monotonic()
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._gauges = {}
+    
+    def _stage(self, name):
+        stage = self._stages.get(name)
+        if stage is None:
+            stage = self._stages[name] = StageStats(self.max_samples)
+        return stage
+    
+    def begin(self, name):
+        """标记某阶段开始处理一个任务"""
+        with self._lock:
+            self._stage(name).in_flight += 1
+    
+    def end(self, name, seconds, success=True):
+        """标记某阶段完成一个任务"""
+        with self._lock:
+            stage = self._stage(name)
+            stage.in_flight = max(0, stage.in_flight - 1)
+            stage.finished_at.append(time.monotonic())
+            if success:
+                stage.completed += 1
+                stage.samples.append(seconds)
+                stage.total_seconds += seconds
+            else:
+                stage.failed += 1
+    
+    @contextmanager
+    def measure(self, name):
+        """计时上下文：with metrics.measure("llm"): ..."""
+        self.begin(name)
+        start = time.monotonic()
+        success = False
+        try:
+            yield
+            success = True
+        finally:
+            self.end(name, time.monotonic() - start, success)
+    
+    def set_gauge(self, name, value):
+        """设置瞬时指标(如队列长度)"""
+        with self._lock:
+            self._gauges[name] = value
+    
+    def _throughput(self, stage, now):
+        """滑动窗口内每秒完成的任务数，刚开始时按开始以来的时间计算"""
+        if not stage.finished_at:
+            return None
+        window_start = now - self.rate_window
+        count = len(stage.finished_at) - bisect.bisect_left(stage.finished_at, window_start)
+        span = min(self.rate_window, now - self._started_monotonic)
+        return count / span if span > 0 else None
+    
+    def throughput(self, name):
+        """某阶段的吞吐量(个/秒)，还没有完成的任务时返回None"""
+        with self._lock:
+            stage = self._stages.get(name)
+            return self._throughput(stage, time.monotonic()) if stage else None
+    
+    def eta(self, remaining, name="total"):
+        """按实测吞吐量估计处理剩余任务所需的时间(秒)，无法估计时返回None
+        
+        Args:
+            remaining: 剩余任务数
+            name: 用于估计的阶段，默认为完整处理一个文件的"total"阶段
+        """
+        if remaining <= 0:
+            return 0.0
+        rate = self.throughput(name)
+        return remaining / rate if rate else None
+    
+    def snapshot(self):
+        """获取当前所有指标"""
+        with self._lock:
+            now = time.monotonic()
+            stages = {}
+            for name, stage in self._stages.items():
+                samples = sorted(stage.samples)
+                stages[name] = {
+                    "completed": stage.completed,
+                    "failed": stage.failed,
+                    "in_flight": stage.in_flight,
+                    "p50": percentile(samples, 50),
+                    "p95": percentile(samples, 95),
+                    "avg": stage.total_seconds / stage.completed if stage.completed else None,
+                    "throughput": self._throughput(stage, now)
+                }
+            return {
+                "uptime": time.time() - self.started_at,
+                "stages": stages,
+                "gauges": dict(self._gauges)
+            }
@@ -0,0 +1,379 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@File    :   settings_service.py
+@Time    :   2025/04/03
+@Author  :   Maker
+@Version :   1.0
+'''
+
+"""
+设置服务
+settings.json只在启动(或手动重新加载)时解析一次，之后以不可变的快照提供给各模块；
+修改设置时生成新快照，按变化的键通知订阅者，并延迟合并后原子地写回文件
+"""
+
+import os
+import json
+import atexit
+import threading
+from pathlib import Path
+from types import MappingProxyType
+
+
+# 默认设置文件
+SETTINGS_FILE = Path(__file__).resolve().parent.parent.parent / "settings.json"
+
+# 默认提示词模板
+DEFAULT_PROMPT_TEMPLATE = "请将以下笔记内容转换为Markdown格式:\n\n"
+
+# 模型相关的键
+MODEL_KEYS = ("MODELS", "CUSTOM_MODEL", "CUSTOM_BASE_URL", "CUSTOM_API_KEY")
+
+# OCR相关的键
+OCR_KEYS = (
+    "OCR_API_TYPE", "OCR_LANGUAGE", "OCR_TIMEOUT", "OCR_FRAME_WORKERS",
+    "BAIDU_APP_ID", "BAIDU_API_KEY", "BAIDU_SECRET_KEY", "BAIDU_OCR_TOKEN",
+    "TENCENT_SECRET_ID", "TENCENT_SECRET_KEY", "TENCENT_REGION",
+    "CUSTOM_OCR_ENDPOINT", "CUSTOM_OCR_KEY",
+    "LOCAL_OCR_ENGINE", "LOCAL_OCR_WORKERS",
+)
+
+# 设置文件中没有时可以从环境变量读取的键(只在加载时读取一次)
+ENV_KEYS = ("CUSTOM_MODEL", "CUSTOM_BASE_URL", "CUSTOM_API_KEY", "PROMPT_TEMPLATE") + OCR_KEYS
+
+
+def _freeze(value):
+    """将字典和列表转换为只读的映射和元组"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _thaw(value):
+    """将只读的映射和元组还原为可修改(可写入JSON)的字典和列表"""
+    if isinstance(value, (dict, MappingProxyType)):
+        return {key: _thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [_thaw(item) for item in value]
+    return value
+
+
+def _to_int(value, default):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class Settings:
+    """不可变的设置快照，可在多个线程之间共享"""
+
+    __slots__ = ("_data", "version", "env_keys")
+
+    def __init__(self, data=None, version=0, env_keys=()):
+        """
+        Args:
+            data: 设置字典
+            version: 快照版本号，每次修改加1
+            env_keys: 值来自环境变量的键，写回设置文件时不包含这些项
+        """
+        object.__setattr__(self, "_data", _freeze(dict(data or {})))
+        object.__setattr__(self, "version", version)
+        object.__setattr__(self, "env_keys", frozenset(env_keys))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Settings快照不可修改，请使用SettingsService.update")
+
+    def get(self, key, default=None):
+        """获取设置项，值为空时返回默认值"""
+        value = self._data.get(key)
+        return default if value in (None, "") else value
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def keys(self):
+        return self._data.keys()
+
+    def items(self):
+        return self._data.items()
+
+    def to_dict(self, include_environment=True):
+        """转换为可修改的字典(深复制)
+
+        Args:
+            include_environment: 是否包含值来自环境变量的项，写回设置文件时为False，避免把密钥等写入文件
+        """
+        data = _thaw(self._data)
+        if not include_environment:
+            for key in self.env_keys:
+                data.pop(key, None)
+        return data
+
+    @property
+    def models(self):
+        """模型配置 {model_id: model_info}，兼容旧版的单模型配置"""
+        models = self._data.get("MODELS")
+        if models:
+            return models
+        if self.get("CUSTOM_MODEL") or self.get("CUSTOM_BASE_URL") or self.get("CUSTOM_API_KEY"):
+            return _freeze({
+                "default_model": {
+                    "id": "default_model",
+                    "name": self.get("CUSTOM_MODEL", "默认模型"),
+                    "display_name": "默认模型",
+                    "base_url": self.get("CUSTOM_BASE_URL", ""),
+                    "api_key": self.get("CUSTOM_API_KEY", ""),
+                }
+            })
+        return MappingProxyType({})
+
+    @property
+    def default_model(self):
+        """默认模型的配置(第一个模型)，没有配置模型时为空映射"""
+        models = self.models
+        return next(iter(models.values())) if models else MappingProxyType({})
+
+    @property
+    def prompt_template(self):
+        return self.get("PROMPT_TEMPLATE", DEFAULT_PROMPT_TEMPLATE)
+
+    @property
+    def ocr_api_type(self):
+        return self.get("OCR_API_TYPE", "CUSTOM")
+
+    def ocr_config(self):
+        """OCR处理器使用的配置，数值项已转换为整数
+
+        Returns:
+            dict: OCR配置
+        """
+        api_type = self.ocr_api_type
+        config = {"OCR_API_TYPE": api_type}
+        if api_type == "BAIDU":
+            for key in ("BAIDU_APP_ID", "BAIDU_API_KEY", "BAIDU_SECRET_KEY", "BAIDU_OCR_TOKEN"):
+                config[key] = self.get(key, "")
+        elif api_type == "TENCENT":
+            config["TENCENT_SECRET_ID"] = self.get("TENCENT_SECRET_ID", "")
+            config["TENCENT_SECRET_KEY"] = self.get("TENCENT_SECRET_KEY", "")
+            config["TENCENT_REGION"] = self.get("TENCENT_REGION", "ap-beijing")
+        elif api_type == "LOCAL":
+            config["LOCAL_OCR_ENGINE"] = self.get("LOCAL_OCR_ENGINE", "rapidocr")
+            config["LOCAL_OCR_WORKERS"] = _to_int(self.get("LOCAL_OCR_WORKERS"), 0)
+            config["OCR_LANGUAGE"] = self.get("OCR_LANGUAGE", "zh")
+            config["OCR_TIMEOUT"] = _to_int(self.get("OCR_TIMEOUT"), 120)
+        else:  # CUSTOM
+            config["CUSTOM_OCR_ENDPOINT"] = self.get("CUSTOM_OCR_ENDPOINT", "")
+            config["CUSTOM_OCR_KEY"] = self.get("CUSTOM_OCR_KEY", "")
+            config["OCR_LANGUAGE"] = self.get("OCR_LANGUAGE", "zh")
+            config["OCR_TIMEOUT"] = _to_int(self.get("OCR_TIMEOUT"), 30)
+        config["OCR_FRAME_WORKERS"] = _to_int(self.get("OCR_FRAME_WORKERS"), 8)
+        return config
+
+
+class SettingsService:
+    """设置服务，线程安全"""
+
+    def __init__(self, path=None, save_delay=0.5, use_environment=True):
+        """
+        Args:
+            path: 设置文件路径，为None时使用项目根目录下的settings.json
+            save_delay: 修改后延迟写入文件的时间(秒)，期间的多次修改合并为一次写入
+            use_environment: 设置文件中没有的项是否从环境变量读取
+        """
+        self.path = Path(path) if path else SETTINGS_FILE
+        self.save_delay = save_delay
+        self.use_environment = use_environment
+        self._lock = threading.RLock()
+        self._snapshot = None
+        self._subscribers = []
+        self._save_timer = None
+        self._dirty = False
+
+    def snapshot(self):
+        """当前的设置快照(首次调用时加载设置文件)"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    data, env_keys = self._read()
+                    self._snapshot = Settings(data, 0, env_keys)
+                snapshot = self._snapshot
+        return snapshot
+
+    def _read(self):
+        """读取设置文件，文件不存在或读取失败时返回空字典
+
+        Returns:
+            tuple: (设置字典, 值来自环境变量的键)
+        """
+        data = {}
+        try:
+            if self.path.exists():
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+        except Exception as e:
+            print(f"加载配置文件时出错: {e}")
+            data = {}
+        env_keys = set()
+        if self.use_environment:
+            for key in ENV_KEYS:
+                if data.get(key) in (None, "") and os.environ.get(key):
+                    data[key] = os.environ[key]
+                    env_keys.add(key)
+        return data, env_keys
+
+    def reload(self):
+        """重新读取设置文件，变化的项会通知订阅者
+
+        Returns:
+            Settings: 新的设置快照
+        """
+        with self._lock:
+            # 先写入尚未保存的修改，避免被重新读取的内容覆盖
+            self.flush()
+            old = self.snapshot()
+            data, env_keys = self._read()
+            new = Settings(data, old.version + 1, env_keys)
+            self._snapshot = new
+        self._publish(old, new)
+        return new
+
+    def update(self, changes=None, save=True, **kwargs):
+        """修改设置
+
+        Args:
+            changes: 要修改的设置项字典，值为None时删除该项
+            save: 是否(延迟)写入设置文件
+            kwargs: 以关键字参数给出的设置项
+        Returns:
+            Settings: 新的设置快照，没有变化时返回原快照
+        """
+        changes = dict(changes or {}, **kwargs)
+        with self._lock:
+            old = self.snapshot()
+            data = old.to_dict()
+            env_keys = set(old.env_keys)
+            for key, value in changes.items():
+                if value is None:
+                    data.pop(key, None)
+                    env_keys.discard(key)
+                elif data.get(key) != value:
+                    # 修改过的项不再来自环境变量，需要写入设置文件
+                    data[key] = value
+                    env_keys.discard(key)
+            new = Settings(data, old.version + 1, env_keys)
+            if not self._changed_keys(old, new):
+                return old
+            self._snapshot = new
+            if save:
+                self._schedule_save()
+        self._publish(old, new)
+        return new
+
+    @staticmethod
+    def _changed_keys(old, new):
+        keys = set(old.keys()) | set(new.keys())
+        return {key for key in keys if _thaw(old._data.get(key)) != _thaw(new._data.get(key))}
+
+    def subscribe(self, callback, keys=None):
+        """订阅设置变化
+
+        Args:
+            callback: 回调函数 callback(settings, changed_keys)，在修改设置的线程中调用
+            keys: 只关心的键，为None时任何变化都通知
+        Returns:
+            callback，便于之后取消订阅
+        """
+        with self._lock:
+            self._subscribers.append((callback, frozenset(keys) if keys else None))
+        return callback
+
+    def unsubscribe(self, callback):
+        """取消订阅"""
+        with self._lock:
+            self._subscribers = [item for item in self._subscribers if item[0] is not callback]
+
+    def _publish(self, old, new):
+        changed = self._changed_keys(old, new)
+        if not changed:
+            return
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback, keys in subscribers:
+            if keys is not None and not (keys & changed):
+                continue
+            try:
+                callback(new, changed)
+            except Exception as e:
+                print(f"设置变化通知出错: {e}")
+
+    def _schedule_save(self):
+        self._dirty = True
+        if self._save_timer is not None:
+            self._save_timer.cancel()
+        self._save_timer = threading.Timer(self.save_delay, self._save_in_background)
+        self._save_timer.daemon = True
+        self._save_timer.start()
+
+    def _save_in_background(self):
+        try:
+            self.flush()
+        except SettingsError as e:
+            print(e)
+
+    def flush(self):
+        """立即写入尚未保存的修改"""
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            if not self._dirty:
+                return
+            self._dirty = False
+            self._write(self._snapshot)
+
+    def _write(self, snapshot):
+        """原子地写入设置文件：先写临时文件再替换，写入中断也不会损坏原文件"""
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = self.path.with_name(f"{self.path.name}.tmp")
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(snapshot.to_dict(include_environment=False), f, ensure_ascii=False, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+            print(f"设置已保存到: {self.path}")
+        except Exception as e:
+            self._dirty = True
+            raise SettingsError(f"保存设置到文件时出错: {e}") from e
+
+
+class SettingsError(Exception):
+    """设置读写错误"""
+    pass
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_settings_service():
+    """获取全局设置服务实例，程序退出时写入尚未保存的修改"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = SettingsService()
+            atexit.register(_service.flush)
+        return _service
+
+
+def get_settings():
+    """获取当前的设置快照"""
+    return get_settings_service().snapshot()
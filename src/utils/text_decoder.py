@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@File    :   text_decoder.py
+@Time    :   2025/04/03
+@Author  :   Maker
+@Version :   1.0
+'''
+
+"""
+文本文件编码检测与解码
+只读取文件开头的一段样本判断编码，之后整个文件只读取、解码一次；
+大文件使用内存映射，避免先复制一份完整的字节串。另外提供增量解码，供流式处理使用
+"""
+
+import mmap
+import codecs
+from pathlib import Path
+
+
+# 用于检测编码的样本大小
+SAMPLE_SIZE = 64 * 1024
+
+# 超过该大小的文件使用内存映射读取
+MMAP_THRESHOLD = 8 * 1024 * 1024
+
+# 无BOM且不是UTF-8时依次尝试的编码，GB18030兼容GBK/GB2312
+FALLBACK_ENCODINGS = ["gb18030", "big5"]
+
+BOMS = [
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+
+# 中文为主的UTF-16文本中，字符高字节常见的取值：常用汉字(U+4E00-U+9FFF)、中文标点(U+3000-U+303F)、
+# 全角字符(U+FF00-U+FFEF)以及换行、空格等ASCII字符
+_CJK_HIGH_BYTES = bytes(range(0x4E, 0xA0))
+_COMMON_HIGH_BYTES = _CJK_HIGH_BYTES + b"\x00\x30\xff"
+
+
+def _decode_sample(sample, encoding, is_complete):
+    """严格解码样本，失败时返回None"""
+    decoder = codecs.getincrementaldecoder(encoding)(errors="strict")
+    try:
+        return decoder.decode(sample, final=is_complete)
+    except (UnicodeDecodeError, LookupError):
+        return None
+
+
+def _decodes(sample, encoding, is_complete):
+    """样本能否按指定编码严格解码；样本被截断时允许末尾有不完整的多字节字符"""
+    return _decode_sample(sample, encoding, is_complete) is not None
+
+
+def _guess_utf16(sample, is_complete=False):
+    """无BOM的UTF-16
+
+    ASCII为主的文本：高字节为0，零字节集中在奇数或偶数位置；
+    中文为主的文本：不是有效的UTF-8，一侧的字节几乎都是汉字、中文标点、全角字符或ASCII字符的高字节，
+    且按该字节序解码后几乎没有控制字符
+    """
+    if len(sample) < 4:
+        return None
+    even_zeros = sample[0::2].count(0)
+    odd_zeros = sample[1::2].count(0)
+    half = len(sample) // 2
+    if odd_zeros > half * 0.3 and even_zeros < half * 0.05:
+        return "utf-16-le"
+    if even_zeros > half * 0.3 and odd_zeros < half * 0.05:
+        return "utf-16-be"
+
+    # 英文等ASCII文本两侧字节都在汉字高字节的范围内，但它们总是有效的UTF-8
+    if _decodes(sample, "utf-8", is_complete):
+        return None
+    for encoding, high in (("utf-16-le", sample[1::2]), ("utf-16-be", sample[0::2])):
+        cjk = len(high) - len(high.translate(None, _CJK_HIGH_BYTES))
+        common = len(high) - len(high.translate(None, _COMMON_HIGH_BYTES))
+        if cjk < len(high) * 0.3 or common < len(high) * 0.9:
+            continue
+        text = _decode_sample(sample, encoding, is_complete)
+        if text is None:
+            continue
+        controls = sum(1 for char in text if char < " " and char not in "\r\n\t")
+        if controls <= len(text) * 0.01:
+            return encoding
+    return None
+
+
+def detect_encoding(sample, is_complete=False):
+    """根据字节样本检测编码
+
+    Args:
+        sample: 文件开头的字节样本
+        is_complete: 样本是否为完整文件
+    Returns:
+        str: 编码名称
+    """
+    for bom, encoding in BOMS:
+        if sample.startswith(bom):
+            return encoding
+
+    utf16 = _guess_utf16(sample, is_complete)
+    if utf16 and _decodes(sample, utf16, is_complete):
+        return utf16
+
+    if _decodes(sample, "utf-8", is_complete):
+        return "utf-8"
+
+    candidates = [encoding for encoding in FALLBACK_ENCODINGS if _decodes(sample, encoding, is_complete)]
+    if len(candidates) > 1:
+        # GB18030、Big5等双字节编码经常都能解码成功，
+        # 安装了charset_normalizer(requests的依赖)时用它在这些候选中选出最合理的一个
+        try:
+            from charset_normalizer import from_bytes
+            best = from_bytes(sample, cp_isolation=candidates).best()
+            if best is not None and codecs.lookup(best.encoding).name in [codecs.lookup(c).name for c in candidates]:
+                return best.encoding
+        except ImportError:
+            pass
+    return candidates[0] if candidates else "gb18030"
+
+
+def _normalize_newlines(text):
+    """与文本模式open()一致，统一换行符为\\n"""
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+def _decode_buffer(buffer, encoding):
+    """严格解码整个缓冲区(bytes或mmap)，不额外复制数据"""
+    text, _ = codecs.lookup(encoding).decode(memoryview(buffer), "strict")
+    return text
+
+
+def read_text(file_path, encoding=None):
+    """读取文本文件，整个文件只读取一次
+
+    Args:
+        file_path: 文件路径
+        encoding: 已知的编码(如之前检测并缓存的结果)，为None时自动检测
+    Returns:
+        tuple: (文本内容, 实际使用的编码)
+    """
+    path = Path(file_path)
+    size = path.stat().st_size
+    if size == 0:
+        return "", encoding or "utf-8"
+
+    with open(path, "rb") as f:
+        if size > MMAP_THRESHOLD:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            buffer = f.read()
+
+        try:
+            # 已知编码能解码时无需检测
+            if encoding:
+                try:
+                    return _normalize_newlines(_decode_buffer(buffer, encoding)), encoding
+                except (UnicodeDecodeError, LookupError):
+                    pass
+
+            detected = detect_encoding(buffer[:SAMPLE_SIZE], is_complete=size <= SAMPLE_SIZE)
+            # 样本之后才出现的字符可能不符合样本检测出的编码，依次尝试其他编码
+            candidates = [detected, "utf-8"] + FALLBACK_ENCODINGS
+
+            tried = set()
+            for candidate in candidates:
+                key = codecs.lookup(candidate).name
+                if key in tried:
+                    continue
+                tried.add(key)
+                try:
+                    return _normalize_newlines(_decode_buffer(buffer, candidate)), candidate
+                except UnicodeDecodeError:
+                    continue
+
+            # 都无法严格解码，按检测结果解码并替换无效字节
+            text, _ = codecs.lookup(detected).decode(memoryview(buffer), "replace")
+            return _normalize_newlines(text), detected
+        finally:
+            if isinstance(buffer, mmap.mmap):
+                buffer.close()
+
+
+def iter_text(file_path, encoding=None, chunk_size=1024 * 1024):
+    """增量读取并解码文本文件，逐块返回文本，适合流式处理超大文件
+
+    Args:
+        file_path: 文件路径
+        encoding: 已知的编码，为None时根据文件开头的样本检测
+        chunk_size: 每次读取的字节数
+    Yields:
+        str: 解码后的文本块(多字节字符和\\r\\n不会被拆开)
+    """
+    with open(file_path, "rb") as f:
+        first = f.read(max(chunk_size, SAMPLE_SIZE))
+        if encoding is None:
+            encoding = detect_encoding(first[:SAMPLE_SIZE], is_complete=len(first) < SAMPLE_SIZE)
+
+        decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        pending_cr = False
+        data = first
+        while True:
+            final = not data
+            text = decoder.decode(data, final=final)
+            if pending_cr:
+                text = "\r" + text
+                pending_cr = False
+            # 末尾的\r可能与下一块开头的\n组成\r\n，留到下一块处理
+            if text.endswith("\r") and not final:
+                text = text[:-1]
+                pending_cr = True
+            if text:
+                yield _normalize_newlines(text)
+            if final:
+                return
+            data = f.read(chunk_size)
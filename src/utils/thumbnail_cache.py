@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@File    :   thumbnail_cache.py
+@Time    :   2025/04/03
+@Author  :   Maker
+@Version :   1.0
+'''
+
+"""
+图片缩略图缓存
+缩略图解码时利用Pillow的draft/reduce只解码所需的分辨率，大图也只需很短时间；
+生成的缩略图按文件内容哈希缓存在内存(LRU)和磁盘中，文件移动或改名后仍可复用
+"""
+
+import os
+import hashlib
+import threading
+from pathlib import Path
+
+from PIL import Image, ImageOps
+
+from utils.lru_cache import LRUCache
+
+
+# 默认磁盘缓存目录
+DEFAULT_CACHE_DIR = Path(__file__).resolve().parent.parent.parent / ".thumbnails"
+
+
+def make_thumbnail(image_path, size):
+    """生成缩略图
+
+    Args:
+        image_path: 图片路径
+        size: 缩略图最大边长(像素)
+    Returns:
+        Image: RGBA格式的缩略图
+    """
+    with Image.open(image_path) as img:
+        # JPEG在解码时直接按1/2、1/4、1/8缩小，其余格式由thumbnail先用reduce整数倍缩小再精细缩放
+        img.draft("RGB", (size * 2, size * 2))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((size, size), Image.LANCZOS, reducing_gap=2.0)
+        return img.convert("RGBA")
+
+
+def file_digest(file_path, chunk_size=1024 * 1024):
+    """计算文件内容的SHA-256"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ThumbnailCache:
+    """缩略图缓存，线程安全"""
+
+    def __init__(self, cache_dir=None, max_items=256):
+        """
+        Args:
+            cache_dir: 磁盘缓存目录，为None时使用项目目录下的.thumbnails
+            max_items: 内存中最多缓存的缩略图数
+        """
+        self.cache_dir = Path(cache_dir) if cache_dir else DEFAULT_CACHE_DIR
+        self.memory = LRUCache(max_items)
+        self._lock = threading.Lock()
+        # 路径 -> (大小, 修改时间, 内容哈希)，文件未变化时无需重新计算哈希
+        self._digests = {}
+
+    def digest(self, image_path):
+        """获取文件内容哈希，文件大小和修改时间未变化时使用之前的结果"""
+        path = os.fspath(image_path)
+        stat = os.stat(path)
+        with self._lock:
+            cached = self._digests.get(path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime:
+            return cached[2]
+        value = file_digest(path)
+        with self._lock:
+            self._digests[path] = (stat.st_size, stat.st_mtime, value)
+        return value
+
+    def _disk_path(self, digest, size):
+        return self.cache_dir / digest[:2] / f"{digest}_{size}.png"
+
+    def get(self, image_path, size=128):
+        """获取缩略图：依次查找内存缓存、磁盘缓存，都没有时解码生成
+
+        Args:
+            image_path: 图片路径
+            size: 缩略图最大边长(像素)
+        Returns:
+            Image: RGBA格式的缩略图
+        """
+        digest = self.digest(image_path)
+        key = (digest, size)
+        thumbnail = self.memory.get(key)
+        if thumbnail is not None:
+            return thumbnail
+
+        disk_path = self._disk_path(digest, size)
+        thumbnail = None
+        if disk_path.exists():
+            try:
+                with Image.open(disk_path) as cached:
+                    thumbnail = cached.convert("RGBA")
+            except OSError:
+                thumbnail = None
+
+        if thumbnail is None:
+            thumbnail = make_thumbnail(image_path, size)
+            try:
+                disk_path.parent.mkdir(parents=True, exist_ok=True)
+                # 先写临时文件再改名，避免其他线程读到不完整的文件
+                temp_path = disk_path.with_name(f"{disk_path.name}.{threading.get_ident()}.tmp")
+                thumbnail.save(temp_path, "PNG", compress_level=1)
+                os.replace(temp_path, disk_path)
+            except OSError as e:
+                print(f"保存缩略图缓存失败: {e}")
+
+        self.memory.put(key, thumbnail)
+        return thumbnail
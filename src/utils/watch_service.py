@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@File    :   watch_service.py
+@Time    :   2025/04/03
+@Author  :   Maker 
+@Version :   1.0
+'''
+
+"""
+监视模式服务
+长时间运行，监视笔记文件夹，把新增或修改的文件送入 读取(OCR) → AI处理 → 写出 流水线。
+文件变化经过防抖后进入有界队列，队列满时监视器暂停投递(背压)，由固定数量的工作线程处理
+"""
+
+import queue
+import threading
+from pathlib import Path
+
+from utils.file_handler import FileHandler
+from utils.batch_pipeline import BatchPipeline
+from utils.job_journal import JobJournal
+from utils.folder_watcher import FolderWatcher
+from utils.docx_markdown import DOCX_MODE_AUTO
+from ocr.image_dedup import ImageDeduplicator
+
+
+class WatchService:
+    """监视文件夹并增量转换的服务"""
+    
+    def __init__(self, folders, processor, format_options, workers=2, queue_size=100,
+                 debounce=2.0, poll_interval=1.0, use_native=True, dedup_distance=None,
+                 docx_mode=DOCX_MODE_AUTO, log=print):
+        """
+        Args:
+            folders: 要监视的文件夹列表，每个文件夹的输出保存在其markdown_output子文件夹中
+            processor: AI处理器(CustomProcessor或ModelRouter)
+            format_options: 格式选项
+            workers: 工作线程数
+            queue_size: 待处理队列的最大长度
+            debounce: 防抖时间(秒)
+            poll_interval: 轮询模式下的扫描间隔(秒)
+            use_native: 是否尝试使用系统文件事件(watchdog)
+            dedup_distance: 重复图片去重的候选汉明距离阈值，为None时不去重
+            docx_mode: Word文档的处理方式(DOCX_MODE_*)
+            log: 日志输出函数
+        """
+        self.folders = [Path(folder).resolve() for folder in folders]
+        self.workers = max(1, workers)
+        self.log = log
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self._stop_event = threading.Event()
+        self._threads = []
+        
+        # 每个监视的文件夹使用独立的输出目录和任务日志
+        self.pipelines = {}
+        for folder in self.folders:
+            output_folder = folder / "markdown_output"
+            journal = JobJournal(output_folder / ".job_journal.db")
+            deduplicator = None
+            if dedup_distance is not None:
+                deduplicator = ImageDeduplicator(output_folder / ".image_hashes.db", max_distance=dedup_distance)
+            self.pipelines[folder] = BatchPipeline(
+                processor, format_options, output_folder, journal, source_root=folder,
+                deduplicator=deduplicator, docx_mode=docx_mode
+            )
+        
+        self.watcher = FolderWatcher(
+            self.folders,
+            self._enqueue,
+            FileHandler.SUPPORTED_TEXT_FORMATS + FileHandler.SUPPORTED_IMAGE_FORMATS,
+            debounce=debounce,
+            poll_interval=poll_interval,
+            use_native=use_native
+        )
+        
+        self.processed_count = 0
+        self.failed_count = 0
+        self._count_lock = threading.Lock()
+    
+    def _enqueue(self, path):
+        """将稳定的文件放入队列，队列已满时阻塞(背压)"""
+        while not self._stop_event.is_set():
+            try:
+                self.queue.put(path, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+    
+    def _pipeline_for(self, path):
+        """找到文件所属监视文件夹的流水线"""
+        for folder, pipeline in self.pipelines.items():
+            try:
+                path.relative_to(folder)
+                return pipeline
+            except ValueError:
+                continue
+        return None
+    
+    def _worker_loop(self):
+        """工作线程：从队列中取出文件并转换"""
+        while not self._stop_event.is_set():
+            try:
+                path = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            
+            try:
+                pipeline = self._pipeline_for(path)
+                if pipeline is None or not path.exists():
+                    continue
+                
+                # 登记文件，内容已变化的文件会清空旧的中间结果
+                pipeline.journal.register([path])
+                if pipeline.is_done(path):
+                    continue
+                
+                output_file = pipeline.convert_file(path)
+                with self._count_lock:
+                    self.processed_count += 1
+                self.log(f"已转换: {path} -> {output_file}")
+            except Exception as e:
+                with self._count_lock:
+                    self.failed_count += 1
+                self.log(f"转换失败: {path}: {e}")
+            finally:
+                self.queue.task_done()
+    
+    def start(self, process_existing=True):
+        """启动监视和工作线程
+        Args:
+            process_existing: 启动时是否处理文件夹中尚未转换的已有文件
+        """
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        
+        self.watcher.start(process_existing=process_existing)
+        backend = "系统文件事件" if self.watcher.backend == "native" else "轮询"
+        self.log(f"开始监视 {len(self.folders)} 个文件夹 (方式: {backend}, 工作线程: {self.workers})")
+    
+    def stop(self):
+        """停止服务：等待正在转换的文件完成后再关闭任务日志，队列中其余的文件下次启动时处理"""
+        self._stop_event.set()
+        self.watcher.stop()
+        # 工作线程在两个文件之间检查停止标志；不设超时，避免正在等待模型结果的转换在日志关闭后失败
+        for thread in self._threads:
+            thread.join()
+        for pipeline in self.pipelines.values():
+            pipeline.journal.close()
+            if pipeline.deduplicator is not None:
+                pipeline.deduplicator.close()
+    
+    def run_forever(self, process_existing=True):
+        """启动服务并阻塞运行，直到按下Ctrl+C"""
+        self.start(process_existing=process_existing)
+        try:
+            while not self._stop_event.wait(1.0):
+                pass
+        except KeyboardInterrupt:
+            self.log("正在停止监视...")
+        finally:
+            self.stop()
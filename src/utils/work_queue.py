@@ -0,0 +1,391 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+@File    :   work_queue.py
+@Time    :   2025/04/03
+@Author  :   Maker
+@Version :   1.0
+'''
+
+"""
+分布式批处理
+协调端扫描文件夹，把待转换的文件写入共享的任务队列(放在共享存储上的SQLite文件)，
+多台机器上的工作进程从队列中领取任务，完成 读取(OCR) → AI处理 → 写出 后回写状态。
+
+任务以租约方式领取：工作进程定期续租，进程退出或机器宕机后租约过期，
+任务会被其他工作进程重新领取。输出文件先写临时文件再原子替换，重复执行同一任务结果不变
+"""
+
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+from pathlib import Path
+
+from utils.file_handler import FileHandler
+from utils.batch_pipeline import BatchPipeline, PipelineError
+
+
+# 任务状态
+TASK_PENDING = "pending"   # 等待领取
+TASK_LEASED = "leased"     # 已被工作进程领取(租约过期后可被重新领取)
+TASK_DONE = "done"         # 已完成
+TASK_FAILED = "failed"     # 重试次数用尽
+
+
+class WorkQueue:
+    """基于SQLite文件的共享任务队列，可被多个进程(包括其他机器上的进程)同时访问"""
+
+    def __init__(self, db_path, lease_seconds=300.0, max_attempts=3):
+        """
+        Args:
+            db_path: 队列数据库文件路径，多机使用时应放在所有机器都能访问的共享存储上
+            lease_seconds: 租约时长(秒)，工作进程超过该时间未续租，任务即可被其他进程领取
+            max_attempts: 每个任务最多尝试的次数
+        """
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+
+        # 网络文件系统上无法使用WAL的共享内存，使用默认的回滚日志模式；
+        # 事务由代码显式控制，领取任务时用BEGIN IMMEDIATE保证多进程之间的互斥
+        self._conn = sqlite3.connect(
+            str(self.db_path), check_same_thread=False, timeout=60, isolation_level=None
+        )
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    path TEXT PRIMARY KEY,
+                    output_path TEXT NOT NULL,
+                    size INTEGER,
+                    mtime REAL,
+                    status TEXT NOT NULL,
+                    worker TEXT,
+                    lease_token TEXT,
+                    lease_until REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    updated_at REAL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks(status, lease_until)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
+
+    def set_format_options(self, format_options):
+        """保存本批任务使用的格式选项，所有工作进程使用同一份"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('format_options', ?)",
+                (json.dumps(format_options or {}, ensure_ascii=False),)
+            )
+
+    def get_format_options(self):
+        """读取协调端保存的格式选项"""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key='format_options'").fetchone()
+        return json.loads(row["value"]) if row else {}
+
+    def enqueue(self, tasks):
+        """添加任务：新文件和内容已变化的文件进入等待状态，其余保持原状态
+        Args:
+            tasks: (源文件路径, 输出文件路径) 的可迭代对象
+        Returns:
+            int: 新增或重置的任务数
+        """
+        rows = []
+        for path, output_path in tasks:
+            try:
+                stat = Path(path).stat()
+            except OSError:
+                continue
+            rows.append((str(path), str(output_path), stat.st_size, stat.st_mtime))
+
+        now = time.time()
+        count = 0
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                existing = {
+                    row["path"]: (row["size"], row["mtime"], row["output_path"])
+                    for row in self._conn.execute("SELECT path, size, mtime, output_path FROM tasks")
+                }
+                for path, output_path, size, mtime in rows:
+                    if existing.get(path) == (size, mtime, output_path):
+                        continue
+                    self._conn.execute(
+                        """INSERT OR REPLACE INTO tasks (path, output_path, size, mtime, status, attempts, updated_at)
+                           VALUES (?, ?, ?, ?, ?, 0, ?)""",
+                        (path, output_path, size, mtime, TASK_PENDING, now)
+                    )
+                    count += 1
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return count
+
+    def claim(self, worker_id, limit=1):
+        """领取任务：优先领取等待中的任务，其次是租约已过期的任务(原工作进程已失联)
+        Returns:
+            list: 任务字典列表，包含path、output_path和本次领取的lease_token
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    """SELECT path, output_path FROM tasks
+                       WHERE (status=? OR (status=? AND lease_until<?)) AND attempts<?
+                       ORDER BY status DESC, attempts, path LIMIT ?""",
+                    (TASK_PENDING, TASK_LEASED, now, self.max_attempts, limit)
+                ).fetchall()
+                tasks = []
+                for row in rows:
+                    token = uuid.uuid4().hex
+                    self._conn.execute(
+                        """UPDATE tasks SET status=?, worker=?, lease_token=?, lease_until=?,
+                           attempts=attempts+1, updated_at=? WHERE path=?""",
+                        (TASK_LEASED, worker_id, token, now + self.lease_seconds, now, row["path"])
+                    )
+                    tasks.append({"path": row["path"], "output_path": row["output_path"], "lease_token": token})
+
+                # 租约过期且已用尽重试次数的任务直接记为失败，避免永远停留在领取状态
+                self._conn.execute(
+                    "UPDATE tasks SET status=?, error=COALESCE(error, ?), updated_at=? "
+                    "WHERE status=? AND lease_until<? AND attempts>=?",
+                    (TASK_FAILED, "租约过期", now, TASK_LEASED, now, self.max_attempts)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return tasks
+
+    def renew(self, tasks):
+        """为仍持有的任务续租
+        Returns:
+            int: 续租成功的任务数(租约已被他人接管的任务不再续租)
+        """
+        until = time.time() + self.lease_seconds
+        with self._lock:
+            cursor = self._conn.executemany(
+                "UPDATE tasks SET lease_until=? WHERE path=? AND lease_token=? AND status=?",
+                [(until, task["path"], task["lease_token"], TASK_LEASED) for task in tasks]
+            )
+            return cursor.rowcount
+
+    def complete(self, task):
+        """标记任务完成。租约已被接管时也接受(输出是幂等的)，已完成的任务保持不变"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE tasks SET status=?, lease_token=NULL, error=NULL, updated_at=? WHERE path=? AND status!=?",
+                (TASK_DONE, time.time(), task["path"], TASK_DONE)
+            )
+
+    def fail(self, task, error):
+        """标记本次尝试失败：仍有重试次数时重新进入等待状态，否则记为失败。
+        租约已被其他进程接管时不做修改"""
+        with self._lock:
+            self._conn.execute(
+                """UPDATE tasks SET status=CASE WHEN attempts<? THEN ? ELSE ? END,
+                   lease_token=NULL, lease_until=NULL, error=?, updated_at=?
+                   WHERE path=? AND lease_token=?""",
+                (self.max_attempts, TASK_PENDING, TASK_FAILED, str(error), time.time(),
+                 task["path"], task["lease_token"])
+            )
+
+    def retry_failed(self):
+        """将失败的任务重新放回队列
+        Returns:
+            int: 重置的任务数
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE tasks SET status=?, attempts=0, error=NULL, updated_at=? WHERE status=?",
+                (TASK_PENDING, time.time(), TASK_FAILED)
+            )
+            return cursor.rowcount
+
+    def has_unfinished(self):
+        """是否还有等待中或正在处理的任务"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) AS count FROM tasks WHERE status IN (?, ?)", (TASK_PENDING, TASK_LEASED)
+            ).fetchone()
+        return row["count"] > 0
+
+    def summary(self):
+        """按状态统计任务数量"""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) AS count FROM tasks GROUP BY status").fetchall()
+        return {row["status"]: row["count"] for row in rows}
+
+    def failed_items(self):
+        """获取所有失败的任务"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path, error, attempts, worker FROM tasks WHERE status=? ORDER BY path", (TASK_FAILED,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+
+def scan_folder_tasks(folder, extensions=None, output_dir_name="markdown_output"):
+    """扫描文件夹生成任务，输出保存在文件夹的markdown_output子文件夹中并保持子目录结构
+    Returns:
+        list: (源文件路径, 输出文件路径) 列表
+    """
+    folder = Path(folder).resolve()
+    output_folder = folder / output_dir_name
+    extensions = set(extensions or FileHandler.SUPPORTED_TEXT_FORMATS + FileHandler.SUPPORTED_IMAGE_FORMATS)
+
+    tasks = []
+    for root, dirs, files in os.walk(folder):
+        dirs[:] = [d for d in dirs if d != output_dir_name and not d.startswith(".")]
+        for name in files:
+            file = Path(root) / name
+            if file.suffix.lower() in extensions:
+                relative_dir = file.parent.relative_to(folder)
+                tasks.append((file, output_folder / relative_dir / f"{file.stem}.md"))
+    return tasks
+
+
+class DistributedWorker:
+    """分布式工作进程：从共享队列领取任务并处理，后台线程定期为持有的任务续租"""
+
+    def __init__(self, work_queue, processor, worker_id=None, threads=1, exit_when_idle=False,
+                 poll_interval=2.0, log=print):
+        """
+        Args:
+            work_queue: 共享任务队列(WorkQueue)
+            processor: AI处理器(CustomProcessor或ModelRouter)
+            worker_id: 工作进程标识，默认为 主机名:进程号
+            threads: 本进程内的处理线程数
+            exit_when_idle: 队列中没有未完成的任务时是否退出
+            poll_interval: 没有可领取任务时的等待间隔(秒)
+            log: 日志输出函数
+        """
+        self.queue = work_queue
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.threads = max(1, threads)
+        self.exit_when_idle = exit_when_idle
+        self.poll_interval = poll_interval
+        self.log = log
+
+        # 所有工作进程使用协调端保存的格式选项，保证输出一致
+        self.pipeline = BatchPipeline(processor, self.queue.get_format_options(), ".")
+
+        self.processed_count = 0
+        self.failed_count = 0
+        self._held = {}
+        self._held_lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        """请求停止，正在处理的任务完成后退出"""
+        self._stop_event.set()
+
+    def run(self):
+        """运行直到被停止(或队列处理完毕且exit_when_idle为True)"""
+        heartbeat = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        heartbeat.start()
+
+        threads = [threading.Thread(target=self._work_loop, daemon=True) for _ in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(timeout=0.5)
+        except KeyboardInterrupt:
+            self.log("正在停止，等待当前任务完成...")
+            self.stop()
+            for thread in threads:
+                thread.join()
+        finally:
+            self._stop_event.set()
+
+        self.log(f"[{self.worker_id}] 已退出，完成 {self.processed_count} 个，失败 {self.failed_count} 个")
+
+    def _heartbeat_loop(self):
+        """以租约时长的三分之一为间隔续租"""
+        interval = max(0.5, self.queue.lease_seconds / 3)
+        while not self._stop_event.wait(interval):
+            with self._held_lock:
+                tasks = list(self._held.values())
+            if tasks:
+                try:
+                    self.queue.renew(tasks)
+                except sqlite3.Error as e:
+                    self.log(f"续租失败: {e}")
+
+    def _work_loop(self):
+        while not self._stop_event.is_set():
+            try:
+                tasks = self.queue.claim(self.worker_id)
+            except sqlite3.Error as e:
+                self.log(f"领取任务失败: {e}")
+                self._stop_event.wait(self.poll_interval)
+                continue
+
+            if not tasks:
+                if self.exit_when_idle and not self.queue.has_unfinished():
+                    return
+                # 其他进程持有的任务可能因租约过期而重新可领取，稍后再试
+                self._stop_event.wait(self.poll_interval)
+                continue
+
+            for task in tasks:
+                self._process(task)
+
+    def _process(self, task):
+        """处理单个任务"""
+        with self._held_lock:
+            self._held[task["path"]] = task
+        try:
+            content = self.pipeline.read(task["path"])
+            result = self.pipeline.transform(task["path"], content)
+            self._write_atomic(self.pipeline.render(task["path"], result), Path(task["output_path"]))
+        except PipelineError as e:
+            self.queue.fail(task, f"[{e.stage}] {e}")
+            self._count(failed=True)
+            self.log(f"[{self.worker_id}] 失败: {task['path']} ({e.stage}: {e})")
+        except Exception as e:
+            self.queue.fail(task, e)
+            self._count(failed=True)
+            self.log(f"[{self.worker_id}] 失败: {task['path']} ({e})")
+        else:
+            self.queue.complete(task)
+            self._count(failed=False)
+            self.log(f"[{self.worker_id}] 完成: {task['path']}")
+        finally:
+            with self._held_lock:
+                self._held.pop(task["path"], None)
+
+    def _write_atomic(self, result, output_file):
+        """先写入临时文件再替换，任务被重复执行或中途崩溃都不会留下不完整的输出"""
+        temp_file = output_file.with_name(f".{output_file.name}.{uuid.uuid4().hex[:8]}.tmp")
+        if not FileHandler.save_markdown_file(result, str(temp_file)):
+            raise PipelineError("write", "保存Markdown文件失败")
+        try:
+            os.replace(temp_file, output_file)
+        except OSError as e:
+            temp_file.unlink(missing_ok=True)
+            raise PipelineError("write", str(e))
+
+    def _count(self, failed):
+        with self._held_lock:
+            if failed:
+                self.failed_count += 1
+            else:
+                self.processed_count += 1